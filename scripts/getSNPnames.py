@@ -4,12 +4,10 @@
 
 import logging
 import argparse
-from functools import partial
 
-import aiohttp
 import asyncio
 
-from tskitetude.smarterapi import VariantsEndpoint, variant_worker
+from tskitetude.smarterapi import AsyncSmarterClient, VariantsEndpoint, paginate
 
 # Configure logging
 logging.basicConfig(
@@ -19,70 +17,22 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def process_response(response, all_names):
-    """Deal with the response from the API"""
-
-    # collect names
-    all_names += [item['name'] for item in response['items']]
-
-
-async def fetch_all_names(chip_name, size):
-    async with aiohttp.ClientSession() as session:
+async def fetch_all_names(chip_name, size, max_concurrency):
+    async with AsyncSmarterClient(pool_size=max_concurrency) as session:
         variant_api = VariantsEndpoint(species="Sheep", assembly="OAR3")
 
-        # collect the total number of pages
-        response = await variant_api.get_async_variants(
-            session, page=1, size=size, chip_name=chip_name)
-
-        total_items = response["total"]
-        total_pages = response["pages"]
-
-        # debug
-        # total_items = 1000
-        # total_pages = int(1000 / size)
-
-        logger.info(f"Total items: {total_items}, Total pages: {total_pages}")
-
-        # process the first page
-        all_names = [item['name'] for item in response['items']]
-
-        # create queue
-        queue = asyncio.Queue()
-
-        # Create the partial function with lock and all_names
-        process_response_with_lock = partial(process_response, all_names=all_names)
-
-        # Define the number of workers
-        num_workers = 5
-        tasks = []
-
-        # create workers
-        for i in range(num_workers):
-            task = asyncio.create_task(
-                variant_worker(
-                    queue,
-                    session,
-                    variant_api,
-                    process_response_with_lock,
-                    size,
-                    chip_name=chip_name),
-                name=f"worker-{i}"
-            )
-            tasks.append(task)
-
-        # Populate the queue with page numbers. Start with next page
-        for page in range(2, total_pages + 1):
-            await queue.put(page)
-
-        # Wait until the queue is fully processed
-        await queue.join()
-
-        # Cancel all worker tasks
-        for task in tasks:
-            task.cancel()
+        all_names = []
+        total_items = None
 
-        # Wait until all worker tasks are cancelled
-        await asyncio.gather(*tasks, return_exceptions=True)
+        # pages are fetched concurrently and returned in page order
+        async for response in paginate(
+                variant_api,
+                session,
+                size=size,
+                max_concurrency=max_concurrency,
+                chip_name=chip_name):
+            total_items = response["total"]
+            all_names += [item['name'] for item in response['items']]
 
         assert len(all_names) == total_items
         logger.info("All results have been fetched")
@@ -90,10 +40,10 @@ async def fetch_all_names(chip_name, size):
         return all_names
 
 
-async def main(chip_name="IlluminaOvineSNP50", size=50):
+async def main(chip_name="IlluminaOvineSNP50", size=50, max_concurrency=10):
     logger.info(f"Fetching SNP names for '{chip_name}'")
 
-    all_names = await fetch_all_names(chip_name, size)
+    all_names = await fetch_all_names(chip_name, size, max_concurrency)
 
     for name in all_names:
         print(name)
@@ -104,6 +54,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fetch SNP names.")
     parser.add_argument("--size", type=int, default=50, help="Size of the pages to fetch")
     parser.add_argument("--chip_name", type=str, default="IlluminaOvineSNP50", help="Chip name")
+    parser.add_argument(
+        "--max_concurrency", type=int, default=10, help="Max concurrent requests")
     args = parser.parse_args()
 
-    asyncio.run(main(chip_name=args.chip_name, size=args.size))
+    asyncio.run(
+        main(
+            chip_name=args.chip_name,
+            size=args.size,
+            max_concurrency=args.max_concurrency))
@@ -0,0 +1,100 @@
+"""
+Unit tests for breedindex.py functions
+"""
+
+import base64
+
+import numpy as np
+import pytest
+
+from tskitetude.breedindex import (
+    BREED_INDEX_KEY,
+    BreedIndex,
+    get_breed_index,
+    load_breed_index,
+    write_breed_index,
+)
+
+from .test_gnn import make_ts
+
+msprime = pytest.importorskip("msprime")
+
+
+def test_breed_index_from_tables():
+    ts = make_ts(42, 1e5, "1")
+    index = BreedIndex.from_tables(ts.tables)
+
+    assert index.breeds == ["Texel", "Frizarta"]
+    np.testing.assert_array_equal(
+        index.breed_samples("Texel"), ts.samples(population=0)
+    )
+    np.testing.assert_array_equal(
+        index.breed_samples("Frizarta"), ts.samples(population=1)
+    )
+
+    for individual in ts.individuals():
+        np.testing.assert_array_equal(
+            index.individual_nodes_of(individual.id), individual.nodes
+        )
+
+    # no stored index
+    assert load_breed_index(ts) is None
+
+
+def test_write_breed_index():
+    ts = make_ts(42, 1e5, "1")
+    tables = ts.dump_tables()
+    expected = write_breed_index(tables)
+
+    indexed = tables.tree_sequence()
+
+    # existing metadata is kept
+    assert indexed.metadata["chrom"] == "1"
+    assert BREED_INDEX_KEY in indexed.metadata
+
+    # node arrays are stored as base64 int32, not JSON lists
+    stored = indexed.metadata[BREED_INDEX_KEY]
+    assert isinstance(stored["sample_nodes"], str)
+    np.testing.assert_array_equal(
+        np.frombuffer(base64.b64decode(stored["sample_nodes"]), dtype="<i4"),
+        expected.sample_nodes,
+    )
+
+    index = load_breed_index(indexed)
+    assert index.breeds == expected.breeds
+    np.testing.assert_array_equal(index.sample_nodes, expected.sample_nodes)
+    np.testing.assert_array_equal(index.individual_offsets, expected.individual_offsets)
+
+    breeds, sample_sets = index.sample_sets()
+    assert breeds == ["Texel", "Frizarta"]
+    assert [len(nodes) for nodes in sample_sets] == [8, 6]
+
+
+def test_outdated_breed_index():
+    ts = make_ts(42, 1e5, "1")
+    tables = ts.dump_tables()
+    write_breed_index(tables)
+
+    # nodes are renumbered by simplify: the stored index is ignored
+    simplified = tables.tree_sequence().simplify(ts.samples()[:6])
+    assert load_breed_index(simplified) is None
+
+    breeds, sample_sets = get_breed_index(simplified).sample_sets()
+    assert breeds == ["Texel"]
+    np.testing.assert_array_equal(sample_sets[0], np.arange(6))
+
+
+def test_undecodable_breed_index():
+    ts = make_ts(42, 1e5, "1")
+    tables = ts.dump_tables()
+    index = write_breed_index(tables)
+
+    # an index with node lists is ignored and built again
+    metadata = dict(tables.metadata)
+    metadata[BREED_INDEX_KEY]["sample_nodes"] = index.sample_nodes.tolist()
+    tables.metadata = metadata
+
+    assert load_breed_index(tables.tree_sequence()) is None
+    np.testing.assert_array_equal(
+        get_breed_index(tables.tree_sequence()).sample_nodes, index.sample_nodes
+    )
@@ -0,0 +1,143 @@
+"""
+Unit tests for cli.py functions
+"""
+
+import sys
+import gzip
+import json
+import time
+import subprocess
+
+import pytest
+from click.testing import CliRunner
+
+from tskitetude.cli import COMMANDS, cli, claim_job, serve_queue, submit_job
+
+POPKEY = "ind1\tPopA\nind2\tPopB\n"
+
+VCF_HEADER = (
+    "##fileformat=VCFv4.2\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tind2\tind1\n"
+)
+
+
+@pytest.fixture
+def fid_iid_args(tmp_path):
+    indiv_list = tmp_path / "popKey.txt"
+    indiv_list.write_text(POPKEY)
+
+    (tmp_path / "test.vcf.gz").write_bytes(gzip.compress(VCF_HEADER.encode()))
+
+    return [
+        "create_fid_iid",
+        "--indiv_list",
+        str(indiv_list),
+        "--directory",
+        str(tmp_path),
+    ]
+
+
+def test_cli_commands():
+    runner = CliRunner()
+    result = runner.invoke(cli, ["--help"])
+
+    assert result.exit_code == 0, result.output
+
+    for name in list(COMMANDS) + ["worker", "submit"]:
+        assert name in result.output
+
+    # short help, not the import path
+    assert "Create a FID-IID TSV file for each VCF file" in result.output
+    assert "tskitetude.samplesheet:create_fid_iid" not in result.output
+
+
+def test_cli_subcommand(tmp_path, fid_iid_args):
+    runner = CliRunner()
+    result = runner.invoke(cli, fid_iid_args)
+
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "test.sample_names.txt").read_text() == (
+        "PopB\tind2\nPopA\tind1\n"
+    )
+
+
+def test_claim_job(tmp_path):
+    (tmp_path / "b.json").write_text("{}")
+    (tmp_path / "a.json").write_text("{}")
+    (tmp_path / "a.tmp").write_text("{}")
+
+    assert claim_job(tmp_path) == tmp_path / "a.running"
+    assert claim_job(tmp_path) == tmp_path / "b.running"
+    assert claim_job(tmp_path) is None
+
+
+def test_serve_queue(tmp_path, fid_iid_args):
+    queue = tmp_path / "queue"
+    queue.mkdir()
+
+    (queue / "job1.json").write_text(json.dumps({"args": fid_iid_args}))
+    (queue / "job2.json").write_text(json.dumps({"args": ["create_fid_iid"]}))
+    (queue / "job3.json").write_text("not a job")
+    (queue / "job4.json").write_text(json.dumps({"args": "create_fid_iid"}))
+
+    serve_queue(queue, poll_interval=0.01, idle_timeout=0)
+
+    assert (queue / "job1.done").exists()
+    assert json.loads((queue / "job1.result").read_text())["exit_code"] == 0
+    assert (tmp_path / "test.sample_names.txt").exists()
+
+    # missing options: click exits with 2
+    assert (queue / "job2.failed").exists()
+    assert json.loads((queue / "job2.result").read_text())["exit_code"] == 2
+
+    assert (queue / "job3.failed").exists()
+    assert "Invalid job" in json.loads((queue / "job3.result").read_text())["error"]
+    assert "Invalid job" in json.loads((queue / "job4.result").read_text())["error"]
+
+
+def test_worker_socket(tmp_path, fid_iid_args):
+    socket_path = tmp_path / "worker.sock"
+    log = tmp_path / "job.log"
+
+    worker = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "tskitetude.cli",
+            "worker",
+            "--socket",
+            str(socket_path),
+            "--max_jobs",
+            "2",
+            "--no-warm",
+        ]
+    )
+
+    try:
+        for _ in range(100):
+            if socket_path.exists():
+                break
+
+            time.sleep(0.1)
+
+        # a job without args is rejected, without counting it
+        result = submit_job(str(socket_path), {"cwd": str(tmp_path)})
+        assert "Invalid job" in result["error"]
+
+        result = submit_job(str(socket_path), {"args": fid_iid_args, "log": str(log)})
+        assert result["exit_code"] == 0
+        assert (tmp_path / "test.sample_names.txt").exists()
+        assert "Written 2 individuals" in log.read_text()
+
+        # the submit command exits with the job exit code
+        runner = CliRunner()
+        result = runner.invoke(
+            cli, ["submit", "--socket", str(socket_path), "create_fid_iid"]
+        )
+        assert result.exit_code == 2
+
+        # the worker exits after max_jobs
+        assert worker.wait(timeout=30) == 0
+
+    finally:
+        worker.kill()
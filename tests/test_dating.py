@@ -0,0 +1,197 @@
+"""
+Unit tests for dating.py functions
+"""
+
+import numpy as np
+import pytest
+import tskit
+import tsdate
+import tsinfer
+from click.testing import CliRunner
+
+from tskitetude import dating
+from tskitetude.dating import (
+    GridPoint,
+    choose_chunks,
+    constrain_times,
+    date_in_chunks,
+    date_tree_sequence,
+    date_tstree,
+    extract_chunk,
+    make_chunks,
+    make_grid,
+)
+
+msprime = pytest.importorskip("msprime")
+
+
+@pytest.fixture
+def trees_file(tmp_path):
+    ts = msprime.sim_ancestry(
+        10, sequence_length=1e5, recombination_rate=1e-8, population_size=1e4,
+        random_seed=42,
+    )
+    ts = msprime.sim_mutations(ts, rate=1e-8, random_seed=42)
+
+    trees_file = tmp_path / "input.trees"
+    tsdate.preprocess_ts(ts, filter_sites=False).dump(str(trees_file))
+
+    return trees_file
+
+
+def test_make_grid():
+    grid = make_grid(
+        ["variational_gamma", "inside_outside"], [1e-8, 2e-8], [1e4, 2e4]
+    )
+
+    # Ne doesn't affect variational_gamma
+    assert grid == [
+        GridPoint("variational_gamma", 1e-8, None),
+        GridPoint("variational_gamma", 2e-8, None),
+        GridPoint("inside_outside", 1e-8, 1e4),
+        GridPoint("inside_outside", 1e-8, 2e4),
+        GridPoint("inside_outside", 2e-8, 1e4),
+        GridPoint("inside_outside", 2e-8, 2e4),
+    ]
+    assert grid[0].name == "variational_gamma.mu1e-08"
+    assert grid[2].name == "inside_outside.mu1e-08.ne10000"
+
+
+def test_date_tstree(tmp_path, trees_file):
+    output_dir = tmp_path / "dated"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        date_tstree,
+        [
+            "--input_trees",
+            str(trees_file),
+            "--mutation_rate",
+            "1e-8",
+            "--mutation_rate",
+            "2e-8",
+            "--output_dir",
+            str(output_dir),
+            "--processes",
+            "2",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert sorted(path.name for path in output_dir.iterdir()) == [
+        "input.variational_gamma.mu1e-08.trees",
+        "input.variational_gamma.mu2e-08.trees",
+    ]
+
+    # the same result of dating in this process
+    expected = date_tree_sequence(tskit.load(str(trees_file)), mutation_rate=2e-8)
+    dated = tskit.load(str(output_dir / "input.variational_gamma.mu2e-08.trees"))
+
+    assert dated.nodes_time.tolist() == pytest.approx(expected.nodes_time.tolist())
+
+
+def test_date_worker_shared(tmp_path, trees_file, monkeypatch):
+    # a forked worker uses the tree sequence loaded by the parent
+    ts = tskit.load(str(trees_file))
+    monkeypatch.setitem(dating._SHARED_TREES, "not-a-file.trees", ts)
+
+    output = str(tmp_path / "dated.trees")
+    point = GridPoint("variational_gamma", 1e-8, None)
+
+    assert dating._date_worker("not-a-file.trees", point, output) == output
+    assert tskit.load(output).num_nodes == ts.num_nodes
+
+
+def test_make_chunks():
+    assert make_chunks(250, 100, 10) == [
+        ((0.0, 100.0), (0.0, 110.0)),
+        ((100.0, 200.0), (90.0, 210.0)),
+        ((200.0, 250.0), (190.0, 250.0)),
+    ]
+
+
+def test_extract_chunk(trees_file):
+    ts = tskit.load(str(trees_file))
+    chunk, node_ids, chunk_ids = extract_chunk(ts, (2e4, 5e4))
+
+    # only the edges in the interval
+    assert chunk.num_edges < ts.num_edges
+    assert chunk.edges_left.min() >= 2e4
+    assert chunk.edges_right.max() <= 5e4
+
+    # samples keep their IDs, other nodes are mapped
+    assert np.all(chunk_ids[: ts.num_samples] == np.arange(ts.num_samples))
+    np.testing.assert_array_equal(ts.nodes_time[node_ids], chunk.nodes_time[chunk_ids])
+
+
+def test_choose_chunks(trees_file):
+    ts = tskit.load(str(trees_file))
+    chunks = make_chunks(ts.sequence_length, 3e4, 5e3)
+
+    # the same of the argmax of the dense (chunks, nodes) span matrix
+    spans = np.zeros((len(chunks), ts.num_nodes))
+
+    for i, ((start, end), _) in enumerate(chunks):
+        span = np.clip(ts.edges_right, start, end) - np.clip(ts.edges_left, start, end)
+        np.add.at(spans[i], ts.edges_parent, span)
+        np.add.at(spans[i], ts.edges_child, span)
+
+    np.testing.assert_array_equal(
+        choose_chunks(ts, chunks), np.argmax(spans, axis=0)
+    )
+
+
+def test_constrain_times(trees_file):
+    ts = tskit.load(str(trees_file))
+
+    # times with many parents younger than their children
+    rng = np.random.default_rng(42)
+    times = ts.nodes_time * rng.uniform(0.2, 1.5, ts.num_nodes)
+
+    expected = times.copy()
+    parent, child = ts.edges_parent, ts.edges_child
+
+    for _ in range(ts.num_nodes):
+        needed = expected[child] + 1e-8
+        wrong = expected[parent] < needed
+
+        if not np.any(wrong):
+            break
+
+        np.maximum.at(expected, parent[wrong], needed[wrong])
+
+    constrained = constrain_times(ts, times)
+
+    np.testing.assert_allclose(constrained, expected)
+    assert np.all(constrained[parent] > constrained[child])
+
+
+def test_date_in_chunks():
+    ts = msprime.sim_ancestry(
+        20, sequence_length=2e6, recombination_rate=1e-8, population_size=1e4,
+        random_seed=1,
+    )
+    ts = msprime.sim_mutations(ts, rate=1e-8, random_seed=1)
+
+    inferred_ts = tsinfer.infer(tsinfer.SampleData.from_tree_sequence(ts))
+    inferred_ts = tsdate.preprocess_ts(inferred_ts.simplify(), filter_sites=False)
+
+    expected = date_tree_sequence(inferred_ts, mutation_rate=1e-8)
+    dated = date_in_chunks(
+        inferred_ts, chunk_size=1e6, overlap=2e5, mutation_rate=1e-8, processes=2
+    )
+
+    # same nodes, with the same tsdate metadata
+    assert dated.num_nodes == inferred_ts.num_nodes
+    assert dated.num_samples == inferred_ts.num_samples
+    assert dated.tables.nodes.metadata_schema == expected.tables.nodes.metadata_schema
+
+    parent, child = dated.edges_parent, dated.edges_child
+    assert np.all(dated.nodes_time[parent] > dated.nodes_time[child])
+
+    # times are close to the ones dating the whole sequence
+    internal = ~dated.tables.nodes.flags.astype(bool)
+    correlation = np.corrcoef(
+        np.log(dated.nodes_time[internal]), np.log(expected.nodes_time[internal])
+    )[0, 1]
+    assert correlation > 0.95
@@ -0,0 +1,217 @@
+"""
+Unit tests for ensembl.py functions
+"""
+
+import time
+import pytest
+import requests
+from click.testing import CliRunner
+
+from tskitetude.ensembl import ComparaCache, ComparaSheepSNP, collect_fasta_ancestors
+
+
+ANCESTOR = {"seq": "A", "seq_region": "Ancestor_1234"}
+
+ALIGNMENT = [
+    {
+        "alignments": [
+            {"seq": "G", "seq_region": "1"},
+            ANCESTOR,
+        ]
+    }
+]
+
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """A session which counts the network requests"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        response = self.responses[url.split("/")[-1]]
+
+        if isinstance(response, Exception):
+            raise response
+
+        return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with ComparaCache(str(tmp_path / "compara.sqlite")) as cache:
+        yield cache
+
+
+@pytest.fixture
+def session():
+    return FakeSession(
+        {
+            "1:100-100": FakeResponse(200, ALIGNMENT),
+            "1:200-200": FakeResponse(
+                400, {"error": "No alignment available for this region"}
+            ),
+            "1:300-300": FakeResponse(503, "Service unavailable"),
+        }
+    )
+
+
+def get_compara(session, cache):
+    compara = ComparaSheepSNP(
+        base_url="https://nov2020.rest.ensembl.org", assembly="OAR3", cache=cache
+    )
+    compara.session = session
+
+    return compara
+
+
+def test_cache_set_get(cache):
+    params = ComparaSheepSNP.params
+
+    assert cache.get("ovis_aries", "OAR3", "1:100-100", params) is None
+
+    cache.set("ovis_aries", "OAR3", "1:100-100", params, "found", ANCESTOR)
+    record = cache.get("ovis_aries", "OAR3", "1:100-100", params)
+
+    assert record.status == "found"
+    assert record.payload == ANCESTOR
+
+    # key depends on assembly and params too
+    assert cache.get("ovis_aries", "OAR4", "1:100-100", params) is None
+    assert cache.get("ovis_aries", "OAR3", "1:100-100", params[:1]) is None
+
+
+def test_cache_negative_ttl(tmp_path):
+    params = ComparaSheepSNP.params
+
+    with ComparaCache(str(tmp_path / "compara.sqlite"), negative_ttl=0) as cache:
+        cache.set("ovis_aries", "OAR3", "1:100-100", params, "missing")
+        cache.set("ovis_aries", "OAR3", "1:200-200", params, "found", ANCESTOR)
+        time.sleep(0.01)
+
+        # missing record is expired, found records never expire
+        assert cache.get("ovis_aries", "OAR3", "1:100-100", params) is None
+        assert cache.get("ovis_aries", "OAR3", "1:200-200", params) is not None
+
+
+def test_get_ancestor_cached(session, cache):
+    compara = get_compara(session, cache)
+
+    assert compara.get_ancestor("1", 100) == ANCESTOR
+    assert compara.get_ancestor("1", 200) is None
+    assert compara.get_ancestor("1", 300) is None
+    assert session.calls == 3
+
+    # a second lookup (or a rerun with the same cache) does no network I/O
+    assert compara.get_ancestor("1", 100) == ANCESTOR
+    assert compara.get_ancestor("1", 200) is None
+    assert compara.get_ancestor("1", 300) is None
+    assert session.calls == 3
+
+    assert cache.get("ovis_aries", "OAR3", "1:200-200", compara.params).status == (
+        "missing"
+    )
+    assert cache.get("ovis_aries", "OAR3", "1:300-300", compara.params).status == (
+        "error"
+    )
+
+
+def test_get_ancestor_resume(tmp_path, session):
+    cache_file = str(tmp_path / "compara.sqlite")
+
+    with ComparaCache(cache_file) as cache:
+        get_compara(session, cache).get_ancestor("1", 100)
+
+    # reopen the cache like a new run
+    with ComparaCache(cache_file) as cache:
+        new_session = FakeSession({})
+        assert get_compara(new_session, cache).get_ancestor("1", 100) == ANCESTOR
+        assert new_session.calls == 0
+
+
+def test_collect_fasta_ancestors(tmp_path):
+    fasta_file = tmp_path / "ovis_aries_ancestor_1.fa"
+    fasta_file.write_text(
+        ">ANCESTOR_for_chromosome:OAR3:1:1:20:1\nACGTNacgt-\nACGTACGTAC\n"
+    )
+
+    variants = tmp_path / "variants.csv"
+    variants.write_text(
+        "chrom,position,alleles\n1,1,A/G\n1,5,C/T\n1,6,A/G\n1,11,A/C\n2,1,A/G\n"
+    )
+
+    output = tmp_path / "ancestors.csv"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        collect_fasta_ancestors,
+        [
+            "--fasta",
+            str(fasta_file),
+            "--variants",
+            str(variants),
+            "--output",
+            str(output),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert output.read_text() == (
+        "chrom,position,alleles,anc_allele\n1,1,A/G,A\n1,6,A/G,A\n1,11,A/C,A\n"
+    )
+
+    result = runner.invoke(
+        collect_fasta_ancestors,
+        [
+            "--fasta",
+            str(fasta_file),
+            "--variants",
+            str(variants),
+            "--output",
+            str(output),
+            "--high_confidence",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert output.read_text() == (
+        "chrom,position,alleles,anc_allele\n1,1,A/G,A\n1,11,A/C,A\n"
+    )
+
+
+def test_get_ancestor_errors(cache):
+    session = FakeSession(
+        {
+            "1:100-100": FakeResponse(404, {"error": "No alignment found"}),
+            "1:200-200": FakeResponse(429, {"error": "Too many requests"}),
+            "1:300-300": FakeResponse(408, "Request timeout"),
+            "1:400-400": FakeResponse(403, {"error": "Forbidden"}),
+            "1:500-500": requests.ConnectionError("Connection reset"),
+            "1:600-600": requests.Timeout("Read timed out"),
+        }
+    )
+    compara = get_compara(session, cache)
+
+    for position in range(100, 700, 100):
+        assert compara.get_ancestor("1", position) is None
+
+    statuses = [
+        cache.get("ovis_aries", "OAR3", f"1:{position}-{position}", compara.params)
+        .status
+        for position in range(100, 700, 100)
+    ]
+
+    # only a missing alignment is cached with the negative TTL
+    assert statuses == ["missing"] + ["error"] * 5
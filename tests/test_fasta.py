@@ -0,0 +1,160 @@
+"""
+Unit tests for fasta.py functions
+"""
+
+import gzip
+import struct
+
+import pytest
+from click.testing import CliRunner
+
+from tskitetude.fasta import (
+    BgzfWriter,
+    IndexedFasta,
+    build_fasta_index,
+    fake_fasta_from_vcf,
+    read_fasta_index,
+)
+
+# two sequences, with 10 bases per line
+FASTA = """>chr1 first sequence
+ACGTACGTAC
+GGGGGCCCCC
+TTT
+>chr2
+NNNNNacgta
+"""
+
+
+@pytest.fixture
+def fasta_file(tmp_path):
+    fasta_file = tmp_path / "test.fa"
+    fasta_file.write_text(FASTA)
+    return str(fasta_file)
+
+
+def test_build_fasta_index(fasta_file):
+    records = build_fasta_index(fasta_file)
+
+    assert [record.name for record in records] == ["chr1", "chr2"]
+    assert records[0].length == 23
+    assert records[0].offset == len(">chr1 first sequence\n")
+    assert records[0].linebases == 10
+    assert records[0].linewidth == 11
+    assert records[1].length == 10
+
+
+def test_build_fasta_index_malformed(tmp_path):
+    fasta_file = tmp_path / "malformed.fa"
+    fasta_file.write_text(">chr1\nACGTACGTAC\nACG\nACGTACGTAC\n")
+
+    with pytest.raises(ValueError):
+        build_fasta_index(str(fasta_file))
+
+
+def test_indexed_fasta(fasta_file):
+    with IndexedFasta(fasta_file) as fasta:
+        assert fasta.references == ["chr1", "chr2"]
+        assert fasta.get_base("chr1", 1) == "A"
+        assert fasta.get_base("chr1", 11) == "G"
+        assert fasta.get_base("chr1", 23) == "T"
+        assert fasta.get_base("chr2", 6) == "a"
+        assert fasta.fetch("chr1", 8, 13) == "TACGGG"
+
+        with pytest.raises(IndexError):
+            fasta.get_base("chr1", 24)
+
+    # index is written next to the FASTA file
+    assert read_fasta_index(fasta_file + ".fai") == build_fasta_index(fasta_file)
+
+
+VCF = """##fileformat=VCFv4.2
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+1\t1\t.\tA\tG\t.\tPASS\t.
+1\t65\t.\tC\tT\t.\tPASS\t.
+1\t250\t.\tG\tA\t.\tPASS\t.
+2\t10\t.\tT\tC\t.\tPASS\t.
+"""
+
+
+def run_fake_fasta(tmp_path, vcf_text, *args):
+    vcf_file = tmp_path / "test.vcf"
+    vcf_file.write_text(vcf_text)
+    output = tmp_path / "test.fa.gz"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        fake_fasta_from_vcf,
+        ["--vcf", str(vcf_file), "--output", str(output), *args],
+    )
+
+    return result, output
+
+
+def test_bgzf_writer(tmp_path):
+    path = str(tmp_path / "test.gz")
+    data = bytes(range(256)) * 1000
+
+    with BgzfWriter(path) as writer:
+        writer.write(data)
+
+    writer.write_gzi(path + ".gzi")
+
+    with gzip.open(path) as handle:
+        assert handle.read() == data
+
+    # one entry for every block after the first
+    with open(path + ".gzi", "rb") as handle:
+        (n_entries,) = struct.unpack("<Q", handle.read(8))
+        offsets = [struct.unpack("<QQ", handle.read(16)) for _ in range(n_entries)]
+
+    assert n_entries == len(data) // 0xFF00
+    assert [uncompressed for _, uncompressed in offsets] == [
+        0xFF00 * (i + 1) for i in range(n_entries)
+    ]
+
+
+def test_fake_fasta_from_vcf(tmp_path):
+    result, output = run_fake_fasta(tmp_path, VCF, "--round_to", "100")
+
+    assert result.exit_code == 0, result.output
+
+    # uncompress and index the FASTA like samtools would do
+    plain = tmp_path / "plain.fa"
+    with gzip.open(output) as handle:
+        plain.write_bytes(handle.read())
+
+    assert plain.read_text().splitlines()[0] == (
+        ">1 Fake sequence for chrom 1 of length 300"
+    )
+
+    # the index written with the BGZF file is the same of the plain FASTA
+    assert read_fasta_index(str(output) + ".fai") == build_fasta_index(str(plain))
+
+    with IndexedFasta(str(plain)) as fasta:
+        assert fasta.references == ["1", "2"]
+        assert fasta.index["1"].length == 300
+        assert fasta.index["2"].length == 100
+        assert fasta.get_base("1", 1) == "A"
+        assert fasta.get_base("1", 65) == "C"
+        assert fasta.get_base("1", 250) == "G"
+        assert fasta.get_base("2", 10) == "T"
+        assert fasta.fetch("1", 2, 64) == "N" * 63
+
+
+def test_fake_fasta_from_vcf_unsorted(tmp_path):
+    vcf_text = VCF + "1\t300\t.\tA\tG\t.\tPASS\t.\n"
+    result, _ = run_fake_fasta(tmp_path, vcf_text)
+
+    assert result.exit_code != 0
+    assert "needs to be sorted" in str(result.exception)
+
+
+def test_fake_fasta_from_vcf_output(tmp_path):
+    result, output = run_fake_fasta(tmp_path, VCF)
+    assert result.exit_code == 0, result.output
+
+    # don't overwrite existing files
+    result, _ = run_fake_fasta(tmp_path, VCF)
+    assert result.exit_code != 0
+    assert "already exists" in result.output
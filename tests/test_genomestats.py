@@ -0,0 +1,143 @@
+"""
+Unit tests for genomestats.py functions
+"""
+
+import csv
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from tskitetude.genomestats import (
+    chrom_stats,
+    combine_stats,
+    genome_stats,
+    make_windows,
+    window_rows,
+)
+
+from .test_gnn import make_ts
+
+msprime = pytest.importorskip("msprime")
+
+
+def make_mutated_ts(
+    seed: int, sequence_length: float, chrom: str, breeds=("Texel", "Frizarta")
+):
+    ts = make_ts(seed, sequence_length, chrom, breeds)
+
+    return msprime.sim_mutations(ts, rate=1e-8, random_seed=seed)
+
+
+def read_tsv(path) -> list:
+    with open(path) as handle:
+        return list(csv.DictReader(handle, delimiter="\t"))
+
+
+def test_make_windows():
+    np.testing.assert_array_equal(make_windows(100), [0, 100])
+    np.testing.assert_array_equal(make_windows(100, 40), [0, 40, 80, 100])
+
+
+def test_chrom_stats_windows():
+    ts = make_mutated_ts(42, 1e5, "1")
+
+    whole = chrom_stats(ts, "1")
+    windowed = chrom_stats(ts, "1", window_size=3e4)
+
+    assert whole.groups["diversity"] == ["all", "Texel", "Frizarta"]
+    assert whole.groups["divergence"] == ["Texel-Frizarta"]
+    assert windowed.num_windows == 4
+    assert windowed.num_sites.sum() == whole.num_sites.sum() == ts.num_sites
+
+    # not normalised statistics sum up across windows
+    for stat in whole.values:
+        np.testing.assert_allclose(
+            windowed.values[stat].sum(axis=0), whole.values[stat][0]
+        )
+
+    np.testing.assert_allclose(whole.values["diversity"][0, 0], ts.diversity() * 1e5)
+
+
+@pytest.mark.parametrize("weighting", ["length", "sites"])
+def test_combine_stats(weighting):
+    ts1, ts2 = make_mutated_ts(1, 1e5, "1"), make_mutated_ts(2, 3e5, "2")
+    chroms = [chrom_stats(ts1, "1", window_size=5e4), chrom_stats(ts2, "2")]
+
+    rows = combine_stats(chroms, weighting)
+    genome = {
+        (row["stat"], row["group"]): row for row in rows if row["scope"] == "genome"
+    }
+
+    denominator = 4e5 if weighting == "length" else ts1.num_sites + ts2.num_sites
+    expected = (ts1.diversity() * 1e5 + ts2.diversity() * 3e5) / denominator
+
+    assert genome[("diversity", "all")]["value"] == pytest.approx(expected)
+    assert genome[("diversity", "all")]["span"] == 4e5
+    assert genome[("diversity", "all")]["num_sites"] == ts1.num_sites + ts2.num_sites
+
+    # Fst from genome-wide totals, not the mean of chromosomes
+    pi1 = genome[("diversity", "Texel")]["value"]
+    pi2 = genome[("diversity", "Frizarta")]["value"]
+    d12 = genome[("divergence", "Texel-Frizarta")]["value"]
+    assert genome[("Fst", "Texel-Frizarta")]["value"] == pytest.approx(
+        1 - (pi1 + pi2) / 2 / d12
+    )
+
+    scopes = {row["scope"] for row in rows}
+    assert scopes == {"1", "2", "genome"}
+
+    windows = window_rows(chroms, weighting)
+    assert len([row for row in windows if row["chrom"] == "1"]) == 2 * (3 + 3 + 1)
+
+
+def test_combine_stats_hyphenated_breeds():
+    ts = make_mutated_ts(1, 1e5, "1", breeds=("Texel-UK", "Frizarta-GR"))
+    chroms = [chrom_stats(ts, "1")]
+
+    assert chroms[0].pairs == {"Texel-UK-Frizarta-GR": ("Texel-UK", "Frizarta-GR")}
+
+    genome = {
+        (row["stat"], row["group"]): row["value"]
+        for row in combine_stats(chroms)
+        if row["scope"] == "genome"
+    }
+
+    pi1 = genome[("diversity", "Texel-UK")]
+    pi2 = genome[("diversity", "Frizarta-GR")]
+    d12 = genome[("divergence", "Texel-UK-Frizarta-GR")]
+    assert genome[("Fst", "Texel-UK-Frizarta-GR")] == pytest.approx(
+        1 - (pi1 + pi2) / 2 / d12
+    )
+
+
+def test_genome_stats(tmp_path):
+    paths = []
+
+    for seed, chrom in [(1, "1"), (2, "2")]:
+        path = tmp_path / f"chr{chrom}.trees"
+        make_mutated_ts(seed, 1e5, chrom).dump(str(path))
+        paths += ["--input_trees", str(path)]
+
+    result = CliRunner().invoke(
+        genome_stats,
+        paths
+        + [
+            "--window_size", "50000",
+            "--processes", "2",
+            "--output", str(tmp_path / "stats.tsv"),
+            "--output_windows", str(tmp_path / "windows.tsv"),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    rows = read_tsv(tmp_path / "stats.tsv")
+    assert [row["scope"] for row in rows[:: len(rows) // 3]] == ["1", "2", "genome"]
+    assert {row["stat"] for row in rows} == {
+        "diversity", "segregating_sites", "divergence", "Fst"
+    }
+
+    windows = read_tsv(tmp_path / "windows.tsv")
+    assert {(row["chrom"], row["start"]) for row in windows} == {
+        ("1", "0"), ("1", "50000"), ("2", "0"), ("2", "50000")
+    }
@@ -0,0 +1,127 @@
+"""
+Unit tests for gnn.py functions
+"""
+
+import json
+
+import numpy as np
+import pytest
+import tskit
+from click.testing import CliRunner
+
+from tskitetude.gnn import GNNMatrix, compute_gnn, get_breed_sample_sets, gnn
+
+msprime = pytest.importorskip("msprime")
+
+
+def make_ts(
+    seed: int, sequence_length: float, chrom: str, breeds=("Texel", "Frizarta")
+) -> tskit.TreeSequence:
+    demography = msprime.Demography.island_model([1e4, 1e4], migration_rate=1e-4)
+    ts = msprime.sim_ancestry(
+        {0: 4, 1: 3},
+        demography=demography,
+        sequence_length=sequence_length,
+        recombination_rate=1e-8,
+        random_seed=seed,
+    )
+
+    # metadata as written by annotate_tree (JSON without schema)
+    tables = ts.dump_tables()
+    tables.metadata_schema = tskit.MetadataSchema.permissive_json()
+    tables.metadata = {"chrom": chrom}
+
+    populations = tables.populations.copy()
+    tables.populations.clear()
+    tables.populations.metadata_schema = tskit.MetadataSchema.null()
+
+    for population, breed in zip(populations, breeds):
+        tables.populations.append(
+            population.replace(metadata=json.dumps({"breed": breed}).encode())
+        )
+
+    individuals = tables.individuals.copy()
+    tables.individuals.clear()
+
+    for i, individual in enumerate(individuals):
+        tables.individuals.append(
+            individual.replace(metadata=json.dumps({"sample_id": f"ind{i}"}).encode())
+        )
+
+    return tables.tree_sequence()
+
+
+def test_compute_gnn_chunks():
+    ts = make_ts(42, 1e5, "1")
+
+    breeds, sample_sets = get_breed_sample_sets(ts)
+    assert breeds == ["Texel", "Frizarta"]
+    assert [len(nodes) for nodes in sample_sets] == [8, 6]
+
+    expected = ts.genealogical_nearest_neighbours(ts.samples(), sample_sets)
+
+    np.testing.assert_allclose(compute_gnn(ts, sample_sets, chunk_size=3), expected)
+    np.testing.assert_allclose(
+        compute_gnn(ts, sample_sets, chunk_size=5, num_threads=2), expected
+    )
+    np.testing.assert_allclose(
+        compute_gnn(ts, sample_sets, chunk_size=5, num_threads=0), expected
+    )
+
+
+def test_gnn_aggregate(tmp_path):
+    ts1, ts2 = make_ts(1, 1e5, "1"), make_ts(2, 3e5, "2")
+    ts1.dump(str(tmp_path / "chr1.trees"))
+    ts2.dump(str(tmp_path / "chr2.trees"))
+
+    runner = CliRunner()
+    result = runner.invoke(
+        gnn,
+        [
+            "--input_trees", str(tmp_path / "chr1.trees"),
+            "--input_trees", str(tmp_path / "chr2.trees"),
+            "--output", str(tmp_path / "gnn.parquet"),
+            "--chunk_size", "4",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    matrix = GNNMatrix.from_parquet(str(tmp_path / "gnn.parquet"))
+    assert matrix.breeds == ["Texel", "Frizarta"]
+    assert list(matrix.chrom) == ["1"] * 7 + ["2"] * 7
+    assert list(matrix.sample_id[:7]) == [f"ind{i}" for i in range(7)]
+    assert list(matrix.breed[:7]) == ["Texel"] * 4 + ["Frizarta"] * 3
+
+    # the mean of the two nodes of the first individual
+    _, sample_sets = get_breed_sample_sets(ts1)
+    expected = ts1.genealogical_nearest_neighbours([0, 1], sample_sets).mean(axis=0)
+    np.testing.assert_allclose(matrix.values[0], expected, rtol=1e-6)
+    np.testing.assert_allclose(matrix.values.sum(axis=1), 1, rtol=1e-6)
+
+    # aggregate the per-chromosome matrix, weighting by sequence length
+    result = runner.invoke(
+        gnn,
+        [
+            "--input_gnn", str(tmp_path / "gnn.parquet"),
+            "--output", str(tmp_path / "all.parquet"),
+            "--aggregate",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    aggregated = GNNMatrix.from_parquet(str(tmp_path / "all.parquet"))
+    assert len(aggregated) == 7
+    assert list(aggregated.sample_id) == [f"ind{i}" for i in range(7)]
+    np.testing.assert_allclose(aggregated.sequence_length, 4e5)
+    np.testing.assert_allclose(
+        aggregated.values,
+        (matrix.values[:7] * 1e5 + matrix.values[7:] * 3e5) / 4e5,
+        rtol=1e-6,
+    )
+
+
+def test_gnn_no_input(tmp_path):
+    result = CliRunner().invoke(gnn, ["--output", str(tmp_path / "gnn.parquet")])
+
+    assert result.exit_code != 0
+    assert "Provide --input_trees or --input_gnn" in result.output
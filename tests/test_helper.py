@@ -5,15 +5,22 @@ Unit tests for helper.py functions, especially testing sample order consistency
 between CSV metadata and VCF genotypes.
 """
 
+import json
 import tempfile
 import pytest
+import tskit
 import tsinfer
 
 from tskitetude.helper import (
     add_populations,
     add_diploid_individuals,
     add_diploid_sites,
+    check_metadata,
+    copy_samples,
+    create_sample_data,
+    get_chunk_size,
 )
+from tskitetude.samplesheet import load_sample_sheet
 
 
 @pytest.fixture
@@ -193,3 +200,212 @@ def test_genotype_data_integrity(temp_csv_same_order, temp_vcf_file):
         # Site 2 (pos 300): Sample1=1|1, Sample2=0|0, Sample3=0|1
         site2_genotypes = list(samples.sites_genotypes[2])
         assert site2_genotypes == [1, 1, 0, 0, 0, 1]
+
+
+@pytest.fixture
+def inferred_ts(temp_csv_same_order, temp_vcf_file):
+    """Infer a tree sequence like create_tstree does"""
+    import cyvcf2
+
+    with tempfile.NamedTemporaryFile(suffix=".samples") as tmp:
+        with tsinfer.SampleData(path=tmp.name, sequence_length=1000) as samples:
+            pop_lookup = add_populations(temp_csv_same_order, samples)
+            indv_lookup = add_diploid_individuals(
+                temp_csv_same_order, pop_lookup, samples
+            )
+
+            vcf = cyvcf2.VCF(temp_vcf_file)
+            try:
+                add_diploid_sites(
+                    vcf, samples, {}, indv_lookup, ancestral_method="reference"
+                )
+            finally:
+                vcf.close()
+
+        return tsinfer.infer(samples).simplify()
+
+
+def test_check_metadata(inferred_ts, temp_csv_same_order):
+    sample_sheet = load_sample_sheet(temp_csv_same_order)
+
+    assert check_metadata(inferred_ts) == []
+    assert check_metadata(inferred_ts, sample_sheet) == []
+
+
+def test_check_metadata_inconsistencies(inferred_ts, temp_csv_same_order, tmp_path):
+    tables = inferred_ts.dump_tables()
+
+    # move the first node of Sample1 to another population
+    node = tables.nodes[0]
+    tables.nodes[0] = node.replace(population=1 - node.population)
+
+    # remove the individual from the last sample node
+    last = inferred_ts.samples()[-1]
+    tables.nodes[last] = tables.nodes[last].replace(individual=tskit.NULL)
+
+    errors = check_metadata(tables.tree_sequence())
+
+    assert len(errors) == 3
+    assert errors[0].startswith("1 sample nodes without an individual")
+    assert errors[1].startswith("1 individuals without two sample nodes")
+    assert errors[2].startswith("2 sample nodes in a different population")
+
+    # breeds don't match the sample sheet
+    other_sheet = tmp_path / "other.csv"
+    other_sheet.write_text("PopB,Sample1\nPopB,Sample2\nPopB,Sample3\n")
+
+    errors = check_metadata(inferred_ts, load_sample_sheet(str(other_sheet)))
+
+    assert errors == [
+        "4 sample nodes in a population different from the sample sheet "
+        "(eg. [0, 1, 4, 5])"
+    ]
+
+
+def test_check_metadata_invalid(inferred_ts):
+    tables = inferred_ts.dump_tables()
+    tables.populations.packset_metadata(
+        [json.dumps({"name": "PopA"}).encode()] * tables.populations.num_rows
+    )
+
+    errors = check_metadata(tables.tree_sequence())
+
+    assert len(errors) == 1
+    assert errors[0].startswith("Invalid metadata")
+
+
+def build_samples(path, csv_file, vcf_file, ancestors_alleles, ancestral_method):
+    import cyvcf2
+
+    with tsinfer.SampleData(path=path, sequence_length=1000) as samples:
+        samples.metadata = {"chrom": "chr1"}
+
+        pop_lookup = add_populations(csv_file, samples)
+        indv_lookup = add_diploid_individuals(csv_file, pop_lookup, samples)
+
+        vcf = cyvcf2.VCF(vcf_file)
+        try:
+            add_diploid_sites(
+                vcf,
+                samples,
+                ancestors_alleles,
+                indv_lookup,
+                ancestral_method=ancestral_method,
+            )
+        finally:
+            vcf.close()
+
+    return samples
+
+
+@pytest.mark.parametrize(
+    "ancestral_method,ancestors_alleles,expected",
+    [
+        ("reference", {}, [0, 0, 0]),
+        ("estsfs", {("chr1", 100): 1, ("chr1", 300): 0}, [1, -1, 0]),
+        ("ensembl", {("chr1", 100): "T", ("chr1", 200): "A"}, [1, -1, -1]),
+    ],
+)
+def test_copy_samples(
+    tmp_path,
+    temp_csv_same_order,
+    temp_vcf_file,
+    ancestral_method,
+    ancestors_alleles,
+    expected,
+):
+    # build genotypes once, with a different ancestral method
+    source = build_samples(
+        str(tmp_path / "source.samples"),
+        temp_csv_same_order,
+        temp_vcf_file,
+        {},
+        "reference",
+    )
+
+    samples = copy_samples(
+        source.path,
+        str(tmp_path / "copy.samples"),
+        ancestors_alleles,
+        ancestral_method,
+    )
+
+    # the same of reading the VCF with this ancestral method
+    direct = build_samples(
+        str(tmp_path / "direct.samples"),
+        temp_csv_same_order,
+        temp_vcf_file,
+        ancestors_alleles,
+        ancestral_method,
+    )
+
+    assert samples.sites_ancestral_allele[:].tolist() == expected
+    assert direct.sites_ancestral_allele[:].tolist() == expected
+    assert samples.sites_genotypes[:].tolist() == direct.sites_genotypes[:].tolist()
+    assert samples.individuals_metadata[:].tolist() == (
+        direct.individuals_metadata[:].tolist()
+    )
+    assert samples.metadata == {"chrom": "chr1"}
+
+    # the source file is not modified
+    source = tsinfer.load(source.path)
+    assert source.sites_ancestral_allele[:].tolist() == [0, 0, 0]
+
+
+def test_copy_samples_without_chrom(tmp_path, inferred_ts):
+    samples = tsinfer.SampleData.from_tree_sequence(
+        inferred_ts, path=str(tmp_path / "nochrom.samples")
+    )
+    samples.close()
+
+    with pytest.raises(ValueError, match="No chromosome"):
+        copy_samples(samples.path, str(tmp_path / "copy.samples"), {}, "estsfs")
+
+
+def test_get_chunk_size():
+    assert get_chunk_size(600) == 1024
+    assert get_chunk_size(600, chunk_size=512) == 512
+
+    # 1 MB for 2**10 samples: 1024 sites, 512 with two flush buffers
+    assert get_chunk_size(2**10, chunk_size=4096, max_memory=1) == 1024
+    assert get_chunk_size(2**10, chunk_size=4096, max_memory=1, num_buffers=2) == 512
+    assert get_chunk_size(2**10, chunk_size=128, max_memory=1) == 128
+
+    with pytest.raises(ValueError):
+        get_chunk_size(2**21, max_memory=1)
+
+
+def test_create_sample_data(tmp_path, temp_csv_same_order, temp_vcf_file):
+    import cyvcf2
+
+    path = str(tmp_path / "test.samples")
+
+    with create_sample_data(
+        path,
+        1000,
+        num_samples=6,
+        chunk_size=1024,
+        compressor="lz4",
+        max_memory=12 / 2**20,
+    ) as samples:
+        pop_lookup = add_populations(temp_csv_same_order, samples)
+        indv_lookup = add_diploid_individuals(temp_csv_same_order, pop_lookup, samples)
+
+        vcf = cyvcf2.VCF(temp_vcf_file)
+        try:
+            add_diploid_sites(
+                vcf, samples, {}, indv_lookup, ancestral_method="reference"
+            )
+        finally:
+            vcf.close()
+
+    samples = tsinfer.load(path)
+
+    # two sites for each genotype chunk
+    assert samples.sites_genotypes.chunks[0] == 2
+    assert samples.sites_genotypes.compressor.cname == "lz4"
+    assert samples.sites_genotypes[:].tolist() == [
+        [0, 0, 0, 1, 1, 1],
+        [0, 1, 1, 1, 0, 0],
+        [1, 1, 0, 0, 0, 1],
+    ]
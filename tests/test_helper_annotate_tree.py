@@ -8,6 +8,7 @@ import tskit
 import tszip
 from pathlib import Path
 from click.testing import CliRunner
+from tskitetude.breedindex import load_breed_index
 from tskitetude.helper import annotate_tree
 
 
@@ -148,6 +149,13 @@ def test_annotate_tree_success(tmp_files):
     assert len(provenances) > 0
     assert any("test_software" in json.dumps(p) for p in provenances)
 
+    # Verify the breed index in top-level metadata
+    index = load_breed_index(ts)
+    assert index.breeds == ["breed1", "breed2"]
+    assert index.breed_samples("breed1").tolist() == [0, 1]
+    assert index.breed_samples("breed2").tolist() == [2, 3]
+    assert index.individual_nodes_of(1).tolist() == [2, 3]
+
 
 def test_annotate_tree_with_extra_columns(tmp_files):
     """Test annotation handles extra columns in sample file"""
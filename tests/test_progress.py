@@ -0,0 +1,84 @@
+"""
+Unit tests for progress.py functions
+"""
+
+import json
+
+import pytest
+
+from tskitetude.progress import ProgressReporter, format_eta, get_max_rss, get_rss
+
+
+def test_format_eta():
+    assert format_eta(None) == "unknown"
+    assert format_eta(3725.4) == "1:02:05"
+
+
+def test_rss():
+    assert get_rss() > 0
+    assert get_max_rss() > 0
+
+
+def test_progress_total(tmp_path, caplog):
+    metrics_file = tmp_path / "metrics.jsonl"
+
+    with caplog.at_level("INFO", logger="tskitetude.progress"):
+        with ProgressReporter(
+            "Test", total=10, interval=0, metrics_file=str(metrics_file)
+        ) as progress:
+            for _ in range(4):
+                progress.update()
+
+    records = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+
+    # one record for each update (interval is 0) and the final one
+    assert len(records) == 5
+    assert [record["count"] for record in records] == [1, 2, 3, 4, 4]
+    assert [record["done"] for record in records] == [False] * 4 + [True]
+    assert records[-1]["total"] == 10
+    assert records[-1]["eta"] == pytest.approx(
+        6 / records[-1]["rate"], rel=1e-2, abs=1e-3
+    )
+
+    # no input file, no bytes
+    assert records[-1]["bytes_rate"] is None
+    assert records[-1]["rss"] > 0
+
+    assert "Test: 4 sites/10" in caplog.records[-1].getMessage()
+
+
+def test_progress_rate_limited(tmp_path):
+    metrics_file = tmp_path / "metrics.jsonl"
+
+    progress = ProgressReporter("Test", interval=3600, metrics_file=str(metrics_file))
+
+    for _ in range(1000):
+        progress.update()
+
+    assert not metrics_file.exists()
+
+    progress.close()
+
+    records = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+    assert len(records) == 1
+    assert records[0]["count"] == 1000
+    assert records[0]["eta"] is None
+
+
+def test_progress_input_file(tmp_path):
+    input_file = tmp_path / "input.txt"
+    input_file.write_bytes(b"x" * 2**20)
+
+    progress = ProgressReporter("Test", input_file=str(input_file))
+
+    with open(input_file, "rb") as handle:
+        while handle.read(2**16):
+            progress.update()
+
+    metrics = progress.metrics()
+
+    if metrics["bytes_read"] is None:
+        pytest.skip("bytes read by process not available")
+
+    assert metrics["bytes_read"] >= 2**20
+    assert metrics["bytes_rate"] > 0
@@ -0,0 +1,124 @@
+"""
+Unit tests for resampling.py functions
+"""
+
+import csv
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from tskitetude.genomestats import chrom_stats
+from tskitetude.resampling import BlockMatrix, confidence_intervals, stats_ci
+
+from .test_genomestats import make_mutated_ts
+
+
+def make_blocks(values: np.ndarray, denominator: np.ndarray) -> BlockMatrix:
+    num_blocks = len(denominator)
+
+    return BlockMatrix(
+        groups={"diversity": ["all"]},
+        chrom=np.full(num_blocks, "1", dtype=object),
+        start=np.arange(num_blocks) * 10.0,
+        end=np.arange(1, num_blocks + 1) * 10.0,
+        denominator=denominator,
+        values={"diversity": values[:, None]},
+    )
+
+
+def test_jackknife_equal_blocks():
+    rng = np.random.default_rng(42)
+    x = rng.random(20)
+
+    # with equal blocks the jackknife of a mean is the standard error
+    blocks = make_blocks(x * 10, np.full(20, 10.0))
+    theta, se = blocks.jackknife()[("diversity", "all")]
+
+    assert theta == pytest.approx(x.mean())
+    assert se == pytest.approx(x.std(ddof=1) / np.sqrt(20))
+
+
+def test_jackknife_single_block():
+    blocks = make_blocks(np.ones(1), np.ones(1))
+
+    with pytest.raises(ValueError, match="two blocks"):
+        blocks.jackknife()
+
+
+def test_bootstrap():
+    blocks = make_blocks(np.array([1.0, 2.0, 6.0]), np.array([1.0, 1.0, 2.0]))
+    replicates = blocks.bootstrap(5, seed=1)[("diversity", "all")]
+
+    # the same replicates from the sampled blocks
+    rng = np.random.default_rng(1)
+    samples = rng.integers(3, size=(5, 3))
+    expected = [
+        blocks.values["diversity"][row, 0].sum() / blocks.denominator[row].sum()
+        for row in samples
+    ]
+
+    np.testing.assert_allclose(replicates, expected)
+
+
+def test_block_matrix_from_chroms():
+    ts1, ts2 = make_mutated_ts(1, 1e5, "1"), make_mutated_ts(2, 2e5, "2")
+    chroms = [
+        chrom_stats(ts1, "1", window_size=2.5e4),
+        chrom_stats(ts2, "2", window_size=2.5e4),
+    ]
+
+    blocks = BlockMatrix.from_chroms(chroms)
+    assert blocks.num_blocks == 12
+    assert list(blocks.chrom) == ["1"] * 4 + ["2"] * 8
+
+    # the point estimate is the genome-wide value
+    expected = (ts1.diversity() * 1e5 + ts2.diversity() * 2e5) / 3e5
+    assert blocks.point_estimates()[("diversity", "all")] == pytest.approx(expected)
+
+    rows = confidence_intervals(blocks, replicates=200, seed=42)
+    stats = {(row["stat"], row["group"]): row for row in rows}
+
+    row = stats[("diversity", "all")]
+    assert row["estimate"] == pytest.approx(expected)
+    assert row["jackknife_low"] < row["estimate"] < row["jackknife_high"]
+    assert row["bootstrap_low"] <= row["estimate"] <= row["bootstrap_high"]
+    assert ("Fst", "Texel-Frizarta") in stats
+
+
+def test_block_matrix_hyphenated_breeds():
+    ts = make_mutated_ts(1, 1e5, "1", breeds=("Texel-UK", "Frizarta"))
+    blocks = BlockMatrix.from_chroms([chrom_stats(ts, "1", window_size=2.5e4)])
+
+    estimates = blocks.point_estimates()
+    pi1 = estimates[("diversity", "Texel-UK")]
+    pi2 = estimates[("diversity", "Frizarta")]
+    d12 = estimates[("divergence", "Texel-UK-Frizarta")]
+
+    assert estimates[("Fst", "Texel-UK-Frizarta")] == pytest.approx(
+        1 - (pi1 + pi2) / 2 / d12
+    )
+
+
+def test_stats_ci(tmp_path):
+    path = tmp_path / "chr1.trees"
+    make_mutated_ts(1, 1e5, "1").dump(str(path))
+
+    result = CliRunner().invoke(
+        stats_ci,
+        [
+            "--input_trees", str(path),
+            "--block_size", "20000",
+            "--replicates", "50",
+            "--seed", "1",
+            "--output", str(tmp_path / "ci.tsv"),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    with open(tmp_path / "ci.tsv") as handle:
+        rows = list(csv.DictReader(handle, delimiter="\t"))
+
+    assert {row["num_blocks"] for row in rows} == {"5"}
+    assert rows[0]["stat"] == "diversity"
+    assert rows[0]["group"] == "all"
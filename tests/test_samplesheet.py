@@ -0,0 +1,151 @@
+"""
+Unit tests for samplesheet.py functions
+"""
+
+import os
+import gzip
+
+import pytest
+from click.testing import CliRunner
+
+from tskitetude.samplesheet import (
+    create_fid_iid,
+    guess_delimiter,
+    load_sample_sheet,
+    read_vcf_samples,
+)
+
+HEADER = (
+    "##fileformat=VCFv4.2\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{samples}\n"
+)
+
+RECORD = "1\t10\t.\tA\tG\t.\tPASS\t.\tGT\t{genotypes}\n"
+
+
+def write_vcf(path, samples):
+    with gzip.open(path, "wt") as handle:
+        handle.write(HEADER.format(samples="\t".join(samples)))
+        handle.write(RECORD.format(genotypes="\t".join(["0|1"] * len(samples))))
+
+
+def test_read_vcf_samples(tmp_path):
+    vcf_file = tmp_path / "test.vcf.gz"
+    write_vcf(vcf_file, ["tsk_2", "tsk_0", "tsk_1"])
+
+    assert read_vcf_samples(str(vcf_file)) == ["tsk_2", "tsk_0", "tsk_1"]
+
+
+@pytest.mark.parametrize("name,mode", [("test.bcf", "wb"), ("test.bgz", "wz")])
+def test_read_vcf_samples_formats(tmp_path, name, mode):
+    cyvcf2 = pytest.importorskip("cyvcf2")
+
+    vcf_file = tmp_path / "test.vcf.gz"
+    write_vcf(vcf_file, ["tsk_2", "tsk_0", "tsk_1"])
+
+    # BCF and BGZF compressed files (the header is enough), detected
+    # without the .gz extension
+    vcf = cyvcf2.VCF(str(vcf_file))
+    writer = cyvcf2.Writer(str(tmp_path / name), vcf, mode=mode)
+    writer.write_header()
+    writer.close()
+    vcf.close()
+
+    assert read_vcf_samples(str(tmp_path / name)) == ["tsk_2", "tsk_0", "tsk_1"]
+
+
+def test_create_fid_iid(tmp_path):
+    indiv_list = tmp_path / "popKey"
+    indiv_list.write_text("tsk_0\tMM\ntsk_1\tMM\ntsk_2\tNN\ntsk_3\tNN\n")
+
+    write_vcf(tmp_path / "first.vcf.gz", ["tsk_2", "tsk_0", "tsk_1"])
+    write_vcf(tmp_path / "second.vcf.gz", ["tsk_3"])
+
+    runner = CliRunner()
+    result = runner.invoke(
+        create_fid_iid,
+        ["--indiv_list", str(indiv_list), "--directory", str(tmp_path)],
+    )
+
+    assert result.exit_code == 0, result.output
+
+    # individuals are written in VCF order
+    assert (tmp_path / "first.sample_names.txt").read_text() == (
+        "NN\ttsk_2\nMM\ttsk_0\nMM\ttsk_1\n"
+    )
+    assert (tmp_path / "second.sample_names.txt").read_text() == "NN\ttsk_3\n"
+
+
+def test_create_fid_iid_missing(tmp_path):
+    indiv_list = tmp_path / "popKey"
+    indiv_list.write_text("tsk_0\tMM\n")
+
+    write_vcf(tmp_path / "first.vcf.gz", ["tsk_0"])
+    write_vcf(tmp_path / "second.vcf.gz", ["tsk_0", "tsk_9"])
+
+    runner = CliRunner()
+    result = runner.invoke(
+        create_fid_iid,
+        ["--indiv_list", str(indiv_list), "--directory", str(tmp_path)],
+    )
+
+    assert result.exit_code != 0
+    assert "tsk_9" in result.output
+
+    # nothing is written if any VCF doesn't validate
+    assert not list(tmp_path.glob("*.sample_names.txt"))
+
+
+def test_guess_delimiter():
+    assert guess_delimiter("PopA\tSample 1\n") == "\t"
+    assert guess_delimiter("PopA,Sample1\n") == ","
+    assert guess_delimiter("PopA Sample1\n") == " "
+
+
+def test_load_sample_sheet(tmp_path):
+    sheet_file = tmp_path / "samples.csv"
+    sheet_file.write_text("PopB,Sample1\nPopA,Sample2\n\nPopB,Sample3,extra\n")
+
+    sheet = load_sample_sheet(str(sheet_file))
+
+    assert len(sheet) == 3
+    assert sheet.sample_ids == ("Sample1", "Sample2", "Sample3")
+    assert sheet.populations == ("PopB", "PopA")
+    assert sheet.population_index.tolist() == [0, 1, 0]
+    assert list(sheet) == [
+        ("PopB", "Sample1"),
+        ("PopA", "Sample2"),
+        ("PopB", "Sample3"),
+    ]
+    assert sheet.sample_index["Sample3"] == 2
+
+
+def test_load_sample_sheet_cached(tmp_path):
+    sheet_file = tmp_path / "samples.tsv"
+    sheet_file.write_text("PopA\tSample1\n")
+
+    sheet = load_sample_sheet(str(sheet_file))
+    assert load_sample_sheet(str(sheet_file)) is sheet
+
+    # a modified file is read again
+    sheet_file.write_text("PopA\tSample1\nPopA\tSample2\n")
+    stat = os.stat(sheet_file)
+    os.utime(sheet_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert load_sample_sheet(str(sheet_file)).sample_ids == ("Sample1", "Sample2")
+
+
+def test_load_sample_sheet_delimiter(tmp_path):
+    sheet_file = tmp_path / "samples.tsv"
+    sheet_file.write_text("Pop A\tSample,1\n")
+
+    assert load_sample_sheet(str(sheet_file), "tab").sample_ids == ("Sample,1",)
+    assert load_sample_sheet(str(sheet_file), "\t").breeds == ("Pop A",)
+
+
+def test_load_sample_sheet_malformed(tmp_path):
+    sheet_file = tmp_path / "samples.tsv"
+    sheet_file.write_text("PopA\nPopB\n")
+
+    with pytest.raises(ValueError, match="at least two fields"):
+        load_sample_sheet(str(sheet_file))
@@ -0,0 +1,243 @@
+"""
+Unit tests for siteqc.py functions
+"""
+
+import tempfile
+
+import cyvcf2
+import numpy as np
+import pytest
+import tsinfer
+from click.testing import CliRunner
+
+from tskitetude.helper import add_diploid_individuals, add_diploid_sites, add_populations
+from tskitetude.siteqc import (
+    SITE_DUPLICATE,
+    SITE_INVALID_ALLELE,
+    SITE_MISSING,
+    SITE_UNPHASED,
+    genotype_qc,
+    qc_vcf,
+    qc_vcz,
+    site_qc,
+)
+from tskitetude.vcfzarr import vcf_to_vcz
+
+# Sample2 is unphased at 500, Sample3 has missing genotypes
+VCF = """##fileformat=VCFv4.2
+##contig=<ID=chr1,length=1000>
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSample1\tSample2\tSample3
+chr1\t100\t.\tA\tT\t.\tPASS\t.\tGT\t0|0\t0|1\t1|1
+chr1\t200\t.\tC\tG,T\t.\tPASS\t.\tGT\t0|1\t1|1\t2|2
+chr1\t200\t.\tC\tA\t.\tPASS\t.\tGT\t0|1\t1|1\t0|0
+chr1\t300\t.\tA\tN\t.\tPASS\t.\tGT\t1|1\t0|0\t0|1
+chr1\t400\t.\tT\tC\t.\tPASS\t.\tGT\t1|1\t1|0\t.|.
+chr1\t500\t.\tG\tA\t.\tPASS\t.\tGT\t1|1\t1/0\t0|0
+"""
+
+
+@pytest.fixture
+def vcf_file(tmp_path):
+    vcf_file = tmp_path / "test.vcf"
+    vcf_file.write_text(VCF)
+    return str(vcf_file)
+
+
+def test_genotype_qc():
+    genotypes = np.array(
+        [
+            [[0, 1], [1, 1], [-1, -1]],
+            [[0, 1], [0, -1], [1, 0]],
+        ]
+    )
+    phased = np.array([[True, False, False], [True, True, False]])
+
+    missing, unphased = genotype_qc(genotypes, phased)
+
+    assert missing.tolist() == pytest.approx([1 / 3, 1 / 3])
+    # a missing genotype is not unphased
+    assert unphased.tolist() == [1, 1]
+
+
+def test_qc_vcf(vcf_file):
+    qc = qc_vcf(vcf_file, batch_size=4, max_missing=0.2)
+
+    assert qc.position.tolist() == [100, 200, 200, 300, 400, 500]
+    assert qc.num_alleles.tolist() == [2, 3, 2, 2, 2, 2]
+    assert qc.flags.tolist() == [
+        0,
+        0,
+        SITE_DUPLICATE,
+        SITE_INVALID_ALLELE,
+        SITE_MISSING,
+        SITE_UNPHASED,
+    ]
+    assert qc.mask.tolist() == [False, False, True, True, True, False]
+
+    summary = qc.summary()
+    assert summary["sites"] == 6
+    assert summary["multiallelic"] == 1
+    assert summary["masked"] == 3
+
+    errors = qc.errors()
+    assert len(errors) == 1
+    assert errors[0] == "1 unphased sites at positions [500]"
+
+
+def test_qc_vcf_samples(vcf_file):
+    # without Sample2, all sites are phased
+    qc = qc_vcf(vcf_file, ["Sample3", "Sample1"])
+
+    assert qc.errors() == []
+    assert qc.missing.tolist() == pytest.approx([0, 0, 0, 0, 0.5, 0])
+
+    with pytest.raises(ValueError, match="Sample9"):
+        qc_vcf(vcf_file, ["Sample9"])
+
+
+def test_qc_vcz(vcf_file, tmp_path):
+    vcz_path = str(tmp_path / "test.vcz")
+    vcf_to_vcz(vcf_file, vcz_path, variants_chunk_size=4)
+
+    expected = qc_vcf(vcf_file, max_missing=0.2)
+    qc = qc_vcz(vcz_path, max_missing=0.2)
+
+    assert qc.flags.tolist() == expected.flags.tolist()
+    assert qc.num_alleles.tolist() == expected.num_alleles.tolist()
+    assert qc.missing.tolist() == pytest.approx(expected.missing.tolist())
+
+
+def test_multiple_chromosomes(tmp_path):
+    vcf_file = tmp_path / "test.vcf"
+    vcf_file.write_text(
+        VCF.replace("chr1\t500", "chr2\t400")
+        + "chr2\t500\t.\tG\tA\t.\tPASS\t.\tGT\t1|1\t1|0\t0|0\n"
+    )
+
+    qc = qc_vcf(str(vcf_file), ["Sample1", "Sample3"])
+
+    # the same position in another chromosome is not a duplicate
+    assert not qc.flags[-2] & SITE_DUPLICATE
+    assert qc.errors() == ["Input contains multiple chromosomes: ['chr1', 'chr2']"]
+
+
+def test_site_qc(vcf_file, tmp_path):
+    report = tmp_path / "report.tsv"
+    output_mask = tmp_path / "mask.npy"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        site_qc,
+        ["--vcf", vcf_file, "--report", str(report), "--output_mask", str(output_mask)],
+    )
+
+    # unphased sites: the report is written, not the mask
+    assert result.exit_code == 1
+    assert "1 unphased sites at positions [500]" in result.output
+    assert len(report.read_text().splitlines()) == 7
+    assert not output_mask.exists()
+
+    focal_csv = tmp_path / "focal.csv"
+    focal_csv.write_text("PopA,Sample1\nPopB,Sample3\n")
+
+    result = runner.invoke(
+        site_qc,
+        [
+            "--vcf",
+            vcf_file,
+            "--samples",
+            str(focal_csv),
+            "--output_mask",
+            str(output_mask),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert np.load(output_mask).tolist() == [False, False, True, True, False, False]
+
+
+def test_add_diploid_sites_mask(vcf_file, tmp_path):
+    focal_csv = tmp_path / "focal.csv"
+    focal_csv.write_text("PopA,Sample1\nPopB,Sample3\n")
+
+    site_mask = qc_vcf(vcf_file, ["Sample1", "Sample3"]).mask
+
+    with tempfile.NamedTemporaryFile(suffix=".samples") as tmp:
+        with tsinfer.SampleData(path=tmp.name, sequence_length=1000) as samples:
+            pop_lookup = add_populations(str(focal_csv), samples)
+            indv_lookup = add_diploid_individuals(str(focal_csv), pop_lookup, samples)
+
+            with cyvcf2.VCF(vcf_file) as vcf:
+                add_diploid_sites(
+                    vcf,
+                    samples,
+                    {},
+                    indv_lookup,
+                    ancestral_method="reference",
+                    site_mask=site_mask,
+                )
+
+        assert samples.sites_position[:].tolist() == [100, 200, 400, 500]
+
+
+def test_add_diploid_sites_invalid_allele(vcf_file, tmp_path):
+    focal_csv = tmp_path / "focal.csv"
+    focal_csv.write_text("PopA,Sample1\nPopB,Sample3\n")
+
+    with tempfile.NamedTemporaryFile(suffix=".samples") as tmp:
+        with tsinfer.SampleData(path=tmp.name, sequence_length=1000) as samples:
+            pop_lookup = add_populations(str(focal_csv), samples)
+            indv_lookup = add_diploid_individuals(str(focal_csv), pop_lookup, samples)
+
+            with cyvcf2.VCF(vcf_file) as vcf:
+                add_diploid_sites(
+                    vcf, samples, {}, indv_lookup, ancestral_method="reference"
+                )
+
+        # the site with the 'N' allele is skipped, like the duplicated one
+        assert samples.sites_position[:].tolist() == [100, 200, 400, 500]
+
+
+def test_add_diploid_sites_max_missing(vcf_file, tmp_path):
+    focal_csv = tmp_path / "focal.csv"
+    focal_csv.write_text("PopA,Sample1\nPopB,Sample3\n")
+
+    with tempfile.NamedTemporaryFile(suffix=".samples") as tmp:
+        with tsinfer.SampleData(path=tmp.name, sequence_length=1000) as samples:
+            pop_lookup = add_populations(str(focal_csv), samples)
+            indv_lookup = add_diploid_individuals(str(focal_csv), pop_lookup, samples)
+
+            with cyvcf2.VCF(vcf_file) as vcf:
+                add_diploid_sites(
+                    vcf,
+                    samples,
+                    {},
+                    indv_lookup,
+                    ancestral_method="reference",
+                    max_missing=0.2,
+                )
+
+        # the same sites of the site QC mask, checked in a single pass
+        assert samples.sites_position[:].tolist() == [100, 200, 500]
+
+
+def test_add_diploid_sites_short_mask(vcf_file, tmp_path):
+    focal_csv = tmp_path / "focal.csv"
+    focal_csv.write_text("PopA,Sample1\nPopB,Sample3\n")
+
+    with tempfile.NamedTemporaryFile(suffix=".samples") as tmp:
+        with tsinfer.SampleData(path=tmp.name, sequence_length=1000) as samples:
+            pop_lookup = add_populations(str(focal_csv), samples)
+            indv_lookup = add_diploid_individuals(str(focal_csv), pop_lookup, samples)
+
+            with cyvcf2.VCF(vcf_file) as vcf:
+                with pytest.raises(ValueError, match="Site mask has 3 values"):
+                    add_diploid_sites(
+                        vcf,
+                        samples,
+                        {},
+                        indv_lookup,
+                        ancestral_method="reference",
+                        site_mask=np.zeros(3, dtype=bool),
+                    )
@@ -0,0 +1,523 @@
+"""
+Unit tests for smarterapi.py functions. Requests are served by fake
+endpoints, without network access.
+"""
+
+import io
+import math
+import asyncio
+import threading
+
+import aiohttp
+import pytest
+from click.testing import CliRunner
+from yarl import URL
+
+from tskitetude import smarterapi
+from tskitetude.smarterapi import (
+    AsyncSmarterClient,
+    EndPointMixin,
+    Location,
+    LocationTable,
+    Mirror,
+    PaginationError,
+    RetryPolicy,
+    SmarterClient,
+    VariantsEndpoint,
+    paginate,
+    top2forward,
+    use_mirror,
+)
+
+
+def make_page(page, size, total):
+    pages = math.ceil(total / size)
+    start = (page - 1) * size
+
+    return {
+        "items": [
+            {
+                "name": f"snp{idx}",
+                "locations": [
+                    {
+                        "chrom": "1",
+                        "position": idx + 1,
+                        "alleles": "A/G",
+                        "illumina_top": "A/G",
+                        "illumina_forward": "T/C",
+                    }
+                ],
+            }
+            for idx in range(start, min(start + size, total))
+        ],
+        "page": page,
+        "pages": pages,
+        "size": size,
+        "total": total,
+        "next": None if page == pages else f"page={page + 1}",
+    }
+
+
+class FakeMixin:
+    """Serve pages without network access and track the requested pages"""
+
+    total = 95
+
+    # pages which fail the first time they are requested
+    failing = set()
+
+    # pages which fail with an HTTP status the first time they are requested
+    failing_status = {}
+
+    def get(self, **kwargs):
+        kwargs = self._update_kwargs(kwargs)
+
+        with self.lock:
+            self.requested.append(kwargs["page"])
+
+        return make_page(kwargs["page"], kwargs["size"], self.total)
+
+    async def _get_async_once(self, session, **kwargs):
+        kwargs = self._update_kwargs(kwargs)
+        page = kwargs["page"]
+
+        with self.lock:
+            self.requested.append(page)
+
+        # pages are completed in random order
+        await asyncio.sleep(0.001 * ((page * 7) % 5))
+
+        if page in self.failing:
+            self.failing.discard(page)
+            raise aiohttp.ClientError(f"Failed page {page}")
+
+        if page in self.failing_status:
+            raise aiohttp.ClientResponseError(
+                aiohttp.RequestInfo(URL("http://localhost/"), "GET", {}),
+                (),
+                status=self.failing_status.pop(page),
+                message="error",
+            )
+
+        return self._parse_response(make_page(page, kwargs["size"], self.total))
+
+
+class FakeEndpoint(FakeMixin, EndPointMixin):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requested = []
+
+
+class FakeVariantsEndpoint(FakeMixin, VariantsEndpoint):
+    def __init__(self):
+        super().__init__(species="Sheep", assembly="OAR3")
+        self.lock = threading.Lock()
+        self.requested = []
+
+
+def test_iter_pages():
+    endpoint = FakeEndpoint()
+    pages = [page["page"] for page in endpoint.iter_pages(size=10)]
+
+    assert pages == list(range(1, 11))
+    assert sorted(endpoint.requested) == list(range(1, 11))
+
+
+def test_iter_pages_bounded():
+    endpoint = FakeEndpoint()
+    iterator = endpoint.iter_pages(prefetch=2, size=10)
+
+    # consume the first page: no more than the next two pages are downloaded
+    next(iterator)
+    iterator.close()
+
+    assert set(endpoint.requested) <= {1, 2, 3}
+
+
+def test_iter_pages_no_prefetch():
+    endpoint = FakeEndpoint()
+    iterator = endpoint.iter_pages(prefetch=0, size=10)
+
+    # pages are downloaded only when requested
+    assert next(iterator)["page"] == 1
+    assert endpoint.requested == [1]
+
+    assert [page["page"] for page in iterator] == list(range(2, 11))
+    assert endpoint.requested == list(range(1, 11))
+
+    with pytest.raises(ValueError):
+        next(endpoint.iter_pages(prefetch=-1, size=10))
+
+
+def test_iter_variants():
+    endpoint = FakeVariantsEndpoint()
+    variants = list(endpoint.iter_variants(chip_name="IlluminaOvineSNP50", size=10))
+
+    assert len(variants) == FakeVariantsEndpoint.total
+    assert [variant["name"] for variant in variants] == [
+        f"snp{idx}" for idx in range(FakeVariantsEndpoint.total)
+    ]
+
+    # locations are un-nested
+    assert variants[0]["locations"]["position"] == 1
+
+
+async def collect_pages(endpoint, session=None, **kwargs):
+    return [page async for page in paginate(endpoint, session, **kwargs)]
+
+
+def test_paginate():
+    endpoint = FakeEndpoint()
+    progress = []
+
+    pages = asyncio.run(
+        collect_pages(
+            endpoint,
+            size=10,
+            max_concurrency=4,
+            progress=lambda page, total: progress.append((page, total)),
+        )
+    )
+
+    assert [page["page"] for page in pages] == list(range(1, 11))
+    assert progress == [(page, 10) for page in range(1, 11)]
+
+
+def test_paginate_retry():
+    endpoint = FakeVariantsEndpoint()
+    endpoint.failing = {3, 7}
+
+    pages = asyncio.run(collect_pages(endpoint, size=10, backoff_factor=0))
+
+    assert [page["page"] for page in pages] == list(range(1, 11))
+    assert endpoint.requested.count(3) == 2
+    assert endpoint.requested.count(7) == 2
+
+    # variants are un-nested
+    assert pages[0]["items"][0]["locations"]["position"] == 1
+
+
+def test_paginate_error():
+    endpoint = FakeEndpoint()
+    endpoint.failing = {4}
+
+    with pytest.raises(PaginationError) as excinfo:
+        asyncio.run(collect_pages(endpoint, size=10, retries=1, backoff_factor=0))
+
+    assert excinfo.value.page == 4
+
+
+def test_paginate_status_retry():
+    endpoint = FakeEndpoint()
+
+    # 503 is retried, 404 fails without retrying
+    endpoint.failing_status = {3: 503}
+    pages = asyncio.run(collect_pages(endpoint, size=10, backoff_factor=0))
+    assert [page["page"] for page in pages] == list(range(1, 11))
+    assert endpoint.requested.count(3) == 2
+
+    endpoint = FakeEndpoint()
+    endpoint.failing_status = {5: 404}
+
+    with pytest.raises(PaginationError) as excinfo:
+        asyncio.run(collect_pages(endpoint, size=10, backoff_factor=0))
+
+    assert excinfo.value.page == 5
+    assert endpoint.requested.count(5) == 1
+
+
+def test_get_async_status_retry():
+    endpoint = FakeEndpoint()
+    endpoint.failing_status = {1: 401}
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(endpoint.get_async(None, page=1, size=10, backoff_factor=0))
+
+    assert endpoint.requested == [1]
+
+    endpoint = FakeEndpoint()
+    endpoint.failing_status = {1: 429}
+    page = asyncio.run(endpoint.get_async(None, page=1, size=10, backoff_factor=0))
+
+    assert page["page"] == 1
+    assert endpoint.requested == [1, 1]
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """Serve the SMARTER variants API with an ETag"""
+
+    def __init__(self, total):
+        self.total = total
+        self.etag = '"v1"'
+        self.alleles = "A/G"
+        self.requested = []
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.requested.append(params)
+
+        if headers and headers.get("If-None-Match") == self.etag:
+            return FakeResponse(304)
+
+        page = make_page(params["page"], params["size"], self.total)
+
+        # records could be modified in place
+        for item in page["items"]:
+            item["locations"][0]["alleles"] = self.alleles
+
+        return FakeResponse(200, page, {"ETag": self.etag})
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    session = FakeSession(total=95)
+    monkeypatch.setattr(smarterapi.CLIENT, "session", session)
+
+    return Mirror(tmp_path / "mirror"), session
+
+
+def test_mirror_sync(mirror):
+    mirror, session = mirror
+    endpoint = VariantsEndpoint(species="Sheep", assembly="OAR3")
+
+    assert mirror.sync(endpoint, size=10)
+    assert mirror.read_state(endpoint)["total"] == 95
+    assert mirror.read_table(endpoint).num_rows == 95
+    assert (mirror.path / "variants-sheep-OAR3.parquet").exists()
+
+    # not modified: only the conditional request is done
+    session.requested = []
+    assert not mirror.sync(endpoint, size=10)
+    assert len(session.requested) == 1
+
+    # new records: download only the pages with the new records
+    session.total, session.etag = 120, '"v2"'
+    session.requested = []
+    assert mirror.sync(endpoint, size=10)
+    # the last stored record is checked before the new pages
+    assert session.requested[1] == {"page": 95, "size": 1}
+    assert [params["page"] for params in session.requested[2:]] == [10, 11, 12]
+
+    table = mirror.read_table(endpoint)
+    assert table.num_rows == 120
+    assert table.column("name").to_pylist() == [f"snp{idx}" for idx in range(120)]
+
+
+def test_mirror_sync_modified(mirror):
+    mirror, session = mirror
+    endpoint = VariantsEndpoint(species="Sheep", assembly="OAR3")
+    mirror.sync(endpoint, size=10)
+
+    def alleles():
+        table = mirror.read_table(endpoint)
+        return {
+            location["alleles"]
+            for locations in table.column("locations").to_pylist()
+            for location in locations
+        }
+
+    # same number of records modified in place: download everything again
+    session.alleles, session.etag = "C/T", '"v2"'
+    session.requested = []
+    assert mirror.sync(endpoint, size=10)
+    assert [params["page"] for params in session.requested[1:]] == list(range(1, 11))
+    assert alleles() == {"C/T"}
+
+    # new records and modified ones: download everything again
+    session.total, session.alleles, session.etag = 120, "A/C", '"v3"'
+    session.requested = []
+    assert mirror.sync(endpoint, size=10)
+    assert [params["page"] for params in session.requested[2:]] == list(range(1, 13))
+    assert mirror.read_table(endpoint).num_rows == 120
+    assert alleles() == {"A/C"}
+
+
+def test_mirror_query(mirror):
+    mirror, session = mirror
+    endpoint = VariantsEndpoint(species="Sheep", assembly="OAR3", mirror=mirror)
+    mirror.sync(endpoint, size=10)
+
+    session.requested = []
+
+    data = endpoint.get_variants(region="1:11-30", size=15)
+    assert data["total"] == 20
+    assert data["pages"] == 2
+    assert data["next"] is not None
+    assert [item["locations"]["position"] for item in data["items"]] == list(
+        range(11, 26)
+    )
+
+    data = endpoint.get_variants(region="1:11-30", size=15, page=2)
+    assert len(data["items"]) == 5
+    assert data["next"] is None
+
+    assert endpoint.get_variants(region="2")["total"] == 0
+    assert endpoint.get_variants(name="snp3")["items"][0]["name"] == "snp3"
+
+    # no network access in mirror mode
+    assert session.requested == []
+
+    with pytest.raises(NotImplementedError):
+        endpoint.get_variants(unknown="param")
+
+
+def test_use_mirror(mirror):
+    mirror, _ = mirror
+    mirror.sync(VariantsEndpoint(species="Sheep", assembly="OAR3"), size=10)
+
+    use_mirror(mirror.path)
+
+    try:
+        endpoint = VariantsEndpoint(species="Sheep", assembly="OAR3")
+        variants = list(endpoint.iter_variants(size=50))
+        assert len(variants) == 95
+
+    finally:
+        use_mirror(None)
+
+
+class FlakySession:
+    """Fail the first requests with a HTTP 503 error"""
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        if self.failures:
+            self.failures -= 1
+            return FakeResponse(503, "Service unavailable")
+
+        return FakeResponse(200, make_page(params["page"], params["size"], 95))
+
+
+def test_client_retry():
+    client = SmarterClient(retry=RetryPolicy(retries=3, backoff_factor=0))
+    client.session = FlakySession(failures=2)
+
+    endpoint = VariantsEndpoint(species="Sheep", assembly="OAR3", client=client)
+    data = endpoint.get_variants(size=10)
+
+    assert len(data["items"]) == 10
+    assert client.stats.requests == 3
+    assert client.stats.failures == 2
+    assert client.stats.retries == 2
+
+
+def test_client_retry_exhausted():
+    client = SmarterClient(retry=RetryPolicy(retries=2, backoff_factor=0))
+    client.session = FlakySession(failures=2)
+
+    endpoint = VariantsEndpoint(species="Sheep", assembly="OAR3", client=client)
+
+    with pytest.raises(Exception, match="Failed to get data"):
+        endpoint.get_variants(size=10)
+
+    assert client.stats.retries == 1
+
+
+def test_paginate_client_stats():
+    endpoint = FakeEndpoint()
+    endpoint.failing = {2}
+    client = AsyncSmarterClient(retry=RetryPolicy(backoff_factor=0))
+
+    pages = asyncio.run(collect_pages(endpoint, session=client, size=10))
+
+    assert len(pages) == 10
+    assert client.stats.retries == 1
+
+
+def test_location():
+    item = make_page(1, 1, 1)["items"][0]
+    location = Location(name=item["name"], data=item["locations"][0])
+
+    assert not hasattr(location, "__dict__")
+    assert location.to_update_alleles() == ["snp0", "A", "G", "T", "C"]
+
+    location.illumina_forward = None
+
+    with pytest.raises(AttributeError):
+        location.to_update_alleles()
+
+
+def test_location_table():
+    items = FakeVariantsEndpoint().get_variants(size=5)["items"]
+    items[2]["locations"]["illumina_forward"] = None
+    items[4]["locations"]["illumina_top"] = None
+
+    table = LocationTable.concatenate(
+        [LocationTable.from_items(items[:3]), LocationTable.from_items(items[3:])]
+    )
+
+    assert len(table) == 5
+    assert table.position.tolist() == [1, 2, 3, 4, 5]
+    assert table[1].to_update_alleles() == ["snp1", "A", "G", "T", "C"]
+    assert table[2].illumina_forward is None
+
+    records, mask = table.to_update_alleles()
+
+    # locations without a TOP or a FORWARD coding are skipped
+    assert mask.tolist() == [True, True, False, True, False]
+    assert records.shape == (3, 5)
+
+    handle = io.StringIO()
+
+    assert table.write_update_alleles(handle) == 3
+    assert handle.getvalue().splitlines() == [
+        f"snp{idx}\tA\tG\tT\tC" for idx in (0, 1, 3)
+    ]
+
+
+@pytest.mark.parametrize("alleles", ["A/C/G", "A/", "-", ""])
+def test_location_table_malformed_alleles(alleles):
+    items = FakeVariantsEndpoint().get_variants(size=3)["items"]
+    items[1]["locations"]["illumina_forward"] = alleles
+
+    # malformed alleles are skipped, not raised
+    table = LocationTable.from_items(items)
+    records, mask = table.to_update_alleles()
+
+    assert mask.tolist() == [True, False, True]
+    assert records[:, 0].tolist() == [b"snp0", b"snp2"]
+
+
+def test_top2forward_resume(tmp_path, monkeypatch):
+    output = tmp_path / "top2forward.tsv"
+    failing = {"page": 4}
+
+    async def get_async_once(self, session, **kwargs):
+        kwargs = self._update_kwargs(kwargs)
+
+        if kwargs["page"] == failing["page"]:
+            raise aiohttp.ClientError("Connection dropped")
+
+        return self._parse_response(make_page(kwargs["page"], kwargs["size"], 95))
+
+    monkeypatch.setattr(VariantsEndpoint, "_get_async_once", get_async_once)
+
+    runner = CliRunner()
+    args = ["--size", "10", "--retries", "1", "--output", str(output)]
+
+    result = runner.invoke(top2forward, args)
+    assert result.exit_code != 0
+
+    # pages are written in order: stopped before the failed page
+    written = len(output.read_text().splitlines())
+    assert written <= 30 and written % 10 == 0
+
+    failing["page"] = None
+    result = runner.invoke(top2forward, args + ["--resume"])
+    assert result.exit_code == 0, result.output
+
+    assert output.read_text().splitlines() == [
+        f"snp{idx}\tA\tG\tT\tC" for idx in range(95)
+    ]
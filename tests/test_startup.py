@@ -0,0 +1,125 @@
+"""
+Startup tests for the command line entry points: --help and lightweight
+commands must not import the heavy dependencies and must stay below a target
+latency (3 s by default, set with the TSKITETUDE_STARTUP_TARGET environment
+variable: 0 disables the check on slow machines)
+"""
+
+import os
+import sys
+import gzip
+import json
+import subprocess
+
+import pytest
+
+STARTUP_TARGET = float(os.environ.get("TSKITETUDE_STARTUP_TARGET", 3.0))
+
+# modules imported only when a command runs
+HEAVY_MODULES = [
+    "tsinfer",
+    "tsdate",
+    "tszip",
+    "cyvcf2",
+    "zarr",
+    "numcodecs",
+    "pandas",
+    "ensemblrest",
+]
+
+# the entry points in pyproject.toml (smarterapi ones need their clients)
+ENTRY_POINTS = [
+    ("tskitetude.estsfs", "make_est_sfs_input"),
+    ("tskitetude.estsfs", "parse_est_sfs_output"),
+    ("tskitetude.helper", "create_tstree"),
+    ("tskitetude.helper", "annotate_tree"),
+    ("tskitetude.ensembl", "collect_compara_ancestors"),
+    ("tskitetude.ensembl", "collect_fasta_ancestors"),
+    ("tskitetude.fasta", "fake_fasta_from_vcf"),
+    ("tskitetude.samplesheet", "create_fid_iid"),
+    ("tskitetude.vcfzarr", "vcf_to_zarr"),
+    ("tskitetude.dating", "date_tstree"),
+    ("tskitetude.siteqc", "site_qc"),
+    ("tskitetude.gnn", "gnn"),
+    ("tskitetude.genomestats", "genome_stats"),
+    ("tskitetude.resampling", "stats_ci"),
+    ("tskitetude.cli", "cli"),
+]
+
+CHILD = """
+import sys, json, time
+start = time.perf_counter()
+from {module} import {command}
+{command}.main({args!r}, standalone_mode=False)
+print(json.dumps({{
+    "elapsed": time.perf_counter() - start,
+    "modules": sorted(sys.modules),
+}}))
+"""
+
+
+def run_command(module: str, command: str, args: list) -> dict:
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            CHILD.format(module=module, command=command, args=args),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    stats["stdout"] = result.stdout
+
+    return stats
+
+
+def check_startup(stats: dict, command: str):
+    imported = [name for name in HEAVY_MODULES if name in stats["modules"]]
+
+    assert imported == [], f"{command} imports {imported}"
+
+    if STARTUP_TARGET > 0:
+        assert stats["elapsed"] < STARTUP_TARGET
+
+
+@pytest.mark.parametrize("module,command", ENTRY_POINTS)
+def test_help_startup(module, command):
+    stats = run_command(module, command, ["--help"])
+
+    assert "Usage:" in stats["stdout"]
+    check_startup(stats, command)
+
+
+def test_cli_help_without_tskit():
+    # tskit is imported by the commands, not by the package
+    stats = run_command("tskitetude.cli", "cli", ["--help"])
+
+    assert "tskit" not in stats["modules"]
+
+
+def test_create_fid_iid_startup(tmp_path):
+    indiv_list = tmp_path / "popKey.txt"
+    indiv_list.write_text("ind1\tPopA\nind2\tPopB\n")
+
+    header = "\t".join(
+        ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"]
+        + ["ind2", "ind1"]
+    )
+    (tmp_path / "test.vcf.gz").write_bytes(
+        gzip.compress(f"##fileformat=VCFv4.2\n{header}\n".encode())
+    )
+
+    stats = run_command(
+        "tskitetude.samplesheet",
+        "create_fid_iid",
+        ["--indiv_list", str(indiv_list), "--directory", str(tmp_path)],
+    )
+
+    assert (tmp_path / "test.sample_names.txt").read_text() == (
+        "PopB\tind2\nPopA\tind1\n"
+    )
+    assert "tskit" not in stats["modules"]
+    check_startup(stats, "create_fid_iid")
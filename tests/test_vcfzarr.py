@@ -0,0 +1,213 @@
+"""
+Unit tests for vcfzarr.py functions
+"""
+
+import tempfile
+
+import cyvcf2
+import numpy as np
+import pytest
+import tsinfer
+import zarr
+from click.testing import CliRunner
+
+from tskitetude.helper import add_diploid_individuals, add_diploid_sites, add_populations
+from tskitetude.samplesheet import load_sample_sheet
+from tskitetude.vcfzarr import get_ancestral_states, load_variant_data, vcf_to_zarr
+
+VCF = """##fileformat=VCFv4.2
+##contig=<ID=chr1,length=1000>
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSample1\tSample2\tSample3
+chr1\t100\t.\tA\tT\t.\tPASS\t.\tGT\t0|0\t0|1\t1|1
+chr1\t200\t.\tC\tG,T\t.\tPASS\t.\tGT\t0|1\t1|1\t2|2
+chr1\t200\t.\tC\tA\t.\tPASS\t.\tGT\t0|1\t1|1\t0|0
+chr1\t300\t.\tg\ta\t.\tPASS\t.\tGT\t1|1\t0|0\t0|1
+chr1\t400\t.\tT\tC\t.\tPASS\t.\tGT\t1|1\t1|0\t0|0
+"""
+
+
+@pytest.fixture
+def vcf_file(tmp_path):
+    vcf_file = tmp_path / "test.vcf"
+    vcf_file.write_text(VCF)
+    return str(vcf_file)
+
+
+@pytest.fixture
+def vcz_path(tmp_path, vcf_file):
+    vcz_path = str(tmp_path / "test.vcz")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        vcf_to_zarr,
+        ["--vcf", vcf_file, "--output", vcz_path, "--variants_chunk_size", "2"],
+    )
+
+    assert result.exit_code == 0, result.output
+
+    return vcz_path
+
+
+@pytest.fixture
+def focal_csv(tmp_path):
+    # Sample2 is not a focal sample
+    focal_csv = tmp_path / "focal.csv"
+    focal_csv.write_text("PopB,Sample3\nPopA,Sample1\n")
+    return str(focal_csv)
+
+
+def test_vcf_to_zarr(vcz_path):
+    root = zarr.open_group(vcz_path, mode="r")
+
+    assert root["sample_id"][:].tolist() == ["Sample1", "Sample2", "Sample3"]
+    assert root["contig_id"][:].tolist() == ["chr1"]
+    assert root["contig_length"][:].tolist() == [1000]
+    assert root["variant_position"][:].tolist() == [100, 200, 200, 300, 400]
+    assert root["variant_allele"][:].tolist() == [
+        ["A", "T", ""],
+        ["C", "G", "T"],
+        ["C", "A", ""],
+        ["G", "A", ""],
+        ["T", "C", ""],
+    ]
+    assert root["call_genotype"][1].tolist() == [[0, 1], [1, 1], [2, 2]]
+    assert root["call_genotype_phased"][:].all()
+    assert root["call_genotype"].chunks == (2, 10_000, 2)
+
+
+def test_get_ancestral_states(vcz_path):
+    root = zarr.open_group(vcz_path, mode="r")
+
+    assert get_ancestral_states(root, {}, "reference").tolist() == [
+        "A",
+        "C",
+        "C",
+        "G",
+        "T",
+    ]
+    assert get_ancestral_states(root, {}, "major").tolist() == [
+        "A",
+        "G",
+        "C",
+        "G",
+        "T",
+    ]
+
+    estsfs = {("chr1", 100): 1, ("chr1", 300): 0, ("chr1", 400): 5}
+    assert get_ancestral_states(root, estsfs, "estsfs").tolist() == [
+        "T",
+        "N",
+        "N",
+        "G",
+        "N",
+    ]
+
+    ensembl = {("chr1", 100): "T", ("chr1", 300): "c", ("chr1", 400): "C"}
+    assert get_ancestral_states(root, ensembl, "ensembl").tolist() == [
+        "T",
+        "N",
+        "N",
+        "N",
+        "C",
+    ]
+
+
+def test_load_variant_data(vcz_path, vcf_file, focal_csv):
+    variant_data = load_variant_data(
+        vcz_path, load_sample_sheet(focal_csv), {}, ancestral_method="reference"
+    )
+
+    assert variant_data.num_individuals == 2
+    assert variant_data.num_samples == 4
+    assert variant_data.sequence_length == 1000
+
+    # the duplicated position is skipped
+    assert variant_data.sites_position[:].tolist() == [100, 200, 300, 400]
+    assert variant_data.sites_ancestral_allele[:].tolist() == [0, 0, 0, 0]
+
+    # individuals follow VCF order, populations the sample sheet
+    assert [
+        metadata["sample_id"] for metadata in variant_data.individuals_metadata
+    ] == ["Sample1", "Sample3"]
+    assert variant_data.populations_metadata == [{"breed": "PopB"}, {"breed": "PopA"}]
+    assert variant_data.individuals_population.tolist() == [1, 0]
+
+    # same genotypes as reading the VCF with the same individual order
+    sample_csv = tempfile.NamedTemporaryFile(mode="w", suffix=".csv")
+    sample_csv.write("PopA,Sample1\nPopB,Sample3\n")
+    sample_csv.flush()
+
+    with tempfile.NamedTemporaryFile(suffix=".samples") as tmp:
+        with tsinfer.SampleData(path=tmp.name, sequence_length=1000) as samples:
+            pop_lookup = add_populations(sample_csv.name, samples)
+            indv_lookup = add_diploid_individuals(sample_csv.name, pop_lookup, samples)
+
+            with cyvcf2.VCF(vcf_file) as vcf:
+                add_diploid_sites(
+                    vcf, samples, {}, indv_lookup, ancestral_method="reference"
+                )
+
+        np.testing.assert_array_equal(
+            variant_data.sites_genotypes[:], samples.sites_genotypes[:]
+        )
+
+    sample_csv.close()
+
+    # the store is not modified
+    assert "populations_metadata" not in zarr.open_group(vcz_path, mode="r")
+
+
+def test_load_variant_data_missing_sample(vcz_path, tmp_path):
+    focal_csv = tmp_path / "missing.csv"
+    focal_csv.write_text("PopA,Sample1\nPopA,Sample9\n")
+
+    with pytest.raises(ValueError, match="Sample9"):
+        load_variant_data(vcz_path, load_sample_sheet(str(focal_csv)), {}, "reference")
+
+
+def test_load_variant_data_invalid_alleles(tmp_path, focal_csv):
+    # an indel and an N allele are not in ALLELE_CHARS
+    vcf_file = tmp_path / "invalid.vcf"
+    vcf_file.write_text(
+        VCF
+        + "chr1\t500\t.\tA\tAT\t.\tPASS\t.\tGT\t0|1\t0|0\t1|1\n"
+        + "chr1\t600\t.\tN\tC\t.\tPASS\t.\tGT\t0|1\t0|0\t1|1\n"
+        + "chr1\t700\t.\tA\tG\t.\tPASS\t.\tGT\t0|1\t0|0\t1|1\n"
+    )
+
+    vcz_path = str(tmp_path / "invalid.vcz")
+    result = CliRunner().invoke(
+        vcf_to_zarr, ["--vcf", str(vcf_file), "--output", vcz_path]
+    )
+    assert result.exit_code == 0, result.output
+
+    with tempfile.NamedTemporaryFile(suffix=".samples") as tmp:
+        with tsinfer.SampleData(path=tmp.name, sequence_length=1000) as samples:
+            pop_lookup = add_populations(focal_csv, samples)
+            indv_lookup = add_diploid_individuals(focal_csv, pop_lookup, samples)
+
+            with cyvcf2.VCF(str(vcf_file)) as vcf:
+                add_diploid_sites(
+                    vcf, samples, {}, indv_lookup, ancestral_method="reference"
+                )
+
+        expected = samples.sites_position[:].tolist()
+
+    assert expected == [100, 200, 300, 400, 700]
+
+    # the same sites are dropped from VCF Zarr, with or without a site mask
+    # (like the one of site_qc, masking only the duplicated position)
+    duplicates = np.zeros(8, dtype=bool)
+    duplicates[2] = True
+
+    for site_mask in (None, duplicates):
+        variant_data = load_variant_data(
+            vcz_path,
+            load_sample_sheet(focal_csv),
+            {},
+            ancestral_method="reference",
+            site_mask=site_mask,
+        )
+
+        assert variant_data.sites_position[:].tolist() == expected
@@ -6,8 +6,6 @@ An helper library to deal with tskit objects
 
 import pathlib
 
-import tskit
-
 __version__ = "0.5.2"
 __author__ = "Paolo Cozzi"
 
@@ -22,21 +20,29 @@ def get_data_dir() -> pathlib.PosixPath:
 
 
 # define metadata schema for individuals and populations
-POPULATION_METADATA_SCHEMA = tskit.MetadataSchema(
-    {
+_METADATA_SCHEMAS = {
+    "POPULATION_METADATA_SCHEMA": {
         "codec": "json",
         "type": "object",
         "properties": {"breed": {"type": "string"}},
         "required": ["breed"],
-    }
-)
-
-
-INDIVIDUAL_METADATA_SCHEMA = tskit.MetadataSchema(
-    {
+    },
+    "INDIVIDUAL_METADATA_SCHEMA": {
         "codec": "json",
         "type": "object",
         "properties": {"sample_id": {"type": "string"}},
         "required": ["sample_id"],
-    }
-)
+    },
+}
+
+
+def __getattr__(name: str):
+    # tskit is imported when a schema is first used, not with the package
+    if name in _METADATA_SCHEMAS:
+        import tskit
+
+        schema = tskit.MetadataSchema(_METADATA_SCHEMAS[name])
+        globals()[name] = schema
+        return schema
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,227 @@
+import json
+import base64
+import logging
+import dataclasses
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import tskit
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+# the key of the index in the top-level metadata of a tree sequence
+BREED_INDEX_KEY = "breed_index"
+
+
+def decode_metadata(metadata) -> dict:
+    """Metadata as a dictionary, also when written as JSON without a schema"""
+
+    if isinstance(metadata, bytes):
+        return json.loads(metadata) if metadata else {}
+
+    return metadata or {}
+
+
+def get_population_breeds(tables: tskit.TableCollection) -> List[str]:
+    """The breed of each population (the population ID when not set)"""
+
+    return [
+        decode_metadata(population.metadata).get("breed", f"pop{i}")
+        for i, population in enumerate(tables.populations)
+    ]
+
+
+def group_offsets(groups: np.ndarray, num_groups: int) -> np.ndarray:
+    """Offsets of each group in an array sorted by group"""
+
+    return np.concatenate(
+        [[0], np.cumsum(np.bincount(groups, minlength=num_groups))]
+    ).astype(np.int64)
+
+
+def encode_array(array: np.ndarray) -> str:
+    """Store an array of node IDs or offsets as base64 little-endian int32"""
+
+    return base64.b64encode(np.asarray(array, dtype="<i4").tobytes()).decode()
+
+
+def decode_array(data: str, dtype=np.int32) -> np.ndarray:
+    """Read an array written by encode_array"""
+
+    return np.frombuffer(base64.b64decode(data), dtype="<i4").astype(dtype)
+
+
+@dataclasses.dataclass
+class BreedIndex:
+    """
+    Breed sample sets and individual nodes of a tree sequence, as sorted node
+    arrays with offsets: the sample nodes of population ``i`` are
+    ``sample_nodes[breed_offsets[i]:breed_offsets[i + 1]]`` and the nodes of
+    individual ``j`` are
+    ``individual_nodes[individual_offsets[j]:individual_offsets[j + 1]]``.
+    ``num_nodes`` tells if the index still matches the tree sequence.
+    """
+
+    breeds: List[str]
+    sample_nodes: np.ndarray
+    breed_offsets: np.ndarray
+    individual_nodes: np.ndarray
+    individual_offsets: np.ndarray
+    num_nodes: int
+    populations: Dict[str, int] = dataclasses.field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        # the first population of each breed
+        self.populations = {}
+
+        for population, breed in enumerate(self.breeds):
+            self.populations.setdefault(breed, population)
+
+    @classmethod
+    def from_tables(cls, tables: tskit.TableCollection) -> "BreedIndex":
+        """Build the index from the node table and population metadata"""
+
+        breeds = get_population_breeds(tables)
+
+        flags = tables.nodes.flags
+        population = tables.nodes.population
+        individual = tables.nodes.individual
+
+        samples = np.flatnonzero(
+            ((flags & tskit.NODE_IS_SAMPLE) != 0) & (population != tskit.NULL)
+        )
+        samples = samples[np.argsort(population[samples], kind="stable")]
+
+        nodes = np.flatnonzero(individual != tskit.NULL)
+        nodes = nodes[np.argsort(individual[nodes], kind="stable")]
+
+        return cls(
+            breeds=breeds,
+            sample_nodes=samples.astype(np.int32),
+            breed_offsets=group_offsets(population[samples], len(breeds)),
+            individual_nodes=nodes.astype(np.int32),
+            individual_offsets=group_offsets(
+                individual[nodes], tables.individuals.num_rows
+            ),
+            num_nodes=tables.nodes.num_rows,
+        )
+
+    def to_dict(self) -> dict:
+        """The index as JSON metadata, with arrays encoded by encode_array"""
+
+        return {
+            "breeds": self.breeds,
+            "sample_nodes": encode_array(self.sample_nodes),
+            "breed_offsets": encode_array(self.breed_offsets),
+            "individual_nodes": encode_array(self.individual_nodes),
+            "individual_offsets": encode_array(self.individual_offsets),
+            "num_nodes": self.num_nodes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BreedIndex":
+        return cls(
+            breeds=list(data["breeds"]),
+            sample_nodes=decode_array(data["sample_nodes"]),
+            breed_offsets=decode_array(data["breed_offsets"], np.int64),
+            individual_nodes=decode_array(data["individual_nodes"]),
+            individual_offsets=decode_array(data["individual_offsets"], np.int64),
+            num_nodes=data["num_nodes"],
+        )
+
+    def population_samples(self, population: int) -> np.ndarray:
+        start, end = self.breed_offsets[population : population + 2]
+        return self.sample_nodes[start:end]
+
+    def breed_samples(self, breed: str) -> np.ndarray:
+        return self.population_samples(self.populations[breed])
+
+    def individual_nodes_of(self, individual: int) -> np.ndarray:
+        start, end = self.individual_offsets[individual : individual + 2]
+        return self.individual_nodes[start:end]
+
+    def sample_sets(self) -> Tuple[List[str], List[np.ndarray]]:
+        """The breeds with samples and the sample nodes of each breed"""
+
+        breeds, sample_sets = [], []
+
+        for population, breed in enumerate(self.breeds):
+            nodes = self.population_samples(population)
+
+            if len(nodes):
+                breeds.append(breed)
+                sample_sets.append(nodes)
+
+        return breeds, sample_sets
+
+
+def write_breed_index(tables: tskit.TableCollection) -> BreedIndex:
+    """
+    Build the breed index of tables and store it in the top-level metadata,
+    keeping the existing metadata (a JSON schema is set when missing)
+    """
+
+    index = BreedIndex.from_tables(tables)
+
+    if tables.metadata_schema.schema is None:
+        metadata = decode_metadata(tables.metadata)
+        tables.metadata_schema = tskit.MetadataSchema.permissive_json()
+
+    else:
+        metadata = dict(tables.metadata)
+
+    metadata[BREED_INDEX_KEY] = index.to_dict()
+    tables.metadata = metadata
+
+    return index
+
+
+def load_breed_index(ts: tskit.TreeSequence) -> Optional[BreedIndex]:
+    """
+    Return the breed index stored in the tree sequence metadata by
+    annotate_tree, or None if missing or outdated (nodes changed)
+    """
+
+    try:
+        data = decode_metadata(ts.metadata).get(BREED_INDEX_KEY)
+
+    except (ValueError, AttributeError):
+        # not a JSON metadata
+        return None
+
+    if data is None:
+        return None
+
+    try:
+        index = BreedIndex.from_dict(data)
+
+    except (KeyError, TypeError, ValueError):
+        logger.warning("Breed index could not be decoded: ignored")
+        return None
+
+    if (
+        index.num_nodes != ts.num_nodes
+        or len(index.breeds) != ts.num_populations
+        or len(index.individual_offsets) != ts.num_individuals + 1
+    ):
+        logger.warning("Breed index does not match the tree sequence: ignored")
+        return None
+
+    return index
+
+
+def get_breed_index(ts: tskit.TreeSequence) -> BreedIndex:
+    """The stored breed index, or a new one built from the tables"""
+
+    index = load_breed_index(ts)
+
+    if index is None:
+        index = BreedIndex.from_tables(ts.tables)
+
+    return index
@@ -0,0 +1,454 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import pathlib
+import importlib
+import threading
+import socketserver
+import multiprocessing
+from multiprocessing import forkserver
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+# the subcommands of the tskitetude group, imported only when called, with
+# their short help (shown by tskitetude --help without importing them)
+COMMANDS = {
+    "make_est_sfs_input": (
+        "tskitetude.estsfs:make_est_sfs_input",
+        "Create the est-sfs input files from a VCF",
+    ),
+    "parse_est_sfs_output": (
+        "tskitetude.estsfs:parse_est_sfs_output",
+        "Read the est-sfs output and write the ancestral alleles",
+    ),
+    "create_tstree": (
+        "tskitetude.helper:create_tstree",
+        "Infer (and date) a tree sequence from a phased VCF",
+    ),
+    "collect_compara_ancestors": (
+        "tskitetude.ensembl:collect_compara_ancestors",
+        "Collect ancestral alleles from Ensembl compara",
+    ),
+    "collect_fasta_ancestors": (
+        "tskitetude.ensembl:collect_fasta_ancestors",
+        "Collect ancestral alleles from the Ensembl ancestral sequences",
+    ),
+    "annotate_tree": (
+        "tskitetude.helper:annotate_tree",
+        "Annotate a tree sequence with sample metadata",
+    ),
+    "smarter_mirror": (
+        "tskitetude.smarterapi:smarter_mirror",
+        "Download or sync a local mirror of the SMARTER API",
+    ),
+    "top2forward": (
+        "tskitetude.smarterapi:top2forward",
+        "Write the plink --update-alleles file from TOP to FORWARD",
+    ),
+    "fake_fasta_from_vcf": (
+        "tskitetude.fasta:fake_fasta_from_vcf",
+        "Create a fake FASTA file from a VCF file",
+    ),
+    "create_fid_iid": (
+        "tskitetude.samplesheet:create_fid_iid",
+        "Create a FID-IID TSV file for each VCF file",
+    ),
+    "vcf_to_zarr": (
+        "tskitetude.vcfzarr:vcf_to_zarr",
+        "Convert a phased VCF file in a VCF Zarr store",
+    ),
+    "date_tstree": (
+        "tskitetude.dating:date_tstree",
+        "Date a tree sequence with a grid of tsdate parameters",
+    ),
+    "site_qc": (
+        "tskitetude.siteqc:site_qc",
+        "Check the sites of a VCF file and write a site mask",
+    ),
+    "gnn": (
+        "tskitetude.gnn:gnn",
+        "Compute the individual x breed GNN matrix",
+    ),
+    "genome_stats": (
+        "tskitetude.genomestats:genome_stats",
+        "Compute genome-wide statistics from chromosome tree sequences",
+    ),
+    "stats_ci": (
+        "tskitetude.resampling:stats_ci",
+        "Compute statistics with jackknife and bootstrap intervals",
+    ),
+}
+
+# modules imported once by the worker fork server, shared with the jobs
+WARM_MODULES = ["numcodecs", "zarr", "cyvcf2", "tszip", "tsinfer", "tsdate"]
+
+# the job file states in a queue directory
+JOB_PENDING = ".json"
+JOB_RUNNING = ".running"
+JOB_DONE = ".done"
+JOB_FAILED = ".failed"
+
+
+class LazyGroup(click.Group):
+    """A click group importing the module of a subcommand only when called"""
+
+    def __init__(
+        self, *args, lazy_commands: Dict[str, Tuple[str, str]] = None, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx) -> List[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name in self.lazy_commands:
+            module_name, attr = self.lazy_commands[cmd_name][0].split(":")
+            return getattr(importlib.import_module(module_name), attr)
+
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        # list the subcommands without importing them
+        rows = [
+            (name, short_help)
+            for name, (_, short_help) in self.lazy_commands.items()
+        ]
+        rows += [
+            (name, command.get_short_help_str())
+            for name, command in self.commands.items()
+        ]
+        rows.sort()
+
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
+def cli():
+    """
+    TSKITetude command line: all the tskitetude commands as subcommands
+    (tskitetude <command> --help), plus a worker running commands in
+    processes forked from a warm interpreter.
+    """
+
+
+def start_forkserver(modules: List[str] = WARM_MODULES):
+    """
+    Start the process jobs are forked from, importing modules there once.
+    Jobs are not forked from the worker itself: its server threads could
+    hold locks (logging, imports) copied locked in the child.
+    """
+
+    start = time.perf_counter()
+
+    multiprocessing.set_forkserver_preload([__name__] + list(modules))
+    forkserver.ensure_running()
+
+    logger.info(
+        f"Started the fork server ({len(modules)} modules) in "
+        f"{time.perf_counter() - start:.2f} s"
+    )
+
+
+def _run_job(args: List[str], cwd: Optional[str], log: Optional[str]):
+    # this runs in the forked process
+    if cwd:
+        os.chdir(cwd)
+
+    if log:
+        handle = open(log, "a")
+        os.dup2(handle.fileno(), sys.stdout.fileno())
+        os.dup2(handle.fileno(), sys.stderr.fileno())
+
+    cli.main(args, prog_name="tskitetude")
+
+
+def check_job(job) -> dict:
+    """Raise ValueError if a job is not an object with a list of ``args``"""
+
+    if not isinstance(job, dict) or not isinstance(job.get("args"), list):
+        raise ValueError("a job is a JSON object with a list of 'args'")
+
+    return job
+
+
+def run_job(job: dict) -> dict:
+    """
+    Run a job (a dictionary with the command line ``args`` and optional
+    ``cwd`` and ``log`` file) in a process forked from the fork server.
+    Returns the job exit code and the elapsed time.
+    """
+
+    start = time.perf_counter()
+
+    process = multiprocessing.get_context("forkserver").Process(
+        target=_run_job, args=(job["args"], job.get("cwd"), job.get("log"))
+    )
+    process.start()
+    process.join()
+
+    return {
+        "args": job["args"],
+        "exit_code": process.exitcode,
+        "elapsed": round(time.perf_counter() - start, 3),
+    }
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Read a JSON job (one line), run it and reply with its result"""
+
+    def handle(self):
+        try:
+            job = check_job(json.loads(self.rfile.readline()))
+
+        except ValueError as exc:
+            result = {"error": f"Invalid job: {exc}", "exit_code": None}
+            self.wfile.write((json.dumps(result) + "\n").encode())
+            return
+
+        with self.server.slots:
+            logger.info(f"Running {job['args']}")
+            result = run_job(job)
+
+        logger.info(f"Job {job['args']} exited with {result['exit_code']}")
+        self.wfile.write((json.dumps(result) + "\n").encode())
+
+        self.server.job_done()
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, max_parallel: int, max_jobs: Optional[int]):
+        super().__init__(path, JobHandler)
+        self.slots = threading.Semaphore(max_parallel)
+        self.max_jobs = max_jobs
+        self.num_jobs = 0
+        self.lock = threading.Lock()
+
+    def job_done(self):
+        with self.lock:
+            self.num_jobs += 1
+
+            if self.max_jobs is not None and self.num_jobs >= self.max_jobs:
+                # shutdown waits for serve_forever: call it from another thread
+                threading.Thread(target=self.shutdown).start()
+
+
+def serve_socket(path: str, max_parallel: int = 1, max_jobs: Optional[int] = None):
+    if os.path.exists(path):
+        os.unlink(path)
+
+    with WorkerServer(path, max_parallel, max_jobs) as server:
+        logger.info(f"Waiting for jobs on {path}")
+
+        try:
+            server.serve_forever()
+
+        finally:
+            os.unlink(path)
+
+
+def claim_job(queue: pathlib.Path) -> Optional[pathlib.Path]:
+    """
+    Claim the oldest pending job in a queue directory renaming it: rename is
+    atomic, so many workers could share the same queue
+    """
+
+    for job_file in sorted(queue.glob(f"*{JOB_PENDING}")):
+        running = job_file.with_suffix(JOB_RUNNING)
+
+        try:
+            job_file.rename(running)
+
+        except FileNotFoundError:
+            # claimed by another worker
+            continue
+
+        return running
+
+    return None
+
+
+def serve_queue(
+    queue: pathlib.Path,
+    poll_interval: float = 1.0,
+    max_jobs: Optional[int] = None,
+    idle_timeout: Optional[float] = None,
+):
+    """
+    Run the JSON jobs written in a queue directory, one at a time. Job files
+    should be written with another extension and then renamed .json, to be
+    claimed only when complete. Each job file is renamed .done or .failed
+    after running, and its result is written in a .result file.
+    """
+
+    num_jobs = 0
+    idle_since = time.monotonic()
+
+    logger.info(f"Waiting for jobs in {queue}")
+
+    while max_jobs is None or num_jobs < max_jobs:
+        job_file = claim_job(queue)
+
+        if job_file is None:
+            if idle_timeout is not None and (
+                time.monotonic() - idle_since > idle_timeout
+            ):
+                logger.info(f"No jobs in {idle_timeout} s: exiting")
+                break
+
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            job = check_job(json.loads(job_file.read_text()))
+            logger.info(f"Running {job_file.stem}: {job['args']}")
+            result = run_job(job)
+
+        except (ValueError, KeyError) as exc:
+            result = {"error": f"Invalid job: {exc}", "exit_code": None}
+
+        job_file.with_suffix(".result").write_text(json.dumps(result) + "\n")
+        job_file.rename(
+            job_file.with_suffix(JOB_DONE if result["exit_code"] == 0 else JOB_FAILED)
+        )
+
+        logger.info(f"Job {job_file.stem} exited with {result['exit_code']}")
+
+        num_jobs += 1
+        idle_since = time.monotonic()
+
+
+@cli.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    help="Unix socket path where jobs are received (see submit)",
+    type=click.Path(dir_okay=False),
+    default=None,
+)
+@click.option(
+    "--queue",
+    help="Directory with JSON job files ({'args': [...], 'cwd': ..., 'log': ...})",
+    type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path),
+    default=None,
+)
+@click.option(
+    "--max_parallel",
+    help="Jobs running at the same time (with --socket)",
+    type=int,
+    default=1,
+    show_default=True,
+)
+@click.option(
+    "--max_jobs",
+    help="Exit after running this number of jobs",
+    type=int,
+    default=None,
+)
+@click.option(
+    "--idle_timeout",
+    help="Exit after this number of seconds without jobs (with --queue)",
+    type=float,
+    default=None,
+)
+@click.option(
+    "--poll_interval",
+    help="Seconds between queue directory scans",
+    type=float,
+    default=1.0,
+    show_default=True,
+)
+@click.option(
+    "--warm/--no-warm",
+    help="Import tsinfer, tsdate, cyvcf2 and the other heavy modules at startup",
+    default=True,
+    show_default=True,
+)
+def worker(
+    socket_path: str,
+    queue: pathlib.Path,
+    max_parallel: int,
+    max_jobs: int,
+    idle_timeout: float,
+    poll_interval: float,
+    warm: bool,
+):
+    """
+    Run tskitetude commands sent over a Unix socket or written as job files
+    in a queue directory. Modules are imported once in a fork server: each
+    job runs in a process forked from it, so it starts without any import
+    cost.
+    """
+
+    if bool(socket_path) == bool(queue):
+        raise click.UsageError("Provide one of --socket or --queue")
+
+    start_forkserver(WARM_MODULES if warm else [])
+
+    if socket_path:
+        serve_socket(socket_path, max_parallel, max_jobs)
+
+    else:
+        serve_queue(queue, poll_interval, max_jobs, idle_timeout)
+
+
+def submit_job(socket_path: str, job: dict) -> dict:
+    """Send a job to a worker and wait for its result"""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall((json.dumps(job) + "\n").encode())
+
+        with client.makefile("r") as handle:
+            return json.loads(handle.readline())
+
+
+@cli.command(context_settings={"ignore_unknown_options": True})
+@click.option(
+    "--socket",
+    "socket_path",
+    help="Unix socket of a running worker",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+)
+@click.option(
+    "--log",
+    help="Append the job output to this file (default: the worker output)",
+    type=click.Path(dir_okay=False),
+    default=None,
+)
+@click.argument("args", nargs=-1, type=click.UNPROCESSED, required=True)
+def submit(socket_path: str, log: str, args: List[str]):
+    """
+    Run a command in a worker (tskitetude submit --socket <path> create_tstree
+    ...) from the current directory, exiting with the command exit code.
+    """
+
+    job = {"args": list(args), "cwd": os.getcwd()}
+
+    if log:
+        job["log"] = os.path.abspath(log)
+
+    result = submit_job(socket_path, job)
+
+    if "error" in result:
+        raise click.ClickException(result["error"])
+
+    sys.exit(result["exit_code"])
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,505 @@
+import os
+import logging
+import multiprocessing
+import pathlib
+import tempfile
+import itertools
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, NamedTuple, Optional, Tuple
+
+import click
+import numpy as np
+import tskit
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+# some constants
+TSDATE_DEFAULT_NE = 1e4
+
+TSDATE_METHODS = ["inside_outside", "variational_gamma", "maximization"]
+
+
+def date_tree_sequence(
+    ts: tskit.TreeSequence,
+    method: str = "variational_gamma",
+    mutation_rate: float = 1e-8,
+    Ne: float = TSDATE_DEFAULT_NE,
+) -> tskit.TreeSequence:
+    """
+    Date a preprocessed tree sequence with tsdate. Ne is used only by the
+    'inside_outside' and 'maximization' methods.
+    """
+
+    # tsdate is slow to import (numba): import it only when dating
+    import tsdate
+
+    # Prepare the base tsdate call with common parameters
+    date_partial = functools.partial(
+        tsdate.date, ts, method=method, mutation_rate=mutation_rate
+    )
+
+    # Add Ne parameter only for methods that support it
+    if method in ("inside_outside", "maximization"):
+        return date_partial(Ne=Ne)
+
+    elif method == "variational_gamma":
+        return date_partial()
+
+    raise NotImplementedError(f"Dating method '{method}' not implemented")
+
+
+class GridPoint(NamedTuple):
+    method: str
+    mutation_rate: float
+    Ne: Optional[float]
+
+    @property
+    def name(self) -> str:
+        name = f"{self.method}.mu{self.mutation_rate:g}"
+
+        if self.Ne is not None:
+            name += f".ne{self.Ne:g}"
+
+        return name
+
+
+def make_grid(
+    methods: List[str], mutation_rates: List[float], Nes: List[float]
+) -> List[GridPoint]:
+    """
+    Return all the combinations of dating parameters. Ne is ignored by the
+    variational_gamma method, so it is dated once for each mutation rate.
+    """
+
+    grid = []
+
+    for method, mutation_rate, Ne in itertools.product(methods, mutation_rates, Nes):
+        if method == "variational_gamma":
+            Ne = None
+
+        point = GridPoint(method, mutation_rate, Ne)
+
+        if point not in grid:
+            grid.append(point)
+
+    return grid
+
+
+# tree sequences loaded before forking the date_tstree workers: forked
+# workers inherit the decoded tables, sharing their memory copy-on-write
+_SHARED_TREES = {}
+
+
+@functools.lru_cache(maxsize=1)
+def load_trees(path: str) -> tskit.TreeSequence:
+    # without fork, each worker loads its own copy of the input, once
+    # whatever the number of grid points
+    return tskit.load(path)
+
+
+def _date_worker(input_trees: str, point: GridPoint, output: str) -> str:
+    ts = _SHARED_TREES.get(input_trees)
+
+    if ts is None:
+        ts = load_trees(input_trees)
+
+    dated_ts = date_tree_sequence(
+        ts,
+        method=point.method,
+        mutation_rate=point.mutation_rate,
+        Ne=point.Ne if point.Ne is not None else TSDATE_DEFAULT_NE,
+    )
+    dated_ts.dump(output)
+
+    return output
+
+
+def make_chunks(
+    sequence_length: float, chunk_size: float, overlap: float
+) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
+    """
+    Split a sequence in chunks of chunk_size bp. Returns the core interval
+    of each chunk and the interval which is dated, extended by ``overlap``
+    bp on both sides.
+    """
+
+    chunks = []
+
+    for start in np.arange(0, sequence_length, chunk_size):
+        end = min(start + chunk_size, sequence_length)
+        extended = (max(0, start - overlap), min(sequence_length, end + overlap))
+        chunks.append(((float(start), float(end)), tuple(map(float, extended))))
+
+    return chunks
+
+
+def extract_chunk(
+    ts: tskit.TreeSequence, interval: Tuple[float, float]
+) -> Tuple[tskit.TreeSequence, np.ndarray, np.ndarray]:
+    """
+    Return the trees in an interval, with the IDs of the input nodes found
+    in the interval and their IDs in the chunk
+    """
+
+    chunk = ts.keep_intervals([interval], simplify=False)
+    chunk, node_map = chunk.simplify(
+        map_nodes=True,
+        keep_unary=True,
+        filter_sites=False,
+        filter_populations=False,
+        filter_individuals=False,
+    )
+
+    node_ids = np.flatnonzero(node_map != tskit.NULL)
+
+    return chunk, node_ids, node_map[node_ids]
+
+
+def _date_chunk_worker(
+    chunk_trees: str,
+    method: str,
+    mutation_rate: float,
+    Ne: float,
+):
+    """
+    Date the trees of a chunk file (removed once loaded). Returns the times
+    and metadata of the chunk nodes
+    """
+
+    chunk = tskit.load(chunk_trees)
+    os.unlink(chunk_trees)
+
+    dated = date_tree_sequence(
+        chunk, method=method, mutation_rate=mutation_rate, Ne=Ne
+    )
+
+    nodes = dated.tables.nodes
+
+    return (
+        dated.nodes_time,
+        tskit.unpack_bytes(nodes.metadata, nodes.metadata_offset),
+        repr(nodes.metadata_schema),
+    )
+
+
+def choose_chunks(
+    ts: tskit.TreeSequence,
+    chunks: List[Tuple[Tuple[float, float], Tuple[float, float]]],
+) -> np.ndarray:
+    """
+    Return the chunk where each node spans most of the core interval (bp of
+    its edges as parent or child), the first one on ties. Only the best span
+    so far is kept, so memory doesn't grow with the number of chunks.
+    """
+
+    left, right = ts.edges_left, ts.edges_right
+    parent, child = ts.edges_parent, ts.edges_child
+
+    best = np.full(ts.num_nodes, -1.0)
+    winner = np.zeros(ts.num_nodes, dtype=np.int64)
+    spans = np.zeros(ts.num_nodes)
+
+    for i, ((start, end), _) in enumerate(chunks):
+        span = np.clip(right, start, end) - np.clip(left, start, end)
+
+        spans[:] = 0
+        np.add.at(spans, parent, span)
+        np.add.at(spans, child, span)
+
+        better = spans > best
+        best[better] = spans[better]
+        winner[better] = i
+
+    return winner
+
+
+def constrain_times(
+    ts: tskit.TreeSequence, times: np.ndarray, min_branch_length: float = 1e-8
+) -> np.ndarray:
+    """
+    Make parents older than their children (times from different chunks).
+    Edges are sorted by the input time of their parent, so parents are
+    updated in a single pass, in batches of parents whose children were
+    all updated by the previous batches.
+    """
+
+    times = times.copy()
+    parent, child = ts.edges_parent, ts.edges_child
+
+    if len(parent) == 0:
+        return times
+
+    # the edges of each parent are contiguous
+    starts = np.flatnonzero(np.r_[True, parent[1:] != parent[:-1]])
+    ends = np.r_[starts[1:], len(parent)]
+    parents = parent[starts]
+
+    # the last parent (in edge order) each parent depends on
+    position = np.full(ts.num_nodes, -1, dtype=np.int64)
+    position[parents] = np.arange(len(parents))
+    depends = np.maximum.reduceat(position[child], starts)
+
+    first = 0
+
+    while first < len(parents):
+        # the batch ends at the first parent with a child in the batch
+        last, window = len(parents), 64
+
+        while first + 1 < len(parents):
+            stop = min(first + 1 + window, len(parents))
+            found = np.flatnonzero(depends[first + 1 : stop] >= first)
+
+            if len(found):
+                last = first + 1 + found[0]
+                break
+
+            if stop == len(parents):
+                break
+
+            window *= 2
+
+        lo, hi = starts[first], ends[last - 1]
+        needed = np.maximum.reduceat(times[child[lo:hi]], starts[first:last] - lo)
+
+        batch = parents[first:last]
+        times[batch] = np.maximum(times[batch], needed + min_branch_length)
+
+        first = last
+
+    return times
+
+
+def date_in_chunks(
+    ts: tskit.TreeSequence,
+    chunk_size: float,
+    overlap: float,
+    method: str = "variational_gamma",
+    mutation_rate: float = 1e-8,
+    Ne: float = TSDATE_DEFAULT_NE,
+    processes: int = 1,
+) -> tskit.TreeSequence:
+    """
+    Date a preprocessed tree sequence in overlapping genomic chunks, in
+    parallel. Each node takes the time (and tsdate metadata) of the chunk
+    where it spans most of the core interval, then times are constrained to
+    be older than children. Node IDs and order are the same of the input
+    tree sequence. Each chunk is written to its own file, so the memory of
+    a worker depends on the chunk size and not on the chromosome length.
+    """
+
+    chunks = make_chunks(ts.sequence_length, chunk_size, overlap)
+
+    logger.info(
+        f"Dating {len(chunks)} chunks of {chunk_size:g} bp "
+        f"(overlap {overlap:g} bp) with {processes} processes"
+    )
+
+    node_maps, futures = [], []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with ProcessPoolExecutor(max_workers=min(processes, len(chunks))) as executor:
+            # chunks are extracted one at a time and dated while the next ones
+            # are extracted: workers load only their chunk
+            for i, (_, interval) in enumerate(chunks):
+                chunk, node_ids, chunk_ids = extract_chunk(ts, interval)
+
+                chunk_trees = os.path.join(tmpdir, f"chunk{i}.trees")
+                chunk.dump(chunk_trees)
+                del chunk
+
+                node_maps.append((node_ids, chunk_ids))
+                futures.append(
+                    executor.submit(
+                        _date_chunk_worker, chunk_trees, method, mutation_rate, Ne
+                    )
+                )
+
+            results = [future.result() for future in futures]
+
+    # choose the chunk for each node
+    winner = choose_chunks(ts, chunks)
+
+    times = ts.nodes_time.copy()
+    metadata = [None] * ts.num_nodes
+
+    for i, ((node_ids, chunk_ids), (nodes_time, nodes_metadata, _)) in enumerate(
+        zip(node_maps, results)
+    ):
+        selected = winner[node_ids] == i
+        times[node_ids[selected]] = nodes_time[chunk_ids[selected]]
+
+        for node_id, chunk_id in zip(node_ids[selected], chunk_ids[selected]):
+            metadata[node_id] = nodes_metadata[chunk_id]
+
+    missing = [node_id for node_id, row in enumerate(metadata) if row is None]
+
+    if missing:
+        raise ValueError(f"Nodes {missing[:10]} not found in any chunk")
+
+    tables = ts.dump_tables()
+    tables.nodes.metadata_schema = tskit.parse_metadata_schema(results[0][2])
+
+    packed, offset = tskit.pack_bytes(metadata)
+    tables.nodes.set_columns(
+        flags=tables.nodes.flags,
+        time=constrain_times(ts, times),
+        population=tables.nodes.population,
+        individual=tables.nodes.individual,
+        metadata=packed,
+        metadata_offset=offset,
+    )
+
+    # edges need to be sorted by the new parent times
+    tables.sort()
+    tables.build_index()
+    tables.compute_mutation_times()
+    tables.sort()
+
+    return tables.tree_sequence()
+
+
+def load_tree_sequence(path: str) -> tskit.TreeSequence:
+    """Load a tree sequence file, compressed with tszip or not"""
+
+    if str(path).endswith(".tsz"):
+        import tszip
+
+        return tszip.decompress(path)
+
+    return tskit.load(path)
+
+
+@click.command()
+@click.option(
+    "--input_trees",
+    help="Input tree sequence (.trees or .tsz) preprocessed by tsdate.preprocess_ts",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+)
+@click.option(
+    "--preprocess",
+    help="Call tsdate.preprocess_ts on input before dating",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--tsdate_method",
+    "methods",
+    help="tsdate method (could be specified multiple times)",
+    type=click.Choice(TSDATE_METHODS, case_sensitive=False),
+    multiple=True,
+    default=["variational_gamma"],
+    show_default=True,
+)
+@click.option(
+    "--mutation_rate",
+    "mutation_rates",
+    help="tsdate mutation rate (could be specified multiple times)",
+    type=float,
+    multiple=True,
+    default=[1e-8],
+    show_default=True,
+)
+@click.option(
+    "--ne",
+    "Nes",
+    help=(
+        "tsdate effective population size (could be specified multiple times): "
+        "affect only 'inside_outside' and 'maximization' tsdate_method parameter"
+    ),
+    type=float,
+    multiple=True,
+    default=[TSDATE_DEFAULT_NE],
+    show_default=True,
+)
+@click.option(
+    "--output_dir",
+    help="Output directory for dated tree sequences",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    required=True,
+)
+@click.option(
+    "--processes",
+    help="Number of tsdate processes",
+    type=int,
+    default=os.cpu_count(),
+    show_default=True,
+)
+def date_tstree(
+    input_trees: click.Path,
+    preprocess: bool,
+    methods: List[str],
+    mutation_rates: List[float],
+    Nes: List[float],
+    output_dir: pathlib.Path,
+    processes: int,
+):
+    """
+    Date a tree sequence with a grid of tsdate parameters, writing a dated
+    tree sequence for each combination (<input>.<method>.mu<rate>[.ne<Ne>].trees).
+    Dating runs in a process pool. Where fork is available, the input is
+    loaded once before forking the workers, which share its tables
+    copy-on-write. Otherwise each worker loads its own copy from a file.
+    """
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stem = pathlib.Path(input_trees).name.split(".")[0]
+
+    grid = make_grid(methods, mutation_rates, Nes)
+
+    logger.info(f"Dating {input_trees} with {len(grid)} parameter combinations")
+
+    fork = "fork" in multiprocessing.get_all_start_methods()
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmpdir:
+        shared_trees = str(input_trees)
+
+        # with fork, the input is loaded once here and shared with workers;
+        # otherwise workers need an uncompressed (and preprocessed) file
+        if fork or preprocess or not shared_trees.endswith(".trees"):
+            ts = load_tree_sequence(input_trees)
+
+            if preprocess:
+                import tsdate
+
+                ts = tsdate.preprocess_ts(ts, filter_sites=False)
+
+            if fork:
+                _SHARED_TREES[shared_trees] = ts
+
+            else:
+                shared_trees = os.path.join(tmpdir, f"{stem}.trees")
+                ts.dump(shared_trees)
+
+            del ts
+
+        try:
+            with ProcessPoolExecutor(
+                max_workers=min(processes, len(grid)),
+                mp_context=multiprocessing.get_context("fork" if fork else None),
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        _date_worker,
+                        shared_trees,
+                        point,
+                        str(output_dir / f"{stem}.{point.name}.trees"),
+                    ): point
+                    for point in grid
+                }
+
+                for future in as_completed(futures):
+                    logger.info(
+                        f"Dated Tree Sequence ({futures[future].name}) saved to "
+                        f"{future.result()}"
+                    )
+
+        finally:
+            _SHARED_TREES.pop(shared_trees, None)
+
+    logger.info("Done!")
@@ -1,14 +1,18 @@
 
 import csv
+import json
+import time
+import sqlite3
 import logging
+import collections
+from typing import List
 from urllib.parse import urljoin
 
 import click
-import pandas as pd
-from tqdm import tqdm
-from ensemblrest import EnsemblRest
+import requests
 
-from .smarterapi import VariantsEndpoint
+from .fasta import IndexedFasta
+from .progress import ProgressReporter
 
 log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 logging.basicConfig(level=logging.INFO, format=log_fmt)
@@ -17,7 +21,113 @@ logging.basicConfig(level=logging.INFO, format=log_fmt)
 logger = logging.getLogger(__name__)
 
 
+# a cached ensembl-compara lookup: status is one of 'found', 'missing', 'error'
+CacheRecord = collections.namedtuple("CacheRecord", ["status", "payload", "created"])
+
+
+class ComparaCache():
+    """
+    A persistent SQLite key-value cache for ensembl-compara alignment lookups.
+    Records are keyed by species, assembly, region and query params. Found
+    ancestors never expire (archive endpoints don't change), while missing
+    ancestors and errors expire after their TTL (in seconds).
+    """
+
+    def __init__(
+            self, path: str, negative_ttl: float = 30 * 86400,
+            error_ttl: float = 86400):
+        logger.info(f"Using compara cache: {path}")
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+
+        # WAL mode let us commit every record without slowing down too much:
+        # an interrupted run will resume from the last committed lookup
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS compara ("
+            "species TEXT NOT NULL, "
+            "assembly TEXT NOT NULL, "
+            "region TEXT NOT NULL, "
+            "params TEXT NOT NULL, "
+            "status TEXT NOT NULL, "
+            "payload TEXT, "
+            "created REAL NOT NULL, "
+            "PRIMARY KEY (species, assembly, region, params))"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def _encode_params(params) -> str:
+        return json.dumps(sorted(params))
+
+    def get(self, species, assembly, region, params) -> CacheRecord:
+        """
+        Return the cached record for a lookup or None if the lookup is
+        not cached or if the negative record is expired.
+        """
+
+        row = self.connection.execute(
+            "SELECT status, payload, created FROM compara "
+            "WHERE species = ? AND assembly = ? AND region = ? AND params = ?",
+            (species, assembly, region, self._encode_params(params))
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        status, payload, created = row
+        record = CacheRecord(
+            status, json.loads(payload) if payload else None, created)
+
+        if status == "missing":
+            ttl = self.negative_ttl
+
+        elif status == "error":
+            ttl = self.error_ttl
+
+        else:
+            ttl = None
+
+        if ttl is not None and time.time() - created > ttl:
+            logger.debug(f"Cached {status} record for {region} is expired")
+            return None
+
+        return record
+
+    def set(self, species, assembly, region, params, status, payload=None):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO compara "
+            "(species, assembly, region, params, status, payload, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                species, assembly, region, self._encode_params(params), status,
+                json.dumps(payload) if payload is not None else None,
+                time.time()
+            )
+        )
+        self.connection.commit()
+
+
 class ComparaSheepSNP():
+    """
+    Query ensembl-compara for the ancestral allele of a SNP. Failed requests
+    (network errors and ``status_forcelist`` statuses) are retried by the
+    session: when retries run out the lookup is an error, cached with the
+    error TTL. Only a 'no alignment' client error is a missing ancestor.
+    """
+
     species = "ovis_aries"
     params = [
         ('method', 'EPO'),
@@ -29,37 +139,103 @@ class ComparaSheepSNP():
     position = None
     last_response = None
 
-    def __init__(self, base_url = "https://rest.ensembl.org"):
+    status_forcelist = (408, 429, 500, 502, 503, 504)
+    missing_status = (400, 404)
+
+    def __init__(
+            self, base_url="https://rest.ensembl.org", assembly=None,
+            cache: ComparaCache = None, retries: int = 5,
+            backoff_factor: float = 1, timeout: float = 60):
+        from ensemblrest import EnsemblRest
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
         logger.info(f"Using base URL: {base_url}")
         self.base_url = base_url
+        self.timeout = timeout
         self.ensembl = EnsemblRest(base_url=base_url)
         self.session = self.ensembl.session
 
+        # return the last response when retries run out: it's cached as an
+        # error, not raised
+        adapter = HTTPAdapter(max_retries=Retry(
+            total=retries, backoff_factor=backoff_factor,
+            status_forcelist=self.status_forcelist,
+            respect_retry_after_header=True, raise_on_status=False))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # the assembly is part of the cache key: fall back to base_url
+        self.assembly = assembly or base_url
+        self.cache = cache
+
     def get_ancestor(self, chrom, position):
         self.chrom = chrom
         self.position = position
 
+        region = f"{chrom}:{position}-{position}"
+
+        if self.cache is not None:
+            record = self.cache.get(
+                self.species, self.assembly, region, self.params)
+
+            if record is not None:
+                logger.debug(f"Got cached {record.status} record for {region}")
+                return record.payload
+
+        status, ancestor = self._fetch_ancestor(region)
+
+        if self.cache is not None:
+            self.cache.set(
+                self.species, self.assembly, region, self.params, status,
+                ancestor)
+
+        return ancestor
+
+    def _fetch_ancestor(self, region):
+        """Query ensembl-compara and returns a (status, ancestor) tuple"""
+
         url = urljoin(
             self.base_url,
-            f"alignment/region/{self.species}/{chrom}:{position}-{position}"
+            f"alignment/region/{self.species}/{region}"
         )
-        response = self.session.get(url, params=self.params)
+        try:
+            response = self.session.get(
+                url, params=self.params, timeout=self.timeout)
+
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            logger.error(f"Failed to get data for {region}: {exc}")
+            return "error", None
+
         self.last_response = response
 
         if response.status_code != 200:
             try:
-                data = response.json()
-                logger.debug(
-                    f"Failed to get data for {chrom}:{position}: "
-                    f"{data['error']}")
+                message = response.json()["error"]
 
-            except Exception as e:
-                logger.error(e)
-                logger.error(f"Failed to get data from {url}: {response.text}")
+            except Exception:
+                message = response.text
 
-            return None
+            logger.debug(
+                f"Failed to get data for {region} "
+                f"(HTTP {response.status_code}): {message}")
+
+            # only a missing alignment is a negative result: rate limits,
+            # timeouts and server errors are queried again after error_ttl
+            if (
+                    response.status_code in self.missing_status
+                    and "alignment" in str(message).lower()):
+                return "missing", None
+
+            logger.error(
+                f"Failed to get data from {url} "
+                f"(HTTP {response.status_code}): {message}")
+
+            return "error", None
 
-        return self._parse_response(response.json())
+        ancestor = self._parse_response(response.json())
+
+        return ("found" if ancestor is not None else "missing"), ancestor
 
     def _parse_response(self, response):
         if "error" in response:
@@ -99,6 +275,76 @@ class ComparaSheepSNP():
             return None
 
 
+class AncestralSequences():
+    """
+    Read ancestral alleles from the Ensembl EPO ancestral sequences FASTA
+    files (one file per chromosome, with headers like
+    ``>ANCESTOR_for_chromosome:OAR3:1:1:275406953:1``). Uppercase bases are
+    high-confidence calls, lowercase bases low-confidence calls while
+    ``N``, ``-`` and ``.`` mean no ancestral allele.
+    """
+
+    missing = set("Nn-.")
+
+    def __init__(self, fasta_files: List[str]):
+        self.fastas = []
+        self.chromosomes = {}
+
+        for fasta_file in fasta_files:
+            fasta = IndexedFasta(fasta_file)
+            self.fastas.append(fasta)
+
+            for name in fasta.references:
+                chrom = self._parse_name(name)
+                logger.debug(f"Found {name} ({chrom}) in {fasta_file}")
+                self.chromosomes[chrom] = (fasta, name)
+
+        logger.info(
+            f"Read ancestral sequences for {len(self.chromosomes)} chromosomes")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for fasta in self.fastas:
+            fasta.close()
+
+    @staticmethod
+    def _parse_name(name: str) -> str:
+        # ANCESTOR_for_chromosome:<assembly>:<chrom>:<start>:<end>:<strand>
+        if ":" in name:
+            return name.split(":")[2]
+
+        return name
+
+    def get_ancestor(self, chrom: str, position: int) -> str:
+        """
+        Return the ancestral allele at position (1-based) or None if
+        there's no ancestral allele
+        """
+
+        if chrom not in self.chromosomes:
+            logger.debug(f"No ancestral sequence for chromosome '{chrom}'")
+            return None
+
+        fasta, name = self.chromosomes[chrom]
+
+        try:
+            base = fasta.get_base(name, position)
+
+        except IndexError as exc:
+            logger.warning(exc)
+            return None
+
+        if base in self.missing:
+            return None
+
+        return base
+
+
 @click.command()
 @click.option(
     '--assembly',
@@ -118,7 +364,41 @@ class ComparaSheepSNP():
     type=click.File('w'),
     help='Output file',
     required=True)
-def collect_compara_ancestors(assembly, chip_name, output):
+@click.option(
+    '--cache',
+    'cache_file',
+    type=click.Path(dir_okay=False),
+    help=(
+        'SQLite cache file for compara lookups. Cached SNPs are not '
+        'queried again, so an interrupted run can be resumed'),
+    default=None)
+@click.option(
+    '--negative_ttl',
+    type=float,
+    help='Hours before a cached missing ancestor is queried again',
+    default=30 * 24,
+    show_default=True)
+@click.option(
+    '--error_ttl',
+    type=float,
+    help='Hours before a cached failed lookup is queried again',
+    default=24,
+    show_default=True)
+@click.option(
+    '--metrics',
+    'metrics_file',
+    type=click.Path(dir_okay=False),
+    help='Append progress metrics (JSON lines) to this file',
+    default=None)
+def collect_compara_ancestors(
+        assembly, chip_name, output, cache_file, negative_ttl, error_ttl,
+        metrics_file):
+    # imported here: the other commands don't need pandas and the SMARTER API
+    import pandas as pd
+    from ensemblrest import EnsemblRest
+
+    from .smarterapi import VariantsEndpoint
+
     compara_assemblies = {
         "OAR3": "https://nov2020.rest.ensembl.org"
     }
@@ -126,7 +406,16 @@ def collect_compara_ancestors(assembly, chip_name, output):
     logger.info(f"Using assembly: {assembly}")
     logger.info(f"Using ensembl REST URL: {compara_assemblies[assembly]}")
     ensRest = EnsemblRest(base_url=compara_assemblies[assembly])
-    compara = ComparaSheepSNP(base_url=compara_assemblies[assembly])
+
+    cache = None
+
+    if cache_file:
+        cache = ComparaCache(
+            cache_file, negative_ttl=negative_ttl * 3600,
+            error_ttl=error_ttl * 3600)
+
+    compara = ComparaSheepSNP(
+        base_url=compara_assemblies[assembly], assembly=assembly, cache=cache)
 
     writer = csv.writer(output, delimiter=',', lineterminator="\n")
     writer.writerow(["chrom", "position", "alleles", "anc_allele"])
@@ -140,42 +429,114 @@ def collect_compara_ancestors(assembly, chip_name, output):
         )
     ))
 
+    variant_api = VariantsEndpoint(species="Sheep", assembly=assembly)
+
     for _, chromosome in chromosomes.iterrows():
         logger.info(f"getting variants for chromosome {chromosome['name']}")
 
-        variant_api = VariantsEndpoint(species="Sheep", assembly=assembly)
-        data = variant_api.get_variants(
-            chip_name=chip_name, region=chromosome['name'])
-        page = data["page"]
-        variants = pd.json_normalize(data["items"])
-
-        if variants.shape[0] == 0:
-            logger.warning(f"No variants found for chromosome {chromosome['name']}")
-            continue
-
-        # deal with pagination
-        while data["next"] is not None:
-            data = variant_api.get_variants(
-                chip_name=chip_name, region=chromosome['name'], page=page+1)
-            df_page = pd.json_normalize(data["items"])
-            page = data["page"]
-            variants = pd.concat([variants, df_page], ignore_index=True)
-
-        # iterate over variants and collect data from ensembl
-        for _, variant in tqdm(variants.iterrows(), total=variants.shape[0]):
-            ancestor = compara.get_ancestor(
-                chrom=variant["locations.chrom"],
-                position=variant["locations.position"])
-
-            if ancestor is not None:
-                writer.writerow([
-                    variant['locations.chrom'],
-                    variant['locations.position'],
-                    variant['locations.alleles'],
-                    ancestor['seq']
-                ])
-
-            # end of variant loop
+        progress = ProgressReporter(
+            f"Chromosome {chromosome['name']}", unit="SNPs",
+            metrics_file=metrics_file)
+
+        # iterate over variants and collect data from ensembl: next pages
+        # are downloaded while the current one is processed
+        for data in variant_api.iter_pages(
+                chip_name=chip_name, region=chromosome['name']):
+            progress.total = data["total"]
+
+            if data["total"] == 0:
+                logger.warning(
+                    f"No variants found for chromosome {chromosome['name']}")
+                break
+
+            for variant in data["items"]:
+                location = variant["locations"]
+
+                ancestor = compara.get_ancestor(
+                    chrom=location["chrom"],
+                    position=location["position"])
+
+                if ancestor is not None:
+                    writer.writerow([
+                        location['chrom'],
+                        location['position'],
+                        location['alleles'],
+                        ancestor['seq']
+                    ])
+
+                progress.update()
+
+                # end of variant loop
+
+        progress.close()
 
         # end of chromosome loop
         logger.info(f"Done with chromosome {chromosome['name']}")
+
+    if cache is not None:
+        cache.close()
+
+
+@click.command()
+@click.option(
+    '--fasta',
+    'fasta_files',
+    type=click.Path(exists=True, dir_okay=False),
+    multiple=True,
+    required=True,
+    help='Ensembl ancestral sequences FASTA file (uncompressed)')
+@click.option(
+    '--variants',
+    type=click.File('r'),
+    required=True,
+    help='CSV file with chrom, position and alleles columns')
+@click.option(
+    '--output',
+    type=click.File('w'),
+    help='Output file',
+    required=True)
+@click.option(
+    '--high_confidence',
+    is_flag=True,
+    default=False,
+    help='Keep only high-confidence ancestral alleles (uppercase in FASTA)')
+def collect_fasta_ancestors(fasta_files, variants, output, high_confidence):
+    """
+    Collect ancestral alleles from the Ensembl ancestral sequences FASTA
+    files, writing the same output of collect_compara_ancestors without
+    any network access. Ancestral alleles are written in uppercase: use
+    --high_confidence to drop the low-confidence (lowercase) calls.
+    """
+
+    reader = csv.DictReader(variants)
+
+    writer = csv.writer(output, delimiter=',', lineterminator="\n")
+    writer.writerow(["chrom", "position", "alleles", "anc_allele"])
+
+    found, total = 0, 0
+
+    with AncestralSequences(fasta_files) as sequences:
+        for record in reader:
+            total += 1
+
+            ancestor = sequences.get_ancestor(
+                record["chrom"], int(record["position"]))
+
+            if ancestor is None:
+                continue
+
+            if high_confidence and ancestor.islower():
+                continue
+
+            # alleles are matched in uppercase by create_tstree, like the
+            # compara ancestors
+            writer.writerow([
+                record["chrom"],
+                record["position"],
+                record.get("alleles"),
+                ancestor.upper()
+            ])
+
+            found += 1
+
+    logger.info(f"Found ancestral alleles for {found} of {total} variants")
@@ -6,9 +6,9 @@ import collections
 from typing import List
 
 import click
-from cyvcf2 import VCF
 
-from .helper import open_csv
+from .progress import ProgressReporter
+from .samplesheet import DELIMITERS, load_sample_sheet
 
 log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 logging.basicConfig(level=logging.INFO, format=log_fmt)
@@ -39,6 +39,12 @@ logger = logging.getLogger(__name__)
     type=click.Path(exists=True),
     required=True,
 )
+@click.option(
+    "--delimiter",
+    help="focal and outgroup CSV delimiter (guessed from first line by default)",
+    type=click.Choice(list(DELIMITERS)),
+    default=None
+)
 @click.option(
     "--output_data",
     help="Output data file",
@@ -64,10 +70,17 @@ logger = logging.getLogger(__name__)
     help="N random iterations",
     default=10
 )
+@click.option(
+    "--metrics",
+    "metrics_file",
+    help="append progress metrics (JSON lines) to this file",
+    type=click.Path(dir_okay=False),
+    default=None
+)
 def make_est_sfs_input(
         vcf_file: click.Path, focal: click.Path, outgroups: List[click.Path],
-        output_data: str, output_config: str, output_mapping: str, model: int,
-        nrandom: int):
+        delimiter: str, output_data: str, output_config: str, output_mapping: str, model: int,
+        nrandom: int, metrics_file: click.Path):
 
     """
     inspired from: "https://github.com/Popgen48/scalepopgen_v1/blob/defb5d6a8a95b3fd84bd4312c4a42ef2ef6b9b7b/bin/create_estsfs_inputs.py"
@@ -84,17 +97,25 @@ def make_est_sfs_input(
     mapping_writer.writerow(header)
 
     # read focal samples
-    focal_samples = [sample_id for _, sample_id in open_csv(focal)]
+    focal_samples = load_sample_sheet(focal, delimiter).sample_ids
 
     # deal with outgroup samples
     outgroup_samples = {}
     for idx, outgroup in enumerate(outgroups):
-        outgroup_samples[idx] = [sample_id for _, sample_id in open_csv(outgroup)]
+        outgroup_samples[idx] = load_sample_sheet(outgroup, delimiter).sample_ids
+
+    from cyvcf2 import VCF
 
     # open a vcf file
     vcf = VCF(vcf_file)
 
+    progress = ProgressReporter(
+        "Read VCF", unit="variants", input_file=vcf_file,
+        metrics_file=metrics_file)
+
     for variant in vcf:
+        progress.update()
+
         # test if I have all genotypes for focal samples. All my focal variants
         # are at the left side of the VCF (I have imputed this data, if I'm skipping
         # a variant, maybe I have ancient allele and not focal, for example
@@ -231,6 +252,8 @@ def make_est_sfs_input(
         data_handle.flush()
         mapping_handle.flush()
 
+    progress.close()
+
     data_handle.close()
     mapping_handle.close()
 
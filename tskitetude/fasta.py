@@ -0,0 +1,409 @@
+import os
+import math
+import mmap
+import zlib
+import struct
+import logging
+import collections
+from typing import Dict, List
+
+import click
+import numpy as np
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+# max uncompressed data in a BGZF block (like htslib)
+BGZF_BLOCK_SIZE = 0xFF00
+
+# the empty BGZF block marking the end of file
+BGZF_EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+
+# a samtools faidx record: offset is the byte offset of the first base,
+# linebases the number of bases per line and linewidth the bytes per line
+FaidxRecord = collections.namedtuple(
+    "FaidxRecord", ["name", "length", "offset", "linebases", "linewidth"]
+)
+
+
+def build_fasta_index(fasta_file: str) -> List[FaidxRecord]:
+    """
+    Scan an uncompressed FASTA file and return its faidx records. Sequence
+    lines need to have the same length (except the last one), like
+    samtools faidx does.
+    """
+
+    records = []
+
+    name, length, offset, linebases, linewidth = None, 0, 0, 0, 0
+    last_line = False
+
+    with open(fasta_file, "rb") as handle:
+        position = 0
+
+        for line in handle:
+            if line.startswith(b">"):
+                if name is not None:
+                    records.append(
+                        FaidxRecord(name, length, offset, linebases, linewidth)
+                    )
+
+                name = line[1:].split()[0].decode()
+                length, linebases, linewidth = 0, 0, 0
+                offset = position + len(line)
+                last_line = False
+
+            else:
+                bases = len(line.rstrip(b"\r\n"))
+
+                if last_line and bases > 0:
+                    raise ValueError(
+                        f"Different line length in sequence '{name}' "
+                        f"of {fasta_file}"
+                    )
+
+                if linebases == 0:
+                    linebases, linewidth = bases, len(line)
+
+                elif bases != linebases:
+                    # this need to be the last line of the sequence
+                    last_line = True
+
+                length += bases
+
+            position += len(line)
+
+    if name is not None:
+        records.append(FaidxRecord(name, length, offset, linebases, linewidth))
+
+    return records
+
+
+def write_fasta_index(records: List[FaidxRecord], fai_file: str):
+    with open(fai_file, "w") as handle:
+        for record in records:
+            handle.write("\t".join(str(value) for value in record) + "\n")
+
+
+def read_fasta_index(fai_file: str) -> List[FaidxRecord]:
+    records = []
+
+    with open(fai_file) as handle:
+        for line in handle:
+            name, *values = line.rstrip("\n").split("\t")[:5]
+            records.append(FaidxRecord(name, *[int(value) for value in values]))
+
+    return records
+
+
+class IndexedFasta:
+    """
+    Random access to an uncompressed FASTA file using a faidx index and a
+    memory-mapped file: only the pages with the requested bases are read
+    from disk. The index is created (and stored as ``<fasta>.fai`` if
+    possible) when missing.
+    """
+
+    def __init__(self, fasta_file: str):
+        self.fasta_file = fasta_file
+
+        fai_file = fasta_file + ".fai"
+
+        if os.path.exists(fai_file) and (
+            os.path.getmtime(fai_file) >= os.path.getmtime(fasta_file)
+        ):
+            records = read_fasta_index(fai_file)
+
+        else:
+            logger.info(f"Indexing {fasta_file}")
+            records = build_fasta_index(fasta_file)
+
+            try:
+                write_fasta_index(records, fai_file)
+
+            except OSError as exc:
+                logger.warning(f"Cannot write index {fai_file}: {exc}")
+
+        self.index: Dict[str, FaidxRecord] = {
+            record.name: record for record in records
+        }
+
+        self._handle = open(fasta_file, "rb")
+        self._mmap = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    @property
+    def references(self) -> List[str]:
+        return list(self.index.keys())
+
+    def close(self):
+        self._mmap.close()
+        self._handle.close()
+
+    def _byte_offset(self, record: FaidxRecord, position: int) -> int:
+        # position is 0-based
+        line, column = divmod(position, record.linebases)
+        return record.offset + line * record.linewidth + column
+
+    def fetch(self, name: str, start: int, end: int) -> str:
+        """
+        Return the sequence between start and end (1-based, inclusive) like
+        ``samtools faidx <fasta> name:start-end``
+        """
+
+        record = self.index[name]
+
+        if start < 1 or end > record.length or start > end:
+            raise IndexError(
+                f"Region {name}:{start}-{end} outside sequence "
+                f"(length {record.length})"
+            )
+
+        first = self._byte_offset(record, start - 1)
+        last = self._byte_offset(record, end - 1)
+
+        return (
+            self._mmap[first : last + 1].replace(b"\n", b"").replace(b"\r", b"")
+        ).decode()
+
+    def get_base(self, name: str, position: int) -> str:
+        """Return the base at position (1-based)"""
+
+        record = self.index[name]
+
+        if position < 1 or position > record.length:
+            raise IndexError(
+                f"Position {name}:{position} outside sequence "
+                f"(length {record.length})"
+            )
+
+        offset = self._byte_offset(record, position - 1)
+
+        return chr(self._mmap[offset])
+
+
+class BgzfWriter:
+    """
+    Write a BGZF (blocked gzip) file, tracking the block offsets to write a
+    ``.gzi`` index like ``bgzip -i`` does.
+    """
+
+    def __init__(self, path: str, compresslevel: int = 6):
+        self.handle = open(path, "wb")
+        self.compresslevel = compresslevel
+        self.buffer = bytearray()
+
+        # the (compressed, uncompressed) offsets of every block but the first
+        self.blocks = []
+        self.compressed = 0
+        self.uncompressed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def tell(self) -> int:
+        """The uncompressed offset"""
+
+        return self.uncompressed + len(self.buffer)
+
+    def write(self, data: bytes):
+        self.buffer += data
+
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+            del self.buffer[:BGZF_BLOCK_SIZE]
+
+    def _write_block(self, data: bytes):
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+
+        # header (18 bytes) + deflated data + CRC32 and ISIZE (8 bytes)
+        block_size = 18 + len(deflated) + 8
+
+        if self.compressed > 0:
+            self.blocks.append((self.compressed, self.uncompressed))
+
+        self.handle.write(
+            struct.pack(
+                "<4BI2BH2BHH",
+                0x1F, 0x8B, 8, 4, 0, 0, 0xFF, 6, ord("B"), ord("C"), 2,
+                block_size - 1,
+            )
+        )
+        self.handle.write(deflated)
+        self.handle.write(struct.pack("<II", zlib.crc32(data), len(data)))
+
+        self.compressed += block_size
+        self.uncompressed += len(data)
+
+    def close(self):
+        if self.buffer:
+            self._write_block(bytes(self.buffer))
+            self.buffer.clear()
+
+        self.handle.write(BGZF_EOF)
+        self.handle.close()
+
+    def write_gzi(self, gzi_file: str):
+        with open(gzi_file, "wb") as handle:
+            handle.write(struct.pack("<Q", len(self.blocks)))
+
+            for compressed, uncompressed in self.blocks:
+                handle.write(struct.pack("<QQ", compressed, uncompressed))
+
+
+def write_sequence(
+    writer: BgzfWriter,
+    name: str,
+    sequence: bytearray,
+    description: str = "",
+    line_width: int = 60,
+    chunk_lines: int = 100_000,
+) -> FaidxRecord:
+    """
+    Write a line-wrapped FASTA sequence and return its faidx record. Lines
+    are wrapped with NumPy, a chunk of lines at a time.
+    """
+
+    header = f">{name} {description}".rstrip() + "\n"
+    writer.write(header.encode())
+
+    record = FaidxRecord(
+        name, len(sequence), writer.tell(), line_width, line_width + 1
+    )
+
+    data = np.frombuffer(sequence, dtype=np.uint8)
+    full_lines = len(data) // line_width
+
+    for start in range(0, full_lines, chunk_lines):
+        end = min(start + chunk_lines, full_lines)
+        lines = np.empty((end - start, line_width + 1), dtype=np.uint8)
+        lines[:, :line_width] = data[
+            start * line_width : end * line_width
+        ].reshape(-1, line_width)
+        lines[:, line_width] = ord("\n")
+        writer.write(lines.tobytes())
+
+    if len(data) % line_width:
+        writer.write(data[full_lines * line_width :].tobytes() + b"\n")
+
+    return record
+
+
+@click.command()
+@click.option(
+    "--vcf",
+    "vcf_file",
+    help="Input VCF file",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+)
+@click.option(
+    "--output",
+    help="Output FASTA file (.fa.gz)",
+    type=click.Path(dir_okay=False),
+    required=True,
+)
+@click.option(
+    "--round_to",
+    help="Round up chromosome lengths to a multiple of this value",
+    type=int,
+    default=1_000_000,
+    show_default=True,
+)
+@click.option(
+    "--line_width",
+    help="FASTA line width",
+    type=int,
+    default=60,
+    show_default=True,
+)
+def fake_fasta_from_vcf(
+    vcf_file: click.Path, output: click.Path, round_to: int, line_width: int
+):
+    """
+    Create a fake FASTA file from a VCF file, with 'N's for each chromosome
+    present in the VCF and the REF allele at each variant position. This
+    could be used with bcftools reheader to add contig lines to the VCF
+    header. The VCF is read once, and each chromosome is written (as BGZF,
+    with .fai and .gzi indexes) as soon as all its variants are read.
+    """
+
+    import cyvcf2
+
+    if not output.endswith(".fa.gz"):
+        raise click.BadParameter("output file must have .fa.gz extension")
+
+    if os.path.exists(output):
+        raise click.BadParameter(f"output file '{output}' already exists")
+
+    vcf = cyvcf2.VCF(vcf_file)
+    records = []
+
+    # the chromosome we are working on
+    chrom, sequence = None, None
+
+    def finalize():
+        length = len(sequence)
+        logger.info(f"Writing chromosome {chrom} ({length} bp)")
+        records.append(
+            write_sequence(
+                writer,
+                chrom,
+                sequence,
+                description=f"Fake sequence for chrom {chrom} of length {length}",
+                line_width=line_width,
+            )
+        )
+
+    with BgzfWriter(output) as writer:
+        for variant in vcf:
+            if variant.CHROM != chrom:
+                if chrom is not None:
+                    finalize()
+
+                if any(record.name == variant.CHROM for record in records):
+                    raise ValueError(
+                        f"Chromosome {variant.CHROM} is not contiguous in "
+                        f"{vcf_file}: VCF needs to be sorted"
+                    )
+
+                chrom, sequence = variant.CHROM, bytearray()
+
+            # fill in REF alleles from VCF (0-based)
+            start = variant.POS - 1
+            ref_allele = variant.REF.encode()
+            end = start + len(ref_allele)
+
+            if end > len(sequence):
+                # grow sequence rounding up to the nearest million
+                length = math.ceil(end / round_to) * round_to
+                sequence.extend(b"N" * (length - len(sequence)))
+
+            sequence[start:end] = ref_allele
+
+        if chrom is not None:
+            finalize()
+
+    vcf.close()
+
+    write_fasta_index(records, output + ".fai")
+    writer.write_gzi(output + ".gzi")
+
+    logger.info(f"Written {len(records)} chromosomes to {output}")
@@ -0,0 +1,370 @@
+import csv
+import logging
+import itertools
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import click
+import numpy as np
+import tskit
+
+from .dating import load_tree_sequence
+from .gnn import get_breed_sample_sets, get_chrom
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+STATS_MODES = ["site", "branch"]
+
+# how windows and chromosomes are combined: by sequence length or sites
+WEIGHTINGS = ["length", "sites"]
+
+# the group of the statistics computed on all the samples
+ALL_SAMPLES = "all"
+
+
+@dataclasses.dataclass
+class ChromStats:
+    """
+    Statistics of a chromosome in windows, not normalised: summing values of
+    different windows (and chromosomes) gives the statistic of the union,
+    which is then divided by its length or number of sites. ``pairs`` are
+    the two breeds of each divergence group.
+    """
+
+    chrom: str
+    windows: np.ndarray
+    num_sites: np.ndarray
+    groups: Dict[str, List[str]]
+    values: Dict[str, np.ndarray]
+    pairs: Dict[str, Tuple[str, str]] = dataclasses.field(default_factory=dict)
+
+    @property
+    def span(self) -> np.ndarray:
+        return np.diff(self.windows)
+
+    @property
+    def num_windows(self) -> int:
+        return len(self.windows) - 1
+
+    def denominator(self, weighting: str) -> np.ndarray:
+        """The length or the number of sites of each window"""
+
+        return self.span if weighting == "length" else self.num_sites
+
+
+def make_windows(
+    sequence_length: float, window_size: Optional[float] = None
+) -> np.ndarray:
+    """Window breakpoints of window_size (the whole sequence if None)"""
+
+    if window_size is None:
+        return np.array([0, sequence_length])
+
+    return np.append(np.arange(0, sequence_length, window_size), sequence_length)
+
+
+def chrom_stats(
+    ts: tskit.TreeSequence,
+    chrom: str,
+    mode: str = "site",
+    window_size: Optional[float] = None,
+) -> ChromStats:
+    """
+    Compute diversity and segregating sites of all samples and of each breed,
+    and the divergence of each pair of breeds, in windows of a chromosome
+    """
+
+    breeds, sample_sets = get_breed_sample_sets(ts)
+    windows = make_windows(ts.sequence_length, window_size)
+
+    window_index = np.searchsorted(windows, ts.sites_position, side="right") - 1
+    num_sites = np.bincount(window_index, minlength=len(windows) - 1)
+
+    groups = [ALL_SAMPLES] + breeds
+    sets = [ts.samples()] + sample_sets
+    options = dict(windows=windows, mode=mode, span_normalise=False)
+
+    values = {
+        "diversity": ts.diversity(sets, **options),
+        "segregating_sites": ts.segregating_sites(sets, **options),
+    }
+    stat_groups = {"diversity": groups, "segregating_sites": groups}
+
+    indexes = list(itertools.combinations(range(len(breeds)), 2))
+    pairs = {f"{breeds[i]}-{breeds[j]}": (breeds[i], breeds[j]) for i, j in indexes}
+
+    if indexes:
+        values["divergence"] = ts.divergence(sample_sets, indexes=indexes, **options)
+        stat_groups["divergence"] = list(pairs)
+
+    return ChromStats(chrom, windows, num_sites, stat_groups, values, pairs)
+
+
+def _chrom_stats_worker(
+    input_trees: str, mode: str, window_size: Optional[float]
+) -> ChromStats:
+    # a chromosome is loaded only in its worker: only the statistics are
+    # returned to the main process
+    ts = load_tree_sequence(input_trees)
+
+    return chrom_stats(ts, get_chrom(ts, input_trees), mode, window_size)
+
+
+def hudson_fst(
+    diversity: Dict[str, float],
+    divergence: Dict[str, float],
+    pairs: Dict[str, Tuple[str, str]],
+):
+    """
+    Hudson Fst of each pair of breeds, as a ratio of totals. Divergence
+    groups are labels: pairs are their breeds.
+    """
+
+    fst = {}
+
+    for pair, between in divergence.items():
+        breed1, breed2 = pairs[pair]
+        within = (diversity[breed1] + diversity[breed2]) / 2
+        between = np.asarray(between, dtype=float)
+
+        # values could be arrays of replicates (see resampling)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fst[pair] = np.where(between != 0, 1 - within / between, np.nan)[()]
+
+    return fst
+
+
+def check_groups(chroms: List[ChromStats]) -> Dict[str, List[str]]:
+    """Check that the chromosomes have the same breeds, and return them"""
+
+    groups = chroms[0].groups
+
+    for chrom in chroms[1:]:
+        if chrom.groups != groups:
+            raise ValueError(
+                f"Different breeds in chromosomes {chroms[0].chrom} and {chrom.chrom}"
+            )
+
+    return groups
+
+
+def summarise(
+    chroms: List[ChromStats], scope: str, weighting: str = "length"
+) -> List[dict]:
+    """
+    Combine the windows of the chromosomes summing statistics, lengths and
+    sites, and normalise each total by length or number of sites
+    """
+
+    groups = check_groups(chroms)
+
+    span = float(sum(chrom.span.sum() for chrom in chroms))
+    num_sites = int(sum(chrom.num_sites.sum() for chrom in chroms))
+    denominator = span if weighting == "length" else num_sites
+
+    rows, totals = [], {}
+
+    for stat, names in groups.items():
+        total = sum(chrom.values[stat].sum(axis=0) for chrom in chroms)
+        totals[stat] = dict(zip(names, total))
+
+        for name, value in totals[stat].items():
+            rows.append(
+                {
+                    "scope": scope,
+                    "stat": stat,
+                    "group": name,
+                    "span": span,
+                    "num_sites": num_sites,
+                    "value": value / denominator if denominator else np.nan,
+                }
+            )
+
+    if "divergence" in totals:
+        fst = hudson_fst(totals["diversity"], totals["divergence"], chroms[0].pairs)
+
+        for pair, value in fst.items():
+            rows.append(
+                {
+                    "scope": scope,
+                    "stat": "Fst",
+                    "group": pair,
+                    "span": span,
+                    "num_sites": num_sites,
+                    "value": value,
+                }
+            )
+
+    return rows
+
+
+def combine_stats(chroms: List[ChromStats], weighting: str = "length") -> List[dict]:
+    """Summaries of each chromosome followed by the genome-wide ones"""
+
+    rows = []
+
+    for chrom in chroms:
+        rows += summarise([chrom], chrom.chrom, weighting)
+
+    return rows + summarise(chroms, "genome", weighting)
+
+
+def window_rows(chroms: List[ChromStats], weighting: str = "length") -> List[dict]:
+    """The statistics of each window, normalised by length or sites"""
+
+    rows = []
+
+    for chrom in chroms:
+        denominator = chrom.denominator(weighting)
+
+        for stat, names in chrom.groups.items():
+            values = chrom.values[stat]
+
+            for i in range(chrom.num_windows):
+                for j, name in enumerate(names):
+                    rows.append(
+                        {
+                            "chrom": chrom.chrom,
+                            "start": chrom.windows[i],
+                            "end": chrom.windows[i + 1],
+                            "num_sites": chrom.num_sites[i],
+                            "stat": stat,
+                            "group": name,
+                            "value": (
+                                values[i, j] / denominator[i]
+                                if denominator[i]
+                                else np.nan
+                            ),
+                        }
+                    )
+
+    return rows
+
+
+def format_value(value):
+    if isinstance(value, float):
+        # positions and lengths as integers
+        return str(int(value)) if value.is_integer() else f"{value:.6g}"
+
+    return value
+
+
+def write_tsv(rows: List[dict], path: str):
+    with open(path, "w", newline="") as handle:
+        writer = csv.DictWriter(
+            handle, fieldnames=list(rows[0]), delimiter="\t", lineterminator="\n"
+        )
+        writer.writeheader()
+
+        for row in rows:
+            writer.writerow({key: format_value(value) for key, value in row.items()})
+
+
+def compute_chroms_stats(
+    input_trees: List[str],
+    mode: str = "site",
+    window_size: Optional[float] = None,
+    processes: int = 1,
+) -> List[ChromStats]:
+    """
+    Compute the statistics of each chromosome tree sequence in a process
+    pool, returning them in input order
+    """
+
+    results = [None] * len(input_trees)
+
+    with ProcessPoolExecutor(max_workers=min(processes, len(input_trees))) as executor:
+        futures = {
+            executor.submit(_chrom_stats_worker, path, mode, window_size): i
+            for i, path in enumerate(input_trees)
+        }
+
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+
+            logger.info(
+                f"Computed statistics for chromosome {results[i].chrom} "
+                f"({input_trees[i]})"
+            )
+
+    return results
+
+
+@click.command()
+@click.option(
+    "--input_trees",
+    help="Tree sequence of a chromosome (.trees or .tsz), could be repeated",
+    type=click.Path(exists=True, dir_okay=False),
+    multiple=True,
+    required=True,
+)
+@click.option(
+    "--mode",
+    help="tskit statistics mode",
+    type=click.Choice(STATS_MODES),
+    default="site",
+    show_default=True,
+)
+@click.option(
+    "--window_size",
+    help="Compute statistics in windows of this size (bp)",
+    type=float,
+    default=None,
+)
+@click.option(
+    "--weighting",
+    help="Normalise statistics by sequence length or by number of sites",
+    type=click.Choice(WEIGHTINGS),
+    default="length",
+    show_default=True,
+)
+@click.option(
+    "--output",
+    help="Output TSV with per chromosome and genome-wide statistics",
+    type=click.Path(dir_okay=False),
+    required=True,
+)
+@click.option(
+    "--output_windows",
+    help="Output TSV with the statistics of each window",
+    type=click.Path(dir_okay=False),
+    default=None,
+)
+@click.option(
+    "--processes",
+    help="Number of chromosomes processed in parallel",
+    type=int,
+    default=1,
+    show_default=True,
+)
+def genome_stats(
+    input_trees: List[str],
+    mode: str,
+    window_size: float,
+    weighting: str,
+    output: str,
+    output_windows: str,
+    processes: int,
+):
+    """
+    Compute diversity, segregating sites, divergence and Fst of all the
+    samples and of each breed on the tree sequence of each chromosome, and
+    combine them in genome-wide values. Chromosomes are processed in parallel
+    and never merged: statistics are summed across chromosomes and then
+    normalised by total length or number of sites.
+    """
+
+    chroms = compute_chroms_stats(input_trees, mode, window_size, processes)
+
+    write_tsv(combine_stats(chroms, weighting), output)
+    logger.info(f"Genome-wide statistics written to {output}")
+
+    if output_windows:
+        write_tsv(window_rows(chroms, weighting), output_windows)
+        logger.info(f"Window statistics written to {output_windows}")
@@ -0,0 +1,323 @@
+import os
+import logging
+import pathlib
+import dataclasses
+from typing import List, Optional, Tuple
+
+import click
+import numpy as np
+import tskit
+
+from .breedindex import decode_metadata, get_breed_index, get_population_breeds
+from .dating import load_tree_sequence
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+# the columns before the breed ones in the GNN Parquet files
+GNN_COLUMNS = ["chrom", "sample_id", "breed", "sequence_length"]
+
+
+@dataclasses.dataclass
+class GNNMatrix:
+    """
+    Genealogical nearest neighbours proportions of each individual (rows)
+    against each breed (columns), averaged over the individual sample nodes
+    and the genome. ``sequence_length`` is used as a weight to aggregate
+    chromosomes.
+    """
+
+    chrom: np.ndarray
+    sample_id: np.ndarray
+    breed: np.ndarray
+    sequence_length: np.ndarray
+    breeds: List[str]
+    values: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.sample_id)
+
+    def to_parquet(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = {
+            "chrom": pa.array(self.chrom, pa.string()),
+            "sample_id": pa.array(self.sample_id, pa.string()),
+            "breed": pa.array(self.breed, pa.string()),
+            "sequence_length": pa.array(self.sequence_length, pa.float64()),
+        }
+
+        for i, breed in enumerate(self.breeds):
+            columns[breed] = pa.array(self.values[:, i], pa.float32())
+
+        pq.write_table(pa.table(columns), path)
+
+    @classmethod
+    def from_parquet(cls, path: str) -> "GNNMatrix":
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        breeds = [name for name in table.column_names if name not in GNN_COLUMNS]
+
+        return cls(
+            chrom=table["chrom"].to_numpy(zero_copy_only=False).astype(object),
+            sample_id=table["sample_id"].to_numpy(zero_copy_only=False).astype(object),
+            breed=table["breed"].to_numpy(zero_copy_only=False).astype(object),
+            sequence_length=table["sequence_length"].to_numpy(),
+            breeds=breeds,
+            values=np.column_stack(
+                [table[breed].to_numpy() for breed in breeds]
+            ).astype(np.float32)
+            if breeds
+            else np.zeros((table.num_rows, 0), dtype=np.float32),
+        )
+
+    @classmethod
+    def concatenate(cls, matrices: List["GNNMatrix"]) -> "GNNMatrix":
+        breeds = matrices[0].breeds
+
+        for matrix in matrices[1:]:
+            if matrix.breeds != breeds:
+                raise ValueError(
+                    f"Different breeds in GNN matrices: {breeds} and {matrix.breeds}"
+                )
+
+        return cls(
+            chrom=np.concatenate([matrix.chrom for matrix in matrices]),
+            sample_id=np.concatenate([matrix.sample_id for matrix in matrices]),
+            breed=np.concatenate([matrix.breed for matrix in matrices]),
+            sequence_length=np.concatenate(
+                [matrix.sequence_length for matrix in matrices]
+            ),
+            breeds=breeds,
+            values=np.concatenate([matrix.values for matrix in matrices]),
+        )
+
+    def aggregate(self) -> "GNNMatrix":
+        """
+        Combine the rows of the same individual (one for each chromosome),
+        weighting each chromosome by its sequence length
+        """
+
+        sample_ids, first, inverse = np.unique(
+            self.sample_id.astype(str), return_index=True, return_inverse=True
+        )
+
+        # keep individuals in order of appearance
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        inverse = rank[inverse]
+
+        weights = self.sequence_length
+        totals = np.zeros(len(sample_ids))
+        np.add.at(totals, inverse, weights)
+
+        values = np.zeros((len(sample_ids), len(self.breeds)))
+        np.add.at(values, inverse, self.values * weights[:, None])
+
+        return GNNMatrix(
+            chrom=np.full(len(sample_ids), "all", dtype=object),
+            sample_id=self.sample_id[first[order]],
+            breed=self.breed[first[order]],
+            sequence_length=totals,
+            breeds=self.breeds,
+            values=(values / totals[:, None]).astype(np.float32),
+        )
+
+
+def get_breed_sample_sets(ts: tskit.TreeSequence) -> Tuple[List[str], List[np.ndarray]]:
+    """
+    Return the breeds with samples and the sample nodes of each breed, from
+    the breed index stored by annotate_tree or built from the tables
+    """
+
+    return get_breed_index(ts).sample_sets()
+
+
+def compute_gnn(
+    ts: tskit.TreeSequence,
+    sample_sets: List[np.ndarray],
+    focal: Optional[np.ndarray] = None,
+    chunk_size: int = 10_000,
+    num_threads: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Compute the GNN proportions of focal nodes (all samples by default)
+    against sample_sets, a chunk of focal nodes at a time. Focal nodes of a
+    chunk are split among ``num_threads`` threads (all the CPUs by default)
+    by tskit, each traversing the tree sequence once.
+    """
+
+    if focal is None:
+        focal = ts.samples()
+
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+
+    gnn = np.zeros((len(focal), len(sample_sets)))
+
+    for start in range(0, len(focal), chunk_size):
+        end = min(start + chunk_size, len(focal))
+        gnn[start:end] = ts.genealogical_nearest_neighbours(
+            focal[start:end], sample_sets, num_threads=num_threads
+        )
+
+        logger.info(f"Computed GNN for {end}/{len(focal)} focal nodes")
+
+    return gnn
+
+
+def get_chrom(ts: tskit.TreeSequence, path: str) -> str:
+    """The chromosome stored by create_tstree, or the file name"""
+
+    metadata = decode_metadata(ts.metadata)
+
+    if "chrom" in metadata:
+        return str(metadata["chrom"])
+
+    return pathlib.Path(path).name.split(".")[0]
+
+
+def individuals_gnn(
+    ts: tskit.TreeSequence,
+    chrom: str,
+    chunk_size: int = 10_000,
+    num_threads: Optional[int] = None,
+) -> GNNMatrix:
+    """
+    Compute the GNN matrix of all the individuals with sample nodes against
+    all the breeds: the GNN proportions of each sample node are averaged
+    over the nodes of the same individual.
+    """
+
+    breeds, sample_sets = get_breed_sample_sets(ts)
+
+    samples = ts.samples()
+    node_individual = ts.nodes_individual[samples]
+
+    if np.any(node_individual == tskit.NULL):
+        raise ValueError(f"Sample nodes without an individual in chromosome {chrom}")
+
+    if np.any(ts.nodes_population[samples] == tskit.NULL):
+        raise ValueError(f"Sample nodes without a population in chromosome {chrom}")
+
+    gnn = compute_gnn(ts, sample_sets, samples, chunk_size, num_threads)
+
+    # average the nodes of each individual (in individual order)
+    individuals, inverse = np.unique(node_individual, return_inverse=True)
+    counts = np.bincount(inverse)
+
+    values = np.zeros((len(individuals), len(breeds)))
+    np.add.at(values, inverse, gnn)
+    values /= counts[:, None]
+
+    # the breed of each individual is the population of its first node
+    first_node = np.zeros(len(individuals), dtype=np.int64)
+    first_node[inverse[::-1]] = np.arange(len(samples))[::-1]
+    population = ts.nodes_population[samples[first_node]]
+    population_breeds = get_population_breeds(ts.tables)
+
+    return GNNMatrix(
+        chrom=np.full(len(individuals), chrom, dtype=object),
+        sample_id=np.array(
+            [
+                decode_metadata(ts.individual(i).metadata).get("sample_id", f"ind{i}")
+                for i in individuals
+            ],
+            dtype=object,
+        ),
+        breed=np.array([population_breeds[p] for p in population], dtype=object),
+        sequence_length=np.full(len(individuals), ts.sequence_length),
+        breeds=breeds,
+        values=values.astype(np.float32),
+    )
+
+
+@click.command()
+@click.option(
+    "--input_trees",
+    help="Tree sequence (.trees or .tsz) with breed metadata (could be repeated)",
+    type=click.Path(exists=True, dir_okay=False),
+    multiple=True,
+)
+@click.option(
+    "--input_gnn",
+    help="GNN matrix (.parquet) written by this command (could be repeated)",
+    type=click.Path(exists=True, dir_okay=False),
+    multiple=True,
+)
+@click.option(
+    "--output",
+    help="Output GNN matrix (.parquet)",
+    type=click.Path(dir_okay=False),
+    required=True,
+)
+@click.option(
+    "--aggregate",
+    help="Combine chromosomes: one row for each individual, weighted by length",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--chunk_size",
+    help="Number of focal nodes for each GNN call",
+    type=int,
+    default=10_000,
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    help="Threads computing GNN for a chunk of focal nodes (default: all CPUs)",
+    type=int,
+    default=None,
+)
+def gnn(
+    input_trees: List[str],
+    input_gnn: List[str],
+    output: str,
+    aggregate: bool,
+    chunk_size: int,
+    threads: Optional[int],
+):
+    """
+    Compute the genealogical nearest neighbours (GNN) proportions of every
+    individual against every breed, writing an individual x breed matrix in
+    Parquet with a row for each chromosome. GNN matrices of other chromosomes
+    could be added and all the chromosomes aggregated in a single row per
+    individual.
+    """
+
+    if not input_trees and not input_gnn:
+        raise click.UsageError("Provide --input_trees or --input_gnn")
+
+    matrices = []
+
+    for path in input_trees:
+        ts = load_tree_sequence(path)
+        chrom = get_chrom(ts, path)
+
+        logger.info(
+            f"Computing GNN for {ts.num_individuals} individuals of chromosome "
+            f"{chrom}"
+        )
+        matrices.append(individuals_gnn(ts, chrom, chunk_size, threads))
+
+    for path in input_gnn:
+        matrices.append(GNNMatrix.from_parquet(path))
+
+    matrix = GNNMatrix.concatenate(matrices)
+
+    if aggregate:
+        matrix = matrix.aggregate()
+
+    matrix.to_parquet(output)
+
+    logger.info(
+        f"Written GNN of {len(matrix)} rows against {len(matrix.breeds)} breeds "
+        f"to {output}"
+    )
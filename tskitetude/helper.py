@@ -1,21 +1,35 @@
-import io
 import csv
 import json
 import logging
 import datetime
 import collections
-from functools import partial
-from typing import Dict, Tuple, List, Union
+from typing import TYPE_CHECKING, Dict, Tuple, List, Optional, Union
 
 import click
-import cyvcf2
-import tsdate
-import tsinfer
-import tszip
+import tskit
 import numpy as np
 from click_option_group import optgroup, RequiredMutuallyExclusiveOptionGroup
 from tskit import MISSING_DATA
-from tqdm import tqdm
+
+from . import INDIVIDUAL_METADATA_SCHEMA, POPULATION_METADATA_SCHEMA
+from .breedindex import write_breed_index
+from .dating import TSDATE_DEFAULT_NE, date_in_chunks, date_tree_sequence
+from .progress import ProgressReporter
+from .siteqc import ALLELE_CHARS, log_site_qc, qc_vcf, qc_vcz
+from .samplesheet import (
+    DELIMITERS,
+    SampleSheet,
+    guess_delimiter,
+    load_sample_sheet,
+    read_vcf_samples,
+)
+from .vcfzarr import get_contigs, load_variant_data
+
+if TYPE_CHECKING:
+    # tsinfer, tsdate, tszip and cyvcf2 are imported where they are used:
+    # they are slow to import and not needed by --help or annotate_tree
+    import cyvcf2
+    import tsinfer
 
 log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 logging.basicConfig(level=logging.INFO, format=log_fmt)
@@ -27,48 +41,47 @@ logger = logging.getLogger(__name__)
 tsinfer_log = logging.getLogger("tsinfer")
 tsinfer_log.setLevel(logging.INFO)
 
-# some constants
-TSDATE_DEFAULT_NE = 1e4
+# compressors for tsinfer.SampleData arrays (zstd is the tsinfer default)
+COMPRESSORS = ["zstd", "lz4", "zlib", "none"]
 
 
-class TqdmToLogger(io.StringIO):
-    """
-    Output stream for TQDM which will output to logger module instead of
-    the StdOut.
-    """
+def get_compressor(name: str):
+    """Return the numcodecs compressor for a name in COMPRESSORS"""
 
-    logger = None
-    level = None
-    buf = ""
+    import numcodecs
 
-    def __init__(self, logger, level=None):
-        super(TqdmToLogger, self).__init__()
-        self.logger = logger
-        self.level = level or logging.INFO
-
-    def write(self, buf):
-        self.buf = buf.strip("\r\n\t ")
+    compressors = {
+        "zstd": numcodecs.Zstd,
+        "lz4": lambda: numcodecs.Blosc(
+            cname="lz4", shuffle=numcodecs.Blosc.BITSHUFFLE
+        ),
+        "zlib": numcodecs.Zlib,
+        "none": lambda: None,
+    }
 
-    def flush(self):
-        self.logger.log(self.level, self.buf)
+    return compressors[name]()
 
 
-def open_csv(csv_file: str) -> csv.reader:
+def open_csv(csv_file: str, delimiter: Optional[str] = None) -> csv.reader:
     """
-    Open a csv file and return a csv.reader object
+    Open a csv file and return a csv.reader object. The delimiter is guessed
+    from the first line if not provided
     """
 
-    with open(csv_file) as handle:
-        sniffer = csv.Sniffer()
-        dialect = sniffer.sniff(handle.read(1024))
-        handle.seek(0)
-        reader = csv.reader(handle, dialect)
+    with open(csv_file, newline="") as handle:
+        if delimiter is None:
+            delimiter = guess_delimiter(handle.readline())
+            handle.seek(0)
+
+        reader = csv.reader(handle, delimiter=delimiter)
 
         for line in reader:
             yield line
 
 
-def add_populations(csv_file: str, samples: tsinfer.SampleData) -> Dict[str, int]:
+def add_populations(
+    csv_file: str, samples: "tsinfer.SampleData", delimiter: Optional[str] = None
+) -> Dict[str, int]:
     """
     Attempt to define metadata like tsinfer tutorial
     """
@@ -76,15 +89,17 @@ def add_populations(csv_file: str, samples: tsinfer.SampleData) -> Dict[str, int
     # add population to SampleData object and track reference
     pop_lookup = {}
 
-    for breed, _ in open_csv(csv_file):
-        if breed not in pop_lookup:
-            pop_lookup[breed] = samples.add_population(metadata={"breed": breed})
+    for breed in load_sample_sheet(csv_file, delimiter).populations:
+        pop_lookup[breed] = samples.add_population(metadata={"breed": breed})
 
     return pop_lookup
 
 
 def add_diploid_individuals(
-    csv_file: str, pop_lookup: Dict[str, int], samples: tsinfer.SampleData
+    csv_file: str,
+    pop_lookup: Dict[str, int],
+    samples: "tsinfer.SampleData",
+    delimiter: Optional[str] = None,
 ) -> Dict[str, Tuple[int, List[int]]]:
     """
     Try to add diploid samples. Returns a dictionary mapping sample_id to
@@ -94,7 +109,8 @@ def add_diploid_individuals(
     # track added individuals
     indv_lookup = {}
 
-    for breed, sample_id in open_csv(csv_file):
+    # the sample sheet is cached: this doesn't parse the file again
+    for breed, sample_id in load_sample_sheet(csv_file, delimiter):
         population = pop_lookup[breed]
         indv_lookup[sample_id] = samples.add_individual(
             ploidy=2, metadata={"sample_id": sample_id}, population=population
@@ -127,7 +143,186 @@ def get_ancestors_alleles(
     return ancestors
 
 
-def get_chromosome_lengths(vcf: cyvcf2.VCF) -> Dict[str, int]:
+def decode_metadata_column(table, schema: tskit.MetadataSchema) -> List[dict]:
+    """
+    Decode and validate the metadata column of a tskit table (one row per
+    individual or population, not per node) using a tskitetude schema
+    """
+
+    rows = []
+
+    for raw in tskit.unpack_bytes(table.metadata, table.metadata_offset):
+        row = schema.decode_row(raw)
+        schema.validate_and_encode_row(row)
+        rows.append(row)
+
+    return rows
+
+
+def check_metadata(
+    ts: tskit.TreeSequence, sample_sheet: Optional[SampleSheet] = None
+) -> List[str]:
+    """
+    Check sample nodes against individuals and populations using the node
+    table columns: every sample node needs an individual and a population,
+    every individual two sample nodes in the same population and, if a
+    sample sheet is provided, the breed of the sample sheet. Returns the
+    inconsistencies found (an empty list if everything is fine).
+    """
+
+    errors = []
+
+    samples = ts.samples()
+    node_individual = ts.nodes_individual[samples]
+    node_population = ts.nodes_population[samples]
+
+    def report(mask, message):
+        if np.any(mask):
+            examples = samples[mask][:5].tolist()
+            errors.append(f"{np.sum(mask)} sample nodes {message} (eg. {examples})")
+
+    report(node_individual == tskit.NULL, "without an individual")
+    report(node_population == tskit.NULL, "without a population")
+
+    valid = (node_individual != tskit.NULL) & (node_population != tskit.NULL)
+    individuals = node_individual[valid]
+    populations = node_population[valid]
+
+    # diploid individuals: two sample nodes in the same population
+    counts = np.bincount(individuals, minlength=ts.num_individuals)
+
+    if np.any(counts != 2):
+        wrong = np.flatnonzero(counts != 2)
+        errors.append(
+            f"{len(wrong)} individuals without two sample nodes "
+            f"(eg. {wrong[:5].tolist()})"
+        )
+
+    min_population = np.full(ts.num_individuals, ts.num_populations)
+    max_population = np.full(ts.num_individuals, -1)
+    np.minimum.at(min_population, individuals, populations)
+    np.maximum.at(max_population, individuals, populations)
+
+    mask = np.zeros(len(samples), dtype=bool)
+    mask[valid] = min_population[individuals] != max_population[individuals]
+    report(mask, "in a different population than the other node of the individual")
+
+    tables = ts.tables
+
+    try:
+        sample_ids = [
+            row["sample_id"]
+            for row in decode_metadata_column(
+                tables.individuals, INDIVIDUAL_METADATA_SCHEMA
+            )
+        ]
+        breeds = np.array(
+            [
+                row["breed"]
+                for row in decode_metadata_column(
+                    tables.populations, POPULATION_METADATA_SCHEMA
+                )
+            ]
+        )
+
+    except (tskit.MetadataValidationError, ValueError) as exc:
+        errors.append(f"Invalid metadata: {exc}")
+        return errors
+
+    if sample_sheet is not None:
+        # the sample sheet row of each individual (-1 if missing)
+        rows = np.array(
+            [sample_sheet.sample_index.get(sample_id, -1) for sample_id in sample_ids],
+            dtype=np.int64,
+        )
+        sheet_breeds = np.array(sample_sheet.breeds + ("",))
+
+        node_rows = rows[individuals]
+
+        mask[:] = False
+        mask[valid] = node_rows == -1
+        report(mask, "of individuals not in the sample sheet")
+
+        mask[:] = False
+        mask[valid] = (node_rows != -1) & (
+            sheet_breeds[node_rows] != breeds[populations]
+        )
+        report(mask, "in a population different from the sample sheet")
+
+    return errors
+
+
+def get_chunk_size(
+    num_samples: int,
+    chunk_size: int = 1024,
+    max_memory: Optional[float] = None,
+    num_buffers: int = 1,
+) -> int:
+    """
+    Return the number of sites buffered in memory before being flushed to
+    disk: tsinfer keeps ``num_buffers`` genotype buffers of ``chunk_size``
+    sites for all samples (int8). The chunk size is reduced if these buffers
+    don't fit in ``max_memory`` MB.
+    """
+
+    if max_memory is None:
+        return chunk_size
+
+    max_sites = int(max_memory * 2**20) // (num_samples * max(1, num_buffers))
+
+    if max_sites < 1:
+        raise ValueError(
+            f"Cannot buffer a single site for {num_samples} samples "
+            f"in {max_memory} MB"
+        )
+
+    if max_sites < chunk_size:
+        logger.warning(
+            f"Reducing chunk size from {chunk_size} to {max_sites} sites to "
+            f"keep genotype buffers below {max_memory} MB"
+        )
+        chunk_size = max_sites
+
+    return chunk_size
+
+
+def create_sample_data(
+    path: str,
+    sequence_length: int,
+    num_samples: int,
+    chunk_size: int = 1024,
+    compressor: str = "zstd",
+    max_file_size: Optional[int] = None,
+    max_memory: Optional[float] = None,
+    num_flush_threads: int = 0,
+) -> "tsinfer.SampleData":
+    """
+    Create a tsinfer.SampleData with the given storage options. Genotypes are
+    flushed to disk every ``chunk_size`` sites, so the memory used while
+    adding sites doesn't depend on the chromosome length.
+    """
+
+    import tsinfer
+
+    chunk_size = get_chunk_size(
+        num_samples, chunk_size, max_memory, num_buffers=num_flush_threads
+    )
+
+    logger.info(
+        f"Creating {path} with chunk size {chunk_size} and {compressor} compressor"
+    )
+
+    return tsinfer.SampleData(
+        path=path,
+        sequence_length=sequence_length,
+        chunk_size=chunk_size,
+        compressor=get_compressor(compressor),
+        max_file_size=max_file_size,
+        num_flush_threads=num_flush_threads,
+    )
+
+
+def get_chromosome_lengths(vcf: "cyvcf2.VCF") -> Dict[str, int]:
     results = {}
     for seqname, seqlen in zip(vcf.seqnames, vcf.seqlens):
         results[seqname] = seqlen
@@ -135,7 +330,7 @@ def get_chromosome_lengths(vcf: cyvcf2.VCF) -> Dict[str, int]:
     return results
 
 
-def get_major_allele(variant: cyvcf2.Variant) -> int:
+def get_major_allele(variant: "cyvcf2.Variant") -> int:
     """
     Get the index of the major allele from a variant. Returns 0
     (reference allele) in case of a tie.
@@ -155,18 +350,155 @@ def get_major_allele(variant: cyvcf2.Variant) -> int:
     return major_idx
 
 
+def lookup_ancestral_allele(
+    key: Tuple[str, int],
+    alleles: List[str],
+    ancestors_alleles: Dict[Tuple[str, int], Union[int, str]],
+    ancestral_method: str,
+) -> int:
+    """
+    Return the index of the ancestral allele of a site (chrom, position) from
+    an est-sfs or ensembl-compara ancestors dictionary, or MISSING_DATA
+    """
+
+    if ancestral_method == "estsfs":
+        # get the ancestral allele from the dictionary (which is a number)
+        return ancestors_alleles.get(key, MISSING_DATA)
+
+    # get the ancestral allele from the dictionary (which is a string)
+    ancestral_allele = ancestors_alleles.get(key, MISSING_DATA)
+
+    # find the index of the ancestral allele in the alleles list
+    if ancestral_allele != MISSING_DATA and ancestral_allele in alleles:
+        return alleles.index(ancestral_allele)
+
+    return MISSING_DATA
+
+
+def get_samples_chrom(samples: "tsinfer.SampleData") -> Optional[str]:
+    """Return the chromosome stored by create_tstree in SampleData metadata"""
+
+    try:
+        return (samples.metadata or {}).get("chrom")
+
+    except KeyError:
+        # files created without top-level metadata
+        return None
+
+
+def copy_samples(
+    input_samples: str,
+    output_samples: str,
+    ancestors_alleles: Dict[Tuple[str, int], Union[int, str]],
+    ancestral_method: str = "estsfs",
+) -> "tsinfer.SampleData":
+    """
+    Copy a SampleData file created by create_tstree and rewrite only the
+    ancestral alleles: genotypes, individuals and populations are copied as
+    stored (compressed) chunks, without reading the VCF again. The major
+    allele method is not supported, since the VCF could have more samples
+    than the SampleData.
+    """
+
+    import tsinfer
+
+    source = tsinfer.load(input_samples)
+
+    if ancestral_method == "reference":
+        ancestral_alleles = np.zeros(source.num_sites, dtype=np.int8)
+
+    elif ancestral_method in ("estsfs", "ensembl"):
+        chrom = get_samples_chrom(source)
+
+        if chrom is None:
+            raise ValueError(
+                f"No chromosome in {input_samples} metadata: "
+                "create it again with create_tstree"
+            )
+
+        ancestral_alleles = np.fromiter(
+            (
+                lookup_ancestral_allele(
+                    (chrom, int(position)),
+                    list(alleles),
+                    ancestors_alleles,
+                    ancestral_method,
+                )
+                for position, alleles in zip(
+                    source.sites_position[:], source.sites_alleles[:]
+                )
+            ),
+            dtype=np.int8,
+            count=source.num_sites,
+        )
+
+    else:
+        raise NotImplementedError(
+            f"Ancestral method {ancestral_method} not supported with a SampleData"
+        )
+
+    num_alleles = np.array([len(alleles) for alleles in source.sites_alleles[:]])
+
+    if np.any(ancestral_alleles >= num_alleles):
+        raise ValueError("Ancestral allele index greater than the number of alleles")
+
+    logger.info(
+        f"Copying {input_samples} to {output_samples} with {ancestral_method} "
+        "ancestral alleles"
+    )
+
+    samples = source.copy(path=output_samples)
+    samples.data["sites/ancestral_allele"][:] = ancestral_alleles
+    samples.finalise()
+
+    source.close()
+
+    return samples
+
+
+def check_site_mask(vcf: "cyvcf2.VCF", site_mask: np.ndarray):
+    """
+    Check the site mask length with the number of records of an indexed VCF
+    before reading it (without an index, it's checked while reading)
+    """
+
+    try:
+        num_records = vcf.num_records
+
+    except ValueError:
+        # not indexed
+        return
+
+    if len(site_mask) != num_records:
+        raise ValueError(
+            f"Site mask has {len(site_mask)} values for {num_records} VCF records"
+        )
+
+
 def add_diploid_sites(
-    vcf: cyvcf2.VCF,
-    samples: tsinfer.Sample,
+    vcf: "cyvcf2.VCF",
+    samples: "tsinfer.SampleData",
     ancestors_alleles: Dict[Tuple[str, int], int],
     indv_lookup: Dict[str, int],
-    allele_chars=set("ATCG*"),
+    allele_chars=ALLELE_CHARS,
     ancestral_method="estsfs",
+    site_mask: Optional[np.ndarray] = None,
+    progress: Optional[ProgressReporter] = None,
+    max_missing: float = 1.0,
 ):
     """
-    Read the sites in the vcf and add them to the samples object.
+    Read the sites in the vcf and add them to the samples object. Sites
+    with a True value in site_mask (one value for each VCF record, see
+    siteqc.qc_vcf) are skipped. The checks of site_qc are done in the same
+    pass: duplicated sites, invalid alleles and sites with a greater fraction
+    than max_missing of missing genotypes are skipped, unphased genotypes and
+    multiple chromosomes raise a ValueError. Progress is counted in VCF
+    records.
     """
 
+    if site_mask is not None:
+        check_site_mask(vcf, site_mask)
+
     # logging which method we are using
     if ancestral_method in ["reference", "major"]:
         logger.info(f"Using {ancestral_method} allele as ancestral allele")
@@ -180,26 +512,58 @@ def add_diploid_sites(
     else:
         raise NotImplementedError("Ancestral method not implemented")
 
-    # allele_chars is now passed as argument
-
     # reset position
     pos = 0
 
-    # deal with logging an progress bar
-    tqdm_out = TqdmToLogger(logger, level=logging.INFO)
-    progressbar = tqdm(
-        total=samples.sequence_length,
-        mininterval=1,
-        desc="Read VCF",
-        unit="bp",
-        file=tqdm_out,
+    if progress is None:
+        progress = ProgressReporter(
+            "Read VCF", total=len(site_mask) if site_mask is not None else None
+        )
+
+    # Create a mapping from VCF sample order to the individual order in samples
+    # vcf.samples gives the VCF order, indv_lookup maps sample_id to individual_id.
+    # This is done once: genotypes of each variant are then reordered with
+    # a numpy index, without creating python lists
+    vcf_sample_order = vcf.samples
+    sample_id_to_vcf_idx = {
+        sample_id: idx for idx, sample_id in enumerate(vcf_sample_order)
+    }
+
+    # Sort individuals by their individual_id to get them in insertion order
+    sorted_samples = sorted(indv_lookup.items(), key=lambda x: x[1])
+
+    for sample_id, _ in sorted_samples:
+        if sample_id not in sample_id_to_vcf_idx:
+            raise ValueError(
+                f"Sample {sample_id} found in CSV but not in VCF. "
+                f"VCF samples: {vcf_sample_order}"
+            )
+
+    # Each individual is diploid, so genotypes are at positions
+    # [vcf_idx*2, vcf_idx*2+1] of the flattened genotypes
+    vcf_indexes = np.array(
+        [sample_id_to_vcf_idx[sample_id] for sample_id, _ in sorted_samples],
+        dtype=np.int64,
     )
+    haplotypes = np.stack([vcf_indexes * 2, vcf_indexes * 2 + 1], axis=1).reshape(-1)
 
     # check chromosome we are working on
     chrom = None
 
-    for variant in vcf:  # Loop over variants, each assumed at a unique site
-        progressbar.update(variant.POS - pos)
+    # the index of the last VCF record
+    i = -1
+
+    for i, variant in enumerate(vcf):  # Loop over variants
+        progress.update()
+
+        if site_mask is not None:
+            if i >= len(site_mask):
+                raise ValueError(
+                    f"Site mask has {len(site_mask)} values for more VCF records"
+                )
+
+            if site_mask[i]:
+                continue
 
         if not chrom:
             chrom = variant.CHROM
@@ -209,17 +573,45 @@ def add_diploid_sites(
                 raise ValueError("VCF file contains multiple chromosomes")
 
         if pos == variant.POS:
-            print(f"Duplicate entries at position {pos}, ignoring all but the first")
+            logger.warning(
+                f"Duplicate entries at position {pos}, ignoring all but the first"
+            )
             continue
 
         else:
             pos = variant.POS
 
-        if any([not phased for _, _, phased in variant.genotypes]):
+        vcf_genotypes = variant.genotype.array()
+        focal_genotypes = vcf_genotypes[vcf_indexes]
+
+        # like siteqc.genotype_qc, only for the individuals in samples
+        missing = np.any(focal_genotypes[:, :2] < 0, axis=1)
+        called = ~np.all(focal_genotypes[:, :2] < 0, axis=1)
+
+        if missing.mean() > max_missing:
+            logger.warning(
+                f"Ignoring site at pos {pos}: {missing.mean():.2%} missing genotypes"
+            )
+            continue
+
+        if np.any(called & ~focal_genotypes[:, -1].astype(bool)):
             raise ValueError("Unphased genotypes for variant at position", pos)
 
+        # drop the phase column
+        vcf_genotypes = vcf_genotypes[:, :2]
+
         alleles = [variant.REF.upper()] + [v.upper() for v in variant.ALT]
 
+        # Check we have ATCG alleles
+        invalid = [a for a in alleles if a not in allele_chars]
+
+        if invalid:
+            logger.warning(
+                f"Ignoring site at pos {pos}: alleles {invalid} not in "
+                f"{sorted(allele_chars)}"
+            )
+            continue
+
         if ancestral_method == "reference":
             # set ancestral allele to the first allele
             ancestral_allele = 0
@@ -228,25 +620,14 @@ def add_diploid_sites(
             # get the major allele index
             ancestral_allele = get_major_allele(variant)
 
-        elif ancestral_method == "estsfs":
-            # get the ancestral allele from the dictionary (which is a number)
-            ancestral_allele = ancestors_alleles.get(
-                (variant.CHROM, variant.POS), MISSING_DATA
+        elif ancestral_method in ("estsfs", "ensembl"):
+            ancestral_allele = lookup_ancestral_allele(
+                (variant.CHROM, variant.POS),
+                alleles,
+                ancestors_alleles,
+                ancestral_method,
             )
 
-        elif ancestral_method == "ensembl":
-            # get the ancestral allele from the dictionary (which is a string)
-            ancestral_allele = ancestors_alleles.get(
-                (variant.CHROM, variant.POS), MISSING_DATA
-            )
-
-            # find the index of the ancestral allele in the alleles list
-            if ancestral_allele != MISSING_DATA and ancestral_allele in alleles:
-                ancestral_allele = alleles.index(ancestral_allele)
-
-            else:
-                ancestral_allele = MISSING_DATA
-
         else:
             raise NotImplementedError(
                 f"Ancestral method {ancestral_method} not implemented"
@@ -257,53 +638,44 @@ def add_diploid_sites(
             f"(ancestral allele {ancestral_allele})"
         )
 
-        # Check we have ATCG alleles
-        for a in alleles:
-            if a not in allele_chars:
-                print(f"Ignoring site at pos {pos}: allele {a} not in {allele_chars}")
-                continue
-
-        # Get genotypes from VCF and reorder them to match the order of individuals in samples
-        # VCF.samples gives us the order of samples in the VCF file
-        # We need to reorder genotypes to match the order individuals were added to samples
-        vcf_genotypes = [g for row in variant.genotypes for g in row[0:2]]
-
-        # Create a mapping from VCF sample order to the individual order in samples
-        # vcf.samples gives the VCF order, indv_lookup maps sample_id to individual_id
-        # We need to create an index mapping: vcf_index -> samples_index
-        vcf_sample_order = vcf.samples
-
-        # Create reordered genotypes array
-        # For each individual in the order they were added to samples,
-        # find their position in the VCF and extract their genotypes
-        genotypes = []
-        sample_id_to_vcf_idx = {
-            sample_id: idx for idx, sample_id in enumerate(vcf_sample_order)
-        }
-
-        # Sort individuals by their individual_id to get them in insertion order
-        sorted_samples = sorted(indv_lookup.items(), key=lambda x: x[1])
-
-        for sample_id, _ in sorted_samples:
-            if sample_id not in sample_id_to_vcf_idx:
-                raise ValueError(
-                    f"Sample {sample_id} found in CSV but not in VCF. "
-                    f"VCF samples: {vcf_sample_order}"
-                )
-            vcf_idx = sample_id_to_vcf_idx[sample_id]
-            # Each individual is diploid, so genotypes are at positions [vcf_idx*2, vcf_idx*2+1]
-            genotypes.extend(vcf_genotypes[vcf_idx * 2 : vcf_idx * 2 + 2])
+        # Get genotypes from VCF (as a samples x (ploidy + phase) numpy array)
+        # and reorder them to match the order of individuals in samples
+        genotypes = vcf_genotypes.reshape(-1)[haplotypes].astype(np.int8)
 
         samples.add_site(pos, genotypes, alleles, ancestral_allele=ancestral_allele)
 
+    progress.close()
+
+    if site_mask is not None and len(site_mask) != i + 1:
+        raise ValueError(
+            f"Site mask has {len(site_mask)} values for {i + 1} VCF records"
+        )
+
 
 @click.command()
-@click.option(
+@optgroup.group(
+    "Input genotypes",
+    cls=RequiredMutuallyExclusiveOptionGroup,
+)
+@optgroup.option(
     "--vcf",
     "vcf_file",
     help="A VCF file with all samples (focal/ancient)",
     type=click.Path(exists=True),
-    required=True,
+)
+@optgroup.option(
+    "--vcz",
+    "vcz_path",
+    help="A VCF Zarr store with all samples (see vcf_to_zarr)",
+    type=click.Path(exists=True, file_okay=False),
+)
+@optgroup.option(
+    "--input_samples",
+    help=(
+        "A tsinfer.SampleData file from a previous run (--output_samples): "
+        "only the ancestral alleles are computed again"
+    ),
+    type=click.Path(exists=True, dir_okay=False),
 )
 @click.option(
     "--focal",
@@ -312,6 +684,12 @@ def add_diploid_sites(
     type=click.Path(exists=True),
     required=True,
 )
+@click.option(
+    "--focal_delimiter",
+    help="focal samples CSV delimiter (guessed from first line by default)",
+    type=click.Choice(list(DELIMITERS)),
+    default=None,
+)
 @optgroup.group(
     "Ancestral allele parameters",
     cls=RequiredMutuallyExclusiveOptionGroup,
@@ -340,9 +718,8 @@ def add_diploid_sites(
 )
 @click.option(
     "--output_samples",
-    help="tsinfer.SampleData output file",
+    help="tsinfer.SampleData output file (required with --vcf or --input_samples)",
     type=click.Path(exists=False),
-    required=True,
 )
 @click.option(
     "--output_trees",
@@ -398,9 +775,106 @@ def add_diploid_sites(
     default=TSDATE_DEFAULT_NE,
     show_default=True,
 )
+@optgroup.group("Chunked dating options")
+@optgroup.option(
+    "--date_chunk_size",
+    help="date the tree sequence in genomic chunks of this size (bp)",
+    type=float,
+    default=None,
+)
+@optgroup.option(
+    "--date_chunk_overlap",
+    help="extend each chunk by this size (bp) on both sides",
+    type=float,
+    default=1e6,
+    show_default=True,
+)
+@optgroup.option(
+    "--date_processes",
+    help="number of chunks dated in parallel",
+    type=int,
+    default=1,
+    show_default=True,
+)
+@optgroup.group("SampleData storage options (with --vcf)")
+@optgroup.option(
+    "--chunk_size",
+    help="number of sites (and samples) in a SampleData chunk",
+    type=int,
+    default=1024,
+    show_default=True,
+)
+@optgroup.option(
+    "--compressor",
+    help="SampleData compressor",
+    type=click.Choice(list(COMPRESSORS)),
+    default="zstd",
+    show_default=True,
+)
+@optgroup.option(
+    "--max_file_size",
+    help="SampleData max file size (GB)",
+    type=float,
+    default=None,
+)
+@optgroup.option(
+    "--max_memory",
+    help="max memory (MB) for genotype buffers: reduces --chunk_size if needed",
+    type=float,
+    default=None,
+)
+@optgroup.option(
+    "--flush_threads",
+    help="threads flushing genotype chunks to disk (one buffer each)",
+    type=int,
+    default=0,
+    show_default=True,
+)
+@optgroup.group("Site QC options (with --vcf or --vcz)")
+@optgroup.option(
+    "--max_missing",
+    help="mask sites with a greater fraction of missing genotypes",
+    type=float,
+    default=1.0,
+    show_default=True,
+)
+@optgroup.option(
+    "--site_mask",
+    "site_mask_file",
+    help="site mask (.npy) written by site_qc: skip the site QC pass",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+)
+@optgroup.option(
+    "--site_qc",
+    "site_qc_pass",
+    help=(
+        "check all sites before reading genotypes (a further pass on input): "
+        "without it, sites are checked while reading the VCF"
+    ),
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--metrics",
+    "metrics_file",
+    help="append progress metrics (JSON lines) to this file",
+    type=click.Path(dir_okay=False),
+    default=None,
+)
+@click.option(
+    "--check_metadata",
+    "check_sample_metadata",
+    help="check sample nodes, individuals and populations after inference",
+    is_flag=True,
+    default=False,
+)
 def create_tstree(
     vcf_file: click.Path,
+    vcz_path: click.Path,
+    input_samples: click.Path,
     focal_csv: click.Path,
+    focal_delimiter: str,
     ancestral_estsfs: click.Path,
     ancestral_ensembl: click.Path,
     ancestral_as_reference: bool,
@@ -412,26 +886,98 @@ def create_tstree(
     mutation_rate: float,
     recombination_rate: float,
     Ne: float,
+    date_chunk_size: float,
+    date_chunk_overlap: float,
+    date_processes: int,
+    chunk_size: int,
+    compressor: str,
+    max_file_size: float,
+    max_memory: float,
+    flush_threads: int,
+    max_missing: float,
+    site_mask_file: click.Path,
+    site_qc_pass: bool,
+    metrics_file: click.Path,
+    check_sample_metadata: bool,
 ):
     """
     Read data from phased VCF an try to create a tsinfer.Sample using ancestor
-    alleles CSV file. One chromosome at a time.
+    alleles CSV file. One chromosome at a time. With a VCF Zarr store, the
+    tsinfer.VariantData is created from the store without parsing the VCF.
     """
 
-    vcf = cyvcf2.VCF(vcf_file)
-    chromosome_lengths = get_chromosome_lengths(vcf)
+    import cyvcf2
+    import tsdate
+    import tsinfer
 
-    # get first variant to get the sequence length
-    variant = next(vcf)
-    chrom = variant.CHROM
-    sequence_length = chromosome_lengths[chrom]
+    if (vcf_file or input_samples) and not output_samples:
+        raise click.UsageError(
+            "--output_samples is required with --vcf or --input_samples"
+        )
 
-    logging.info(
-        f"Getting information for chromosome {chrom} with length {sequence_length} bp"
-    )
+    if input_samples and ancestral_as_major:
+        raise click.UsageError(
+            "--ancestral_as_major is not supported with --input_samples"
+        )
+
+    if input_samples:
+        # the chromosome is read from the SampleData metadata
+        chrom = None
+
+    elif vcz_path:
+        contigs = get_contigs(vcz_path)
+
+        if len(contigs) != 1:
+            raise ValueError(f"{vcz_path} contains multiple chromosomes: {contigs}")
+
+        chrom = contigs[0]
+
+    else:
+        vcf = cyvcf2.VCF(vcf_file)
+        chromosome_lengths = get_chromosome_lengths(vcf)
+
+        # get first variant to get the sequence length
+        variant = next(vcf)
+        chrom = variant.CHROM
+        sequence_length = chromosome_lengths[chrom]
+
+        logging.info(
+            f"Getting information for chromosome {chrom} with length "
+            f"{sequence_length} bp"
+        )
+
+        # reset the vcf
+        vcf = cyvcf2.VCF(vcf_file)
+
+    # check all sites before reading ancestral alleles and genotypes, if
+    # requested: VCF sites are checked anyway by add_diploid_sites, while
+    # missing genotypes in a VCF Zarr store are checked only by site QC
+    site_mask = None
+
+    if site_mask_file and not input_samples:
+        site_mask = np.load(site_mask_file)
+
+    elif not input_samples and (site_qc_pass or (vcz_path and max_missing < 1)):
+        sample_ids = load_sample_sheet(focal_csv, focal_delimiter).sample_ids
+
+        if vcf_file:
+            qc = qc_vcf(vcf_file, sample_ids, max_missing=max_missing)
+
+        else:
+            qc = qc_vcz(vcz_path, sample_ids, max_missing=max_missing)
 
-    # reset the vcf
-    vcf = cyvcf2.VCF(vcf_file)
+        log_site_qc(qc)
+        errors = qc.errors()
+
+        for error in errors:
+            logger.error(error)
+
+        if errors:
+            raise ValueError(
+                f"Found {len(errors)} site QC errors in {vcf_file or vcz_path}"
+            )
+
+        site_mask = qc.mask
 
     # this simply debug true/false relying on method selected
     logging.debug("ancestral_as_reference: %s", ancestral_as_reference)
@@ -459,18 +1005,59 @@ def create_tstree(
     else:
         raise NotImplementedError("Ancestral method not implemented")
 
-    with tsinfer.SampleData(
-        path=output_samples, sequence_length=sequence_length
-    ) as samples:
-        pop_lookup = add_populations(focal_csv, samples)
-        indv_lookup = add_diploid_individuals(focal_csv, pop_lookup, samples)
-        add_diploid_sites(
-            vcf,
-            samples,
+    if input_samples:
+        samples = copy_samples(
+            input_samples,
+            output_samples,
             ancestors_alleles,
-            indv_lookup,
             ancestral_method=ancestral_method,
         )
+        chrom = get_samples_chrom(samples)
+
+    elif vcz_path:
+        samples = load_variant_data(
+            vcz_path,
+            load_sample_sheet(focal_csv, focal_delimiter),
+            ancestors_alleles,
+            ancestral_method=ancestral_method,
+            site_mask=site_mask,
+        )
+
+    else:
+        with create_sample_data(
+            output_samples,
+            sequence_length,
+            num_samples=2 * len(load_sample_sheet(focal_csv, focal_delimiter)),
+            chunk_size=chunk_size,
+            compressor=compressor,
+            max_file_size=(
+                int(max_file_size * 2**30) if max_file_size is not None else None
+            ),
+            max_memory=max_memory,
+            num_flush_threads=flush_threads,
+        ) as samples:
+            # track the chromosome to reuse this file with other methods
+            samples.metadata = {"chrom": chrom}
+
+            pop_lookup = add_populations(focal_csv, samples, focal_delimiter)
+            indv_lookup = add_diploid_individuals(
+                focal_csv, pop_lookup, samples, focal_delimiter
+            )
+            add_diploid_sites(
+                vcf,
+                samples,
+                ancestors_alleles,
+                indv_lookup,
+                ancestral_method=ancestral_method,
+                site_mask=site_mask,
+                max_missing=max_missing,
+                progress=ProgressReporter(
+                    "Read VCF",
+                    total=len(site_mask) if site_mask is not None else None,
+                    input_file=vcf_file,
+                    metrics_file=metrics_file,
+                ),
+            )
 
     logger.info(
         f"Sample file created for {samples.num_samples} samples "
@@ -491,19 +1078,19 @@ def create_tstree(
         f"trees over {ts.sequence_length / 1e6} Mb"
     )
 
-    # Check the metadata
-    for sample_node_id in ts.samples():
-        individual_id = ts.node(sample_node_id).individual
-        individual = json.loads(ts.individual(individual_id).metadata)["sample_id"]
+    # Check the metadata (only if requested)
+    if check_sample_metadata:
+        errors = check_metadata(ts, load_sample_sheet(focal_csv, focal_delimiter))
 
-        population_id = ts.node(sample_node_id).population
-        population = json.loads(ts.population(population_id).metadata)["breed"]
+        for error in errors:
+            logger.error(error)
 
-        logger.debug(
-            f"Node {sample_node_id} "
-            f"labels a chr {chrom} sampled from individual "
-            f"'{individual}' in population '{population}'"
-        )
+        if errors:
+            raise ValueError(
+                f"Found {len(errors)} metadata inconsistencies in chr {chrom}"
+            )
+
+        logger.info("Metadata checked: no inconsistencies found")
 
     # Removes unary nodes (currently required in tsdate), keeps historical-only sites
     inferred_ts = tsdate.preprocess_ts(ts, filter_sites=False)
@@ -517,18 +1104,21 @@ def create_tstree(
             "but it will ignored by the 'variational_gamma' method."
         )
 
-    # Prepare the base tsdate call with common parameters
-    date_partial = partial(
-        tsdate.date, inferred_ts, method=tsdate_method, mutation_rate=mutation_rate
-    )
+    if date_chunk_size:
+        dated_ts = date_in_chunks(
+            inferred_ts,
+            chunk_size=date_chunk_size,
+            overlap=date_chunk_overlap,
+            method=tsdate_method,
+            mutation_rate=mutation_rate,
+            Ne=Ne,
+            processes=date_processes,
+        )
 
-    # Add Ne parameter only for methods that support it
-    if tsdate_method in ("inside_outside", "maximization"):
-        dated_ts = date_partial(Ne=Ne)
-    elif tsdate_method == "variational_gamma":
-        dated_ts = date_partial()
     else:
-        raise NotImplementedError(f"Dating method '{tsdate_method}' not implemented")
+        dated_ts = date_tree_sequence(
+            inferred_ts, method=tsdate_method, mutation_rate=mutation_rate, Ne=Ne
+        )
 
     # save generated tree
     dated_ts.dump(output_trees)
@@ -579,6 +1169,12 @@ def create_windows(ts):
     type=click.Path(exists=True),
     required=True,
 )
+@click.option(
+    "--sample_delimiter",
+    help="sample file delimiter (guessed from first line by default)",
+    type=click.Choice(list(DELIMITERS)),
+    default=None,
+)
 @click.option(
     "--output_tsz",
     help="Output annotated tree sequence file",
@@ -601,6 +1197,7 @@ def annotate_tree(
     input_tsz: click.Path,
     input_vcf: click.Path,
     sample_file: click.Path,
+    sample_delimiter: str,
     output_tsz: click.Path,
     software_name: str,
     software_version: str,
@@ -610,41 +1207,40 @@ def annotate_tree(
     """
 
     # Read sample metadata from the provided file
-    with open(sample_file, "r") as f:
-        sniffer = csv.Sniffer()
-        dialect = sniffer.sniff(f.read(1024))
-        f.seek(0)
-
-        reader = csv.reader(f, dialect)
-        sample_info = []
-
-        for row in reader:
-            if len(row) < 2:
-                logger.error(
-                    f"Malformed line in sample file: '{row}'. "
-                    "Each line must contain at least two fields."
-                )
-                raise ValueError("Malformed line in sample file")
+    try:
+        sample_sheet = load_sample_sheet(sample_file, sample_delimiter)
 
-            breed, sample_id = row[:2]
-            sample_info.append((sample_id, breed))
+    except ValueError as exc:
+        logger.error(str(exc))
+        raise
 
-    logger.info(f"Loaded metadata for {len(sample_info)} samples.")
+    logger.info(f"Loaded metadata for {len(sample_sheet)} samples.")
 
-    # open vcf and get sample names
-    with cyvcf2.VCF(input_vcf) as vcf:
-        vcf_sample_order = vcf.samples
+    # get sample names from the VCF header
+    vcf_sample_index = {
+        sample: i for i, sample in enumerate(read_vcf_samples(input_vcf))
+    }
 
     # now order sample_info according to VCF sample order
-    try:
-        sample_info = sorted(sample_info, key=lambda x: vcf_sample_order.index(x[0]))
+    missing = [
+        sample_id
+        for sample_id in sample_sheet.sample_ids
+        if sample_id not in vcf_sample_index
+    ]
 
-    except ValueError:
+    if missing:
         logger.critical(
             "Sample information doesn't match VCF samples. "
             f"Please check that all samples in {sample_file} are present in {input_vcf}"
         )
-        raise
+        raise ValueError(f"Samples not found in {input_vcf}: {missing[:10]}")
+
+    sample_info = sorted(
+        ((sample_id, breed) for breed, sample_id in sample_sheet),
+        key=lambda x: vcf_sample_index[x[0]],
+    )
+
+    import tszip
 
     # Load the input tree sequence
     ts = tszip.load(input_tsz)
@@ -653,11 +1249,9 @@ def annotate_tree(
     tables = ts.dump_tables()
 
     # now I need to determine how many distinct populations (breeds) there are
-    breeds = set(breed for _, breed in sample_info)
-
     breed_to_id = {}
 
-    for breed in breeds:
+    for breed in sample_sheet.populations:
         metadata = {"breed": breed}
         metadata_bytes = json.dumps(metadata).encode()
         pop_id = tables.populations.add_row(metadata=metadata_bytes)
@@ -704,6 +1298,10 @@ def annotate_tree(
         timestamp=provenance_record["timestamp"], record=json.dumps(provenance_record)
     )
 
+    # store breed sample sets and individual nodes, to be loaded without
+    # decoding the metadata of each row (see breedindex.load_breed_index)
+    write_breed_index(tables)
+
     # write a tsz file as output
     annotated_ts = tables.tree_sequence()
 
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import logging
+import datetime
+import resource
+from typing import Any, Dict, Optional
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+def get_bytes_read() -> Optional[int]:
+    """
+    Return the bytes read by this process (``rchar`` of /proc/self/io), or
+    None if not available (not Linux). While reading a compressed VCF, this
+    is the compressed input read by htslib.
+    """
+
+    try:
+        with open("/proc/self/io") as handle:
+            for line in handle:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+
+    except OSError:
+        pass
+
+    return None
+
+
+def get_rss() -> int:
+    """Return the resident set size (bytes) of this process"""
+
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    except (OSError, ValueError):
+        # the peak RSS (in KB on Linux) is the best we have
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_max_rss() -> int:
+    """Return the peak resident set size (bytes) of this process"""
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "unknown"
+
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
+class ProgressReporter:
+    """
+    Track the progress of a long loop: processed items and items/s, bytes/s
+    of the input (when an input file is given), ETA and RSS. Metrics are
+    logged at most every ``interval`` seconds and appended as JSON lines to
+    ``metrics_file``, if provided. The ETA is computed from ``total`` items
+    or, when unknown, from the size of the input file.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        total: Optional[int] = None,
+        unit: str = "sites",
+        input_file: Optional[str] = None,
+        interval: float = 30.0,
+        metrics_file: Optional[str] = None,
+    ):
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.metrics_file = metrics_file
+
+        self.input_size = os.path.getsize(input_file) if input_file else None
+
+        self.count = 0
+        self.start = time.monotonic()
+        self.last_emit = self.start
+        self.start_bytes = get_bytes_read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update(self, n: int = 1):
+        self.count += n
+
+        now = time.monotonic()
+
+        if now - self.last_emit >= self.interval:
+            self.emit(now)
+
+    def metrics(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = now if now is not None else time.monotonic()
+        elapsed = max(now - self.start, 1e-9)
+
+        rate = self.count / elapsed
+
+        bytes_read, bytes_rate = None, None
+        current_bytes = get_bytes_read()
+
+        if self.input_size is not None and current_bytes is not None:
+            bytes_read = current_bytes - self.start_bytes
+            bytes_rate = bytes_read / elapsed
+
+        eta = None
+
+        if self.total is not None and rate > 0:
+            eta = max(self.total - self.count, 0) / rate
+
+        elif bytes_rate:
+            eta = max(self.input_size - bytes_read, 0) / bytes_rate
+
+        return {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "name": self.name,
+            "unit": self.unit,
+            "count": self.count,
+            "total": self.total,
+            "elapsed": round(elapsed, 3),
+            "rate": round(rate, 3),
+            "bytes_read": bytes_read,
+            "bytes_rate": round(bytes_rate, 3) if bytes_rate is not None else None,
+            "eta": round(eta, 3) if eta is not None else None,
+            "rss": get_rss(),
+            "max_rss": get_max_rss(),
+        }
+
+    def emit(self, now: Optional[float] = None, done: bool = False):
+        metrics = self.metrics(now)
+        metrics["done"] = done
+
+        self.last_emit = now if now is not None else time.monotonic()
+
+        message = (
+            f"{self.name}: {metrics['count']} {self.unit}"
+            + (f"/{self.total}" if self.total is not None else "")
+            + f" ({metrics['rate']:.1f} {self.unit}/s"
+        )
+
+        if metrics["bytes_rate"] is not None:
+            message += f", {metrics['bytes_rate'] / 2**20:.2f} MB/s"
+
+        if not done:
+            message += f", ETA {format_eta(metrics['eta'])}"
+
+        message += f", RSS {metrics['rss'] / 2**20:.0f} MB)"
+
+        logger.info(message)
+
+        if self.metrics_file:
+            with open(self.metrics_file, "a") as handle:
+                handle.write(json.dumps(metrics) + "\n")
+
+    def close(self):
+        self.emit(done=True)
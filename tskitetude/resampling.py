@@ -0,0 +1,314 @@
+import logging
+import dataclasses
+import statistics
+from typing import Dict, List, Optional, Tuple
+
+import click
+import numpy as np
+
+from .genomestats import (
+    STATS_MODES,
+    WEIGHTINGS,
+    ChromStats,
+    check_groups,
+    compute_chroms_stats,
+    hudson_fst,
+    write_tsv,
+)
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+def estimate(
+    groups: Dict[str, List[str]],
+    totals: Dict[str, np.ndarray],
+    denominator: np.ndarray,
+    pairs: Dict[str, Tuple[str, str]],
+) -> Dict[Tuple[str, str], np.ndarray]:
+    """
+    Compute the statistics (and Fst) from not normalised totals. The last
+    axis of totals are the groups, leading axes (if any) are replicates.
+    Pairs are the breeds of each divergence group.
+    """
+
+    denominator = np.asarray(denominator, dtype=float)
+    estimates = {}
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for stat, names in groups.items():
+            for j, name in enumerate(names):
+                estimates[(stat, name)] = totals[stat][..., j] / denominator
+
+    if "divergence" in totals:
+        fst = hudson_fst(
+            {
+                name: totals["diversity"][..., j]
+                for j, name in enumerate(groups["diversity"])
+            },
+            {
+                name: totals["divergence"][..., j]
+                for j, name in enumerate(groups["divergence"])
+            },
+            pairs,
+        )
+
+        for pair, value in fst.items():
+            estimates[("Fst", pair)] = value
+
+    return estimates
+
+
+@dataclasses.dataclass
+class BlockMatrix:
+    """
+    Not normalised statistics of each genomic block (rows) and group
+    (columns), with the length or number of sites of each block. Any
+    resampling of blocks is a weighted sum of rows.
+    """
+
+    groups: Dict[str, List[str]]
+    chrom: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    denominator: np.ndarray
+    values: Dict[str, np.ndarray]
+    pairs: Dict[str, Tuple[str, str]] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def from_chroms(
+        cls, chroms: List[ChromStats], weighting: str = "length"
+    ) -> "BlockMatrix":
+        """
+        Stack the windows of the chromosomes as blocks, dropping blocks
+        without length or sites
+        """
+
+        groups = check_groups(chroms)
+
+        denominator = np.concatenate([chrom.denominator(weighting) for chrom in chroms])
+        keep = denominator > 0
+
+        return cls(
+            groups=groups,
+            chrom=np.concatenate(
+                [np.full(chrom.num_windows, chrom.chrom, dtype=object) for chrom in chroms]
+            )[keep],
+            start=np.concatenate([chrom.windows[:-1] for chrom in chroms])[keep],
+            end=np.concatenate([chrom.windows[1:] for chrom in chroms])[keep],
+            denominator=denominator[keep].astype(float),
+            values={
+                stat: np.concatenate([chrom.values[stat] for chrom in chroms])[keep]
+                for stat in groups
+            },
+            pairs=chroms[0].pairs,
+        )
+
+    @property
+    def num_blocks(self) -> int:
+        return len(self.denominator)
+
+    def weighted(self, weights: np.ndarray) -> Dict[Tuple[str, str], np.ndarray]:
+        """
+        Estimates for each row of the (replicates x blocks) weights matrix:
+        bootstrap counts or leave-one-out indicators
+        """
+
+        totals = {stat: weights @ values for stat, values in self.values.items()}
+
+        return estimate(
+            self.groups, totals, weights @ self.denominator, self.pairs
+        )
+
+    def point_estimates(self) -> Dict[Tuple[str, str], float]:
+        return self.weighted(np.ones(self.num_blocks))
+
+    def jackknife(self) -> Dict[Tuple[str, str], Tuple[float, float]]:
+        """
+        Delete-one weighted block jackknife (Busing et al. 1999): blocks are
+        weighted by their length or number of sites. Returns the bias
+        corrected estimate and the standard error of each statistic.
+        """
+
+        if self.num_blocks < 2:
+            raise ValueError("At least two blocks are required for the jackknife")
+
+        num_blocks = self.num_blocks
+        leave_one_out = 1 - np.eye(num_blocks)
+
+        full = self.point_estimates()
+        partial = self.weighted(leave_one_out)
+
+        # h is the inverse of the fraction of the genome in each block
+        h = self.denominator.sum() / self.denominator
+
+        results = {}
+
+        for key, theta in full.items():
+            theta_minus = partial[key]
+            theta_j = num_blocks * theta - np.sum((1 - 1 / h) * theta_minus)
+            pseudo = h * theta - (h - 1) * theta_minus
+            variance = np.mean((pseudo - theta_j) ** 2 / (h - 1))
+
+            results[key] = (float(theta_j), float(np.sqrt(variance)))
+
+        return results
+
+    def bootstrap(
+        self, replicates: int = 1000, seed: Optional[int] = None
+    ) -> Dict[Tuple[str, str], np.ndarray]:
+        """
+        Block bootstrap: each replicate samples blocks with replacement, as a
+        row of block counts. Returns the replicate estimates of each statistic.
+        """
+
+        rng = np.random.default_rng(seed)
+        samples = rng.integers(self.num_blocks, size=(replicates, self.num_blocks))
+
+        counts = np.zeros((replicates, self.num_blocks))
+        np.add.at(counts, (np.arange(replicates)[:, None], samples), 1)
+
+        return self.weighted(counts)
+
+
+def confidence_intervals(
+    blocks: BlockMatrix,
+    replicates: int = 1000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+) -> List[dict]:
+    """
+    Point estimates with jackknife (normal) and bootstrap (percentile)
+    confidence intervals of each statistic
+    """
+
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    tail = (1 - confidence) / 2 * 100
+
+    full = blocks.point_estimates()
+    jackknife = blocks.jackknife()
+    bootstrap = blocks.bootstrap(replicates, seed)
+
+    rows = []
+
+    for (stat, group), value in full.items():
+        theta_j, se = jackknife[(stat, group)]
+        low, high = np.nanpercentile(bootstrap[(stat, group)], [tail, 100 - tail])
+
+        rows.append(
+            {
+                "stat": stat,
+                "group": group,
+                "estimate": float(value),
+                "jackknife_estimate": theta_j,
+                "jackknife_se": se,
+                "jackknife_low": theta_j - z * se,
+                "jackknife_high": theta_j + z * se,
+                "bootstrap_low": float(low),
+                "bootstrap_high": float(high),
+                "num_blocks": blocks.num_blocks,
+            }
+        )
+
+    return rows
+
+
+@click.command()
+@click.option(
+    "--input_trees",
+    help="Tree sequence of a chromosome (.trees or .tsz), could be repeated",
+    type=click.Path(exists=True, dir_okay=False),
+    multiple=True,
+    required=True,
+)
+@click.option(
+    "--block_size",
+    help="Size of the genomic blocks resampled (bp)",
+    type=float,
+    default=5e6,
+    show_default=True,
+)
+@click.option(
+    "--mode",
+    help="tskit statistics mode",
+    type=click.Choice(STATS_MODES),
+    default="site",
+    show_default=True,
+)
+@click.option(
+    "--weighting",
+    help="Normalise statistics and weight blocks by length or number of sites",
+    type=click.Choice(WEIGHTINGS),
+    default="length",
+    show_default=True,
+)
+@click.option(
+    "--replicates",
+    help="Number of bootstrap replicates",
+    type=int,
+    default=1000,
+    show_default=True,
+)
+@click.option(
+    "--confidence",
+    help="Confidence level of the intervals",
+    type=click.FloatRange(0, 1, min_open=True, max_open=True),
+    default=0.95,
+    show_default=True,
+)
+@click.option(
+    "--seed",
+    help="Random seed for bootstrap",
+    type=int,
+    default=None,
+)
+@click.option(
+    "--output",
+    help="Output TSV with estimates and confidence intervals",
+    type=click.Path(dir_okay=False),
+    required=True,
+)
+@click.option(
+    "--processes",
+    help="Number of chromosomes processed in parallel",
+    type=int,
+    default=1,
+    show_default=True,
+)
+def stats_ci(
+    input_trees: List[str],
+    block_size: float,
+    mode: str,
+    weighting: str,
+    replicates: int,
+    confidence: float,
+    seed: int,
+    output: str,
+    processes: int,
+):
+    """
+    Compute genome-wide diversity, segregating sites, divergence and Fst with
+    block jackknife and block bootstrap confidence intervals. Statistics are
+    computed once per block (as windows of each chromosome): replicates are
+    weighted sums of the block matrix, with no further tree traversal.
+    """
+
+    chroms = compute_chroms_stats(input_trees, mode, block_size, processes)
+    blocks = BlockMatrix.from_chroms(chroms, weighting)
+
+    logger.info(
+        f"Resampling {blocks.num_blocks} blocks of {block_size:.0f} bp "
+        f"({replicates} bootstrap replicates)"
+    )
+
+    try:
+        rows = confidence_intervals(blocks, replicates, confidence, seed)
+
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+
+    write_tsv(rows, output)
+    logger.info(f"Confidence intervals written to {output}")
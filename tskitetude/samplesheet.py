@@ -0,0 +1,247 @@
+import io
+import os
+import csv
+import gzip
+import struct
+import pathlib
+import logging
+import functools
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import click
+import numpy as np
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+# the fixed VCF columns before the sample ones
+VCF_FIXED_COLUMNS = 9
+
+# gzip (and BGZF) compressed files and BCF files start with these bytes
+GZIP_MAGIC = b"\x1f\x8b"
+BCF_MAGIC = b"BCF"
+
+
+def read_vcf_samples(vcf_file: str) -> List[str]:
+    """
+    Return the sample names of a VCF or BCF file, in VCF order, reading only
+    the header lines (the records are never decompressed). Compression is
+    detected by magic bytes, not by the file extension.
+    """
+
+    with open(vcf_file, "rb") as handle:
+        compressed = handle.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+    with (gzip.open if compressed else open)(vcf_file, "rb") as handle:
+        if handle.read(len(BCF_MAGIC)) == BCF_MAGIC:
+            # BCF: major and minor version, then the length of the VCF header
+            # text (NUL terminated)
+            handle.read(2)
+            (length,) = struct.unpack("<I", handle.read(4))
+            lines = handle.read(length).rstrip(b"\0").decode().splitlines()
+
+        else:
+            handle.seek(0)
+            lines = io.TextIOWrapper(handle)
+
+        for line in lines:
+            if line.startswith("#CHROM"):
+                return line.rstrip("\r\n").split("\t")[VCF_FIXED_COLUMNS:]
+
+            if not line.startswith("##"):
+                break
+
+    raise ValueError(f"No '#CHROM' header line in {vcf_file}")
+
+
+def read_indiv_list(indiv_list: str) -> Dict[str, str]:
+    """
+    Read a TSV file with individual ID and breed (FID), like the popKey file
+    of the simulations, and return a dictionary IID -> FID
+    """
+
+    with open(indiv_list, "r", newline="") as handle:
+        reader = csv.reader(handle, delimiter="\t")
+        return {row[0]: row[1] for row in reader if row}
+
+
+@click.command()
+@click.option(
+    "--indiv_list",
+    help="TSV file with individual ID and breed (FID)",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+)
+@click.option(
+    "--directory",
+    help="Input directory containing VCF files",
+    type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path),
+    required=True,
+)
+@click.option(
+    "--threads",
+    help="Number of VCF headers to read in parallel",
+    type=int,
+    default=8,
+    show_default=True,
+)
+def create_fid_iid(indiv_list: click.Path, directory: pathlib.Path, threads: int):
+    """
+    Create a FID-IID TSV file (<vcf>.sample_names.txt) for each VCF file
+    in a directory, using only individuals present in the VCF and writing
+    them in VCF order. All VCF files are validated against the individual
+    list before writing anything.
+    """
+
+    indivs = read_indiv_list(indiv_list)
+
+    vcf_files = sorted(directory.glob("*.vcf.gz"))
+
+    logger.info(
+        f"Found {len(vcf_files)} VCF files in directory '{directory}': "
+        f"{[vcf_file.name for vcf_file in vcf_files]}"
+    )
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        vcf_samples = dict(zip(vcf_files, executor.map(read_vcf_samples, vcf_files)))
+
+    # check all files before writing: report every unknown individual
+    errors = []
+
+    for vcf_file, samples in vcf_samples.items():
+        missing = [iid for iid in samples if iid not in indivs]
+
+        if missing:
+            errors.append(
+                f"{len(missing)} individuals found in '{vcf_file.name}' but not "
+                f"in '{indiv_list}': {missing[:10]}"
+            )
+
+    if errors:
+        raise click.ClickException("\n".join(errors))
+
+    for vcf_file, samples in vcf_samples.items():
+        outfile = directory / vcf_file.name.replace(".vcf.gz", ".sample_names.txt")
+
+        with open(outfile, "w") as handle:
+            writer = csv.writer(handle, delimiter="\t", lineterminator="\n")
+            writer.writerows([indivs[iid], iid] for iid in samples)
+
+        logger.info(f"Written {len(samples)} individuals to {outfile}")
+
+
+# delimiters which could be selected from the command line
+DELIMITERS = {"tab": "\t", "comma": ",", "space": " "}
+
+
+@dataclasses.dataclass(frozen=True)
+class SampleSheet:
+    """
+    A sample sheet (breed and sample ID, one sample per row) parsed once.
+    ``populations`` are the distinct breeds in order of appearance, and
+    ``population_index`` the index of each sample breed in ``populations``.
+    """
+
+    path: str
+    breeds: Tuple[str, ...]
+    sample_ids: Tuple[str, ...]
+    populations: Tuple[str, ...]
+    population_index: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.sample_ids)
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        return zip(self.breeds, self.sample_ids)
+
+    @functools.cached_property
+    def sample_index(self) -> Dict[str, int]:
+        """Map each sample ID to its row (the first one, if duplicated)"""
+
+        index = {}
+
+        for i, sample_id in enumerate(self.sample_ids):
+            index.setdefault(sample_id, i)
+
+        return index
+
+
+def guess_delimiter(line: str) -> str:
+    """
+    Choose a delimiter from the first line of a file: a tab, then a comma,
+    then a space. This replaces ``csv.Sniffer`` which is slow and could be
+    fooled by sample IDs.
+    """
+
+    for delimiter in ("\t", ",", " "):
+        if delimiter in line:
+            return delimiter
+
+    # a single column: let the caller deal with the wrong number of fields
+    return "\t"
+
+
+def load_sample_sheet(path: str, delimiter: Optional[str] = None) -> SampleSheet:
+    """
+    Read a sample sheet with breed and sample ID in the first two columns
+    (other columns are ignored). Sheets are cached by path and modification
+    time, so the same file is parsed only once. The delimiter is guessed from
+    the first line if not provided (could be a key of ``DELIMITERS``).
+    """
+
+    stat = os.stat(path)
+    delimiter = DELIMITERS.get(delimiter, delimiter)
+
+    return _load_sample_sheet(
+        os.path.realpath(path), stat.st_mtime_ns, stat.st_size, delimiter
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def _load_sample_sheet(
+    path: str, mtime_ns: int, size: int, delimiter: Optional[str]
+) -> SampleSheet:
+    with open(path, "r", newline="") as handle:
+        if delimiter is None:
+            delimiter = guess_delimiter(handle.readline())
+            handle.seek(0)
+
+        reader = csv.reader(
+            handle, delimiter=delimiter, skipinitialspace=(delimiter == " ")
+        )
+
+        breeds, sample_ids = [], []
+
+        for line_number, row in enumerate(reader, start=1):
+            if not row:
+                continue
+
+            if len(row) < 2:
+                raise ValueError(
+                    f"Malformed line {line_number} in sample file {path}: "
+                    f"'{row}'. Each line must contain at least two fields."
+                )
+
+            breeds.append(row[0])
+            sample_ids.append(row[1])
+
+    # dict keeps insertion order: distinct breeds in order of appearance
+    populations = {breed: None for breed in breeds}
+    lookup = {breed: i for i, breed in enumerate(populations)}
+
+    logger.debug(f"Loaded {len(sample_ids)} samples from {path}")
+
+    return SampleSheet(
+        path=path,
+        breeds=tuple(breeds),
+        sample_ids=tuple(sample_ids),
+        populations=tuple(populations),
+        population_index=np.fromiter(
+            (lookup[breed] for breed in breeds), dtype=np.int32, count=len(breeds)
+        ),
+    )
@@ -0,0 +1,425 @@
+import csv
+import logging
+import dataclasses
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import click
+import numpy as np
+from click_option_group import optgroup, RequiredMutuallyExclusiveOptionGroup
+
+from .samplesheet import load_sample_sheet
+from .vcfzarr import VariantsBuffer
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+# the alleles accepted by tsinfer ingest
+ALLELE_CHARS = frozenset("ATCG*")
+
+# site QC flags (a bitmask for each site)
+SITE_DUPLICATE = 1
+SITE_INVALID_ALLELE = 2
+SITE_MISSING = 4
+SITE_UNPHASED = 8
+SITE_UNSORTED = 16
+
+SITE_FLAGS = {
+    "duplicate": SITE_DUPLICATE,
+    "invalid_allele": SITE_INVALID_ALLELE,
+    "missing": SITE_MISSING,
+    "unphased": SITE_UNPHASED,
+    "unsorted": SITE_UNSORTED,
+}
+
+# sites with these flags are masked (ignored) at ingest, the others are errors
+MASKED_FLAGS = SITE_DUPLICATE | SITE_INVALID_ALLELE | SITE_MISSING
+
+
+def genotype_qc(
+    genotypes: np.ndarray, phased: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the fraction of missing genotypes and the number of unphased
+    (called) genotypes for a (variants, samples, ploidy) genotype array and
+    its (variants, samples) phase array
+    """
+
+    missing = np.any(genotypes < 0, axis=2)
+    called = ~np.all(genotypes < 0, axis=2)
+
+    num_samples = max(genotypes.shape[1], 1)
+
+    return (
+        missing.sum(axis=1) / num_samples,
+        np.count_nonzero(called & ~phased, axis=1),
+    )
+
+
+def allele_qc(
+    alleles: Sequence[Sequence[str]], allele_chars=ALLELE_CHARS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the number of alleles and if all alleles are valid for each site"""
+
+    num_alleles = np.fromiter(
+        (sum(1 for a in row if a) for row in alleles), dtype=np.int16
+    )
+    valid = np.fromiter(
+        (all(a in allele_chars for a in row if a) for row in alleles), dtype=bool
+    )
+
+    return num_alleles, valid
+
+
+@dataclasses.dataclass
+class SiteQC:
+    """
+    Per-site QC statistics, in input order. ``mask`` is True for sites to be
+    ignored at ingest (like the tsinfer site_mask), while ``errors`` lists
+    the problems which prevent ingest.
+    """
+
+    contigs: List[str]
+    contig: np.ndarray
+    position: np.ndarray
+    num_alleles: np.ndarray
+    missing: np.ndarray
+    unphased: np.ndarray
+    flags: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.position)
+
+    @property
+    def mask(self) -> np.ndarray:
+        return (self.flags & MASKED_FLAGS).astype(bool)
+
+    def summary(self) -> Dict[str, int]:
+        summary = {
+            "sites": len(self),
+            "multiallelic": int(np.count_nonzero(self.num_alleles > 2)),
+        }
+
+        for name, flag in SITE_FLAGS.items():
+            summary[name] = int(np.count_nonzero(self.flags & flag))
+
+        summary["masked"] = int(np.count_nonzero(self.mask))
+
+        return summary
+
+    def errors(self) -> List[str]:
+        errors = []
+
+        chroms = np.unique(self.contig)
+
+        if len(chroms) > 1:
+            errors.append(
+                "Input contains multiple chromosomes: "
+                f"{[self.contigs[i] for i in chroms]}"
+            )
+
+        for name, flag in SITE_FLAGS.items():
+            if flag & MASKED_FLAGS:
+                continue
+
+            sites = np.flatnonzero(self.flags & flag)
+
+            if len(sites):
+                errors.append(
+                    f"{len(sites)} {name} sites at positions "
+                    f"{self.position[sites[:10]].tolist()}"
+                )
+
+        return errors
+
+    def write_report(self, path: str):
+        """Write a TSV file with the QC statistics of each site"""
+
+        with open(path, "w", newline="") as handle:
+            writer = csv.writer(handle, delimiter="\t", lineterminator="\n")
+            writer.writerow(
+                ["chrom", "pos", "num_alleles", "missing", "unphased", "masked"]
+                + list(SITE_FLAGS)
+            )
+
+            mask = self.mask
+            flags = list(SITE_FLAGS.values())
+
+            for i in range(len(self)):
+                writer.writerow(
+                    [
+                        self.contigs[self.contig[i]],
+                        self.position[i],
+                        self.num_alleles[i],
+                        f"{self.missing[i]:.4g}",
+                        self.unphased[i],
+                        int(mask[i]),
+                    ]
+                    + [int(bool(self.flags[i] & flag)) for flag in flags]
+                )
+
+
+def make_site_qc(
+    contigs: List[str],
+    contig: np.ndarray,
+    position: np.ndarray,
+    num_alleles: np.ndarray,
+    valid: np.ndarray,
+    missing: np.ndarray,
+    unphased: np.ndarray,
+    max_missing: float = 1.0,
+) -> SiteQC:
+    """Set the QC flags of each site from the per-site statistics"""
+
+    flags = np.zeros(len(position), dtype=np.uint8)
+
+    same_contig = np.zeros(len(position), dtype=bool)
+    same_contig[1:] = contig[1:] == contig[:-1]
+
+    # only the first site in a position is used
+    duplicate = np.zeros(len(position), dtype=bool)
+    duplicate[1:] = same_contig[1:] & (position[1:] == position[:-1])
+    flags[duplicate] |= SITE_DUPLICATE
+
+    unsorted = np.zeros(len(position), dtype=bool)
+    unsorted[1:] = same_contig[1:] & (position[1:] < position[:-1])
+    flags[unsorted] |= SITE_UNSORTED
+
+    flags[~valid] |= SITE_INVALID_ALLELE
+    flags[missing > max_missing] |= SITE_MISSING
+    flags[unphased > 0] |= SITE_UNPHASED
+
+    return SiteQC(
+        contigs=contigs,
+        contig=contig,
+        position=position,
+        num_alleles=num_alleles,
+        missing=missing,
+        unphased=unphased,
+        flags=flags,
+    )
+
+
+def _select_samples(samples: List[str], sample_ids: Optional[Sequence[str]]):
+    if sample_ids is None:
+        return np.arange(len(samples))
+
+    index = {sample: i for i, sample in enumerate(samples)}
+    missing = [sample_id for sample_id in sample_ids if sample_id not in index]
+
+    if missing:
+        raise ValueError(f"Samples {missing[:10]} not found in input")
+
+    return np.sort([index[sample_id] for sample_id in sample_ids])
+
+
+def qc_vcf(
+    vcf_file: str,
+    sample_ids: Optional[Sequence[str]] = None,
+    allele_chars=ALLELE_CHARS,
+    max_missing: float = 1.0,
+    batch_size: int = 10_000,
+) -> SiteQC:
+    """
+    Compute the QC statistics of all the sites in a VCF file, considering
+    only the selected samples. Genotypes are collected in batches of
+    variants and checked as numpy arrays: no tsinfer file is written.
+    """
+
+    import cyvcf2
+
+    vcf = cyvcf2.VCF(vcf_file)
+    selected = _select_samples(vcf.samples, sample_ids)
+
+    contig_index = {}
+    stats = {
+        key: [] for key in ("contig", "position", "alleles", "missing", "unphased")
+    }
+
+    buffer = VariantsBuffer(len(vcf.samples))
+
+    def flush():
+        genotypes = np.stack(buffer.genotypes)[:, selected]
+        phased = np.stack(buffer.phased)[:, selected]
+        missing, unphased = genotype_qc(genotypes, phased)
+
+        stats["contig"].extend(buffer.contig)
+        stats["position"].extend(buffer.position)
+        stats["alleles"].extend(buffer.alleles)
+        stats["missing"].append(missing)
+        stats["unphased"].append(unphased)
+
+        buffer.clear()
+
+    for variant in vcf:
+        contig = contig_index.setdefault(variant.CHROM, len(contig_index))
+        buffer.append(variant, contig)
+
+        if len(buffer) == batch_size:
+            flush()
+
+    if len(buffer):
+        flush()
+
+    vcf.close()
+
+    num_alleles, valid = allele_qc(stats["alleles"], allele_chars)
+
+    return make_site_qc(
+        list(contig_index),
+        np.array(stats["contig"], dtype=np.int16),
+        np.array(stats["position"], dtype=np.int64),
+        num_alleles,
+        valid,
+        np.concatenate(stats["missing"]) if stats["missing"] else np.zeros(0),
+        np.concatenate(stats["unphased"]) if stats["unphased"] else np.zeros(0, int),
+        max_missing=max_missing,
+    )
+
+
+def qc_vcz(
+    vcz_path: str,
+    sample_ids: Optional[Sequence[str]] = None,
+    allele_chars=ALLELE_CHARS,
+    max_missing: float = 1.0,
+) -> SiteQC:
+    """
+    Compute the QC statistics of all the sites in a VCF Zarr store,
+    considering only the selected samples, one chunk of variants at a time
+    """
+
+    import zarr
+
+    root = zarr.open_group(vcz_path, mode="r")
+    selected = _select_samples(root["sample_id"][:].tolist(), sample_ids)
+
+    genotypes, phased = root["call_genotype"], root["call_genotype_phased"]
+    step = genotypes.chunks[0]
+
+    missing, unphased = [], []
+
+    for start in range(0, genotypes.shape[0], step):
+        chunk_missing, chunk_unphased = genotype_qc(
+            genotypes[start : start + step][:, selected],
+            phased[start : start + step][:, selected],
+        )
+        missing.append(chunk_missing)
+        unphased.append(chunk_unphased)
+
+    num_alleles, valid = allele_qc(root["variant_allele"][:].tolist(), allele_chars)
+
+    return make_site_qc(
+        root["contig_id"][:].tolist(),
+        root["variant_contig"][:],
+        root["variant_position"][:].astype(np.int64),
+        num_alleles,
+        valid,
+        np.concatenate(missing) if missing else np.zeros(0),
+        np.concatenate(unphased) if unphased else np.zeros(0, int),
+        max_missing=max_missing,
+    )
+
+
+def log_site_qc(qc: SiteQC):
+    summary = qc.summary()
+
+    logger.info(
+        "Site QC: " + ", ".join(f"{value} {key}" for key, value in summary.items())
+    )
+
+
+@click.command()
+@optgroup.group(
+    "Input genotypes",
+    cls=RequiredMutuallyExclusiveOptionGroup,
+)
+@optgroup.option(
+    "--vcf",
+    "vcf_file",
+    help="Input VCF file",
+    type=click.Path(exists=True, dir_okay=False),
+)
+@optgroup.option(
+    "--vcz",
+    "vcz_path",
+    help="Input VCF Zarr store (see vcf_to_zarr)",
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option(
+    "--samples",
+    "sample_file",
+    help="Sample sheet (breed and sample ID): check only these samples",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+)
+@click.option(
+    "--delimiter",
+    help="Sample sheet delimiter (guessed if not provided)",
+    type=click.Choice(["tab", "comma", "space"]),
+    default=None,
+)
+@click.option(
+    "--max_missing",
+    help="mask sites with a greater fraction of missing genotypes",
+    type=float,
+    default=1.0,
+    show_default=True,
+)
+@click.option(
+    "--output_mask",
+    help="Output site mask (.npy), written only if no errors are found",
+    type=click.Path(dir_okay=False),
+    default=None,
+)
+@click.option(
+    "--report",
+    help="Output TSV file with the QC statistics of each site",
+    type=click.Path(dir_okay=False),
+    default=None,
+)
+def site_qc(
+    vcf_file: click.Path,
+    vcz_path: click.Path,
+    sample_file: click.Path,
+    delimiter: str,
+    max_missing: float,
+    output_mask: click.Path,
+    report: click.Path,
+):
+    """
+    Check the sites of a VCF file (or VCF Zarr store) before creating a tree
+    sequence: missing and unphased genotypes, invalid and multiple alleles,
+    duplicated positions and chromosomes. Duplicated, invalid and missing
+    sites are masked (see create_tstree --site_mask); unphased and unsorted
+    sites and multiple chromosomes are errors.
+    """
+
+    sample_ids = None
+
+    if sample_file:
+        sample_ids = load_sample_sheet(sample_file, delimiter).sample_ids
+
+    if vcf_file:
+        qc = qc_vcf(vcf_file, sample_ids, max_missing=max_missing)
+
+    else:
+        qc = qc_vcz(vcz_path, sample_ids, max_missing=max_missing)
+
+    log_site_qc(qc)
+
+    if report:
+        qc.write_report(report)
+        logger.info(f"Site QC report written to {report}")
+
+    errors = qc.errors()
+
+    if errors:
+        raise click.ClickException("\n".join(errors))
+
+    if output_mask:
+        with open(output_mask, "wb") as handle:
+            np.save(handle, qc.mask)
+
+        logger.info(f"Site mask written to {output_mask}")
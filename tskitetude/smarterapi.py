@@ -1,34 +1,297 @@
+import copy
+import json
+import threading
+import dataclasses
+import math
+import time
+import heapq
 import logging
+import pathlib
+import datetime
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional, Tuple, Union
+
+import click
 import requests
-from requests.models import PreparedRequest
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from requests.adapters import HTTPAdapter
 
 import asyncio
 import aiohttp
 from urllib.parse import urljoin
 
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
 # global variables
-SESSION = requests.Session()
 BASE_URL = "https://webserver.ibba.cnr.it"
 SIZE = 100
 
+# when set (see use_mirror), all the endpoints read data from this mirror
+MIRROR = None
 
-class Location:
-    _data = {}
-    name = None
-    chrom = None
-    position = None
 
-    illumina_top = None
-    illumina_forward = None
+class PaginationError(Exception):
+    """Raised when a page can't be fetched after all the retries"""
+
+    def __init__(self, message, page):
+        super().__init__(message)
+        self.page = page
+
+
+@dataclasses.dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Retry policy shared by the sync and async SMARTER clients: failed
+    requests (connection errors, timeouts and ``status_forcelist`` HTTP
+    statuses) are retried up to ``retries`` attempts, waiting
+    ``backoff_factor * 2 ** attempt`` seconds between attempts.
+    """
+
+    retries: int = 5
+    backoff_factor: float = 5
+    status_forcelist: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+    def wait_time(self, attempt: int) -> float:
+        return self.backoff_factor * (2**attempt)
+
+
+class ClientStats:
+    """Request, retry and latency counters of a SMARTER client"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency: float, failed: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+            if failed:
+                self.failures += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "mean_latency": self.mean_latency,
+            "max_latency": self.max_latency,
+        }
+
+    def __str__(self):
+        return (
+            f"{self.requests} requests ({self.failures} failed, "
+            f"{self.retries} retries), latency mean {self.mean_latency:.3f}s "
+            f"max {self.max_latency:.3f}s"
+        )
+
+
+class SmarterClient:
+    """
+    A sync client for the SMARTER API: a keep-alive ``requests.Session``
+    with a sized connection pool, gzip transfer, timeouts and retries.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        timeout: Union[float, Tuple[float, float]] = (10, 60),
+        retry: RetryPolicy = RetryPolicy(),
+    ) -> None:
+        self.timeout = timeout
+        self.retry = retry
+        self.stats = ClientStats()
+
+        # retries are managed by this client, not by urllib3
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0
+        )
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+        )
+
+    def get(self, url: str, params: dict = None, headers: dict = None):
+        """GET an URL with retries. Returns the last requests.Response"""
+
+        for attempt in range(self.retry.retries):
+            start = time.monotonic()
+
+            try:
+                response = self.session.get(
+                    url, params=params, headers=headers, timeout=self.timeout
+                )
+                exc = None
+
+            except (requests.ConnectionError, requests.Timeout) as error:
+                response, exc = None, error
 
-    def __init__(self, name: str = None, data={}):
+            failed = exc is not None or (
+                response.status_code in self.retry.status_forcelist
+            )
+            self.stats.record(time.monotonic() - start, failed=failed)
+
+            if not failed:
+                return response
+
+            if attempt < self.retry.retries - 1:
+                wait_time = self.retry.wait_time(attempt)
+                error = exc or f"HTTP {response.status_code}"
+                logger.warning(f"Error {error}, retrying in {wait_time} seconds...")
+                self.stats.record_retry()
+                time.sleep(wait_time)
+
+            elif exc is not None:
+                logger.error(f"Failed to get {url} after {self.retry.retries} attempts")
+                raise exc
+
+        return response
+
+    def get_json(self, url: str, params: dict = None, headers: dict = None) -> dict:
+        response = self.get(url, params=params, headers=headers)
+
+        if response.status_code == 200:
+            return response.json()
+
+        else:
+            raise Exception(f"Failed to get data from {url}: {response.text}")
+
+
+class AsyncSmarterClient:
+    """
+    An async client for the SMARTER API, to be used as an async context
+    manager: an ``aiohttp.ClientSession`` with a sized keep-alive connection
+    pool, gzip transfer, timeouts and the same retry policy and counters of
+    :class:`SmarterClient`.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        timeout: float = 60,
+        retry: RetryPolicy = RetryPolicy(),
+    ) -> None:
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retry = retry
+        self.stats = ClientStats()
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.session.close()
+        logger.info(f"SMARTER client stats: {self.stats}")
+
+    async def get_json_once(self, url: str, params: dict = None) -> dict:
+        """A single attempt to GET an URL"""
+
+        start = time.monotonic()
+
+        try:
+            async with self.session.get(url, params=params) as response:
+                response.raise_for_status()
+                result = await response.json()
+
+        except (aiohttp.ClientError, asyncio.exceptions.TimeoutError):
+            self.stats.record(time.monotonic() - start, failed=True)
+            raise
+
+        self.stats.record(time.monotonic() - start)
+
+        return result
+
+
+# the default client used by the endpoints
+CLIENT = SmarterClient()
+SESSION = CLIENT.session
+
+
+async def _async_get_once(session, url, params) -> dict:
+    """GET an URL with an AsyncSmarterClient or an aiohttp.ClientSession"""
+
+    if isinstance(session, AsyncSmarterClient):
+        return await session.get_json_once(url, params=params)
+
+    async with session.get(url, params=params) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+def _async_retry_policy(session, retries=None, backoff_factor=None) -> RetryPolicy:
+    """Get the retry policy of a session, overridden by explicit values"""
+
+    policy = session.retry if isinstance(session, AsyncSmarterClient) else RetryPolicy()
+
+    if retries is not None:
+        policy = dataclasses.replace(policy, retries=retries)
+
+    if backoff_factor is not None:
+        policy = dataclasses.replace(policy, backoff_factor=backoff_factor)
+
+    return policy
+
+
+def _is_retryable(exc: Exception, policy: RetryPolicy) -> bool:
+    """
+    Connection errors and timeouts are retried, HTTP errors only when their
+    status is in ``status_forcelist`` (like :meth:`SmarterClient.get`)
+    """
+
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status in policy.status_forcelist
+
+    return True
+
+
+def _record_retry(session):
+    if isinstance(session, AsyncSmarterClient):
+        session.stats.record_retry()
+
+
+class Location:
+    __slots__ = ("name", "chrom", "position", "illumina_top", "illumina_forward")
+
+    def __init__(self, name: str = None, data: dict = None):
         self.name = name
+        self.chrom = None
+        self.position = None
+        self.illumina_top = None
+        self.illumina_forward = None
 
         if data:
-            self._data = data
             self.read_data(data)
 
     def __str__(self):
@@ -52,10 +315,183 @@ class Location:
         return [self.name, old_code[0], old_code[1], new_code[0], new_code[1]]
 
 
+class LocationTable:
+    """
+    A columnar table of locations, backed by NumPy arrays of fixed-width
+    bytes. Alleles are split in two columns (``A/G`` -> ``A``, ``G``) and
+    missing values are stored as empty strings (or -1 for positions).
+    """
+
+    columns = (
+        "name",
+        "chrom",
+        "position",
+        "top_a1",
+        "top_a2",
+        "forward_a1",
+        "forward_a2",
+    )
+
+    def __init__(self, **arrays):
+        for column in self.columns:
+            setattr(self, column, arrays[column])
+
+    def __len__(self):
+        return len(self.name)
+
+    def __getitem__(self, idx: int) -> Location:
+        def decode(*values):
+            if not values[0]:
+                return None
+
+            return "/".join(value.decode() for value in values)
+
+        location = Location(name=self.name[idx].decode())
+        location.chrom = self.chrom[idx].decode() or None
+        location.position = int(self.position[idx]) if self.position[idx] >= 0 else None
+        location.illumina_top = decode(self.top_a1[idx], self.top_a2[idx])
+        location.illumina_forward = decode(self.forward_a1[idx], self.forward_a2[idx])
+
+        return location
+
+    @staticmethod
+    def _split_alleles(alleles, name=None):
+        if not alleles:
+            return b"", b""
+
+        split = alleles.split("/")
+
+        if len(split) != 2 or not all(split):
+            # stored as missing: the location is skipped by to_update_alleles
+            logger.warning(f"Unexpected alleles '{alleles}' for variant {name}")
+            return b"", b""
+
+        return split[0].encode(), split[1].encode()
+
+    @classmethod
+    def from_items(cls, items) -> "LocationTable":
+        """
+        Create a table from the variants returned by the Variant SMARTER
+        API (with un-nested locations)
+        """
+
+        name, chrom, position, top, forward = [], [], [], [], []
+
+        for item in items:
+            location = item["locations"]
+            name.append(item["name"].encode())
+            chrom.append((location.get("chrom") or "").encode())
+            position.append(location.get("position") or -1)
+            top.append(cls._split_alleles(location.get("illumina_top"), item["name"]))
+            forward.append(
+                cls._split_alleles(location.get("illumina_forward"), item["name"])
+            )
+
+        top = np.array(top, dtype=bytes).reshape(-1, 2)
+        forward = np.array(forward, dtype=bytes).reshape(-1, 2)
+
+        return cls(
+            name=np.array(name, dtype=bytes),
+            chrom=np.array(chrom, dtype=bytes),
+            position=np.array(position, dtype=np.int64),
+            top_a1=top[:, 0],
+            top_a2=top[:, 1],
+            forward_a1=forward[:, 0],
+            forward_a2=forward[:, 1],
+        )
+
+    @classmethod
+    def concatenate(cls, tables) -> "LocationTable":
+        return cls(
+            **{
+                column: np.concatenate([getattr(table, column) for table in tables])
+                for column in cls.columns
+            }
+        )
+
+    def to_update_alleles(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the plink ``--update-alleles`` records of the locations with
+        both a TOP and a FORWARD coding (as a ``(n, 5)`` bytes array) and a
+        mask of the locations which have them.
+        """
+
+        mask = (self.forward_a1 != b"") & (self.top_a1 != b"")
+
+        records = np.stack(
+            [
+                self.name[mask],
+                self.top_a1[mask],
+                self.top_a2[mask],
+                self.forward_a1[mask],
+                self.forward_a2[mask],
+            ],
+            axis=1,
+        )
+
+        return records, mask
+
+    def write_update_alleles(self, handle) -> int:
+        """
+        Write plink ``--update-alleles`` records to a text handle. Locations
+        without a TOP or a FORWARD coding are skipped. Returns the written
+        records.
+        """
+
+        records, mask = self.to_update_alleles()
+
+        for name in self.name[~mask]:
+            logger.warning(
+                f"No illumina_top or illumina_forward allele for variant "
+                f"{name.decode()}: "
+                "Skipping variant."
+            )
+
+        if len(records):
+            lines = records[:, 0]
+
+            for idx in range(1, records.shape[1]):
+                lines = np.char.add(np.char.add(lines, b"\t"), records[:, idx])
+
+            handle.write((b"\n".join(lines) + b"\n").decode())
+
+        return len(records)
+
+
 class EndPointMixin:
     url = None
     headers = {}
 
+    # query params which can be answered by a local mirror: param -> field path
+    mirror_filters: Dict[str, Tuple[str, ...]] = {}
+
+    _mirror = None
+    _client = None
+
+    def __init__(
+        self, mirror: "Mirror" = None, client: SmarterClient = None
+    ) -> None:
+        self._mirror = mirror
+        self._client = client
+
+    @property
+    def client(self) -> SmarterClient:
+        """The sync client used by this endpoint"""
+
+        return self._client if self._client is not None else CLIENT
+
+    @property
+    def mirror(self) -> "Mirror":
+        """The local mirror used by this endpoint, if any"""
+
+        return self._mirror if self._mirror is not None else MIRROR
+
+    @property
+    def mirror_name(self) -> str:
+        """The endpoint name in a local mirror, for example 'samples-sheep'"""
+
+        return self.url[len(urljoin(BASE_URL, "smarter-api/")) :].replace("/", "-")
+
     def _update_kwargs(self, kwargs):
         # add page and size if not in kwargs
         if "page" not in kwargs:
@@ -73,18 +509,170 @@ class EndPointMixin:
         # check for page and size
         kwargs = self._update_kwargs(kwargs)
 
-        response = SESSION.get(self.url, headers=self.headers, params=kwargs)
+        if self.mirror is not None:
+            return self.mirror.query(self, **kwargs)
 
-        if response.status_code == 200:
-            return response.json()
+        return self.client.get_json(self.url, params=kwargs, headers=self.headers)
 
-        else:
-            raise Exception(f"Failed to get data from {self.url}: {response.text}")
+    async def get_async(
+        self,
+        session: Union[AsyncSmarterClient, aiohttp.ClientSession],
+        retries: Optional[int] = None,
+        backoff_factor: Optional[float] = None,
+        **kwargs,
+    ) -> dict:
+        """
+        Fetches async a page of data from the endpoint URL.
+
+        Args:
+            session (AsyncSmarterClient): The async SMARTER client (or an
+                aiohttp.ClientSession).
+            retries (int, optional): The number of retries in case of errors.
+                Defaults to the client retry policy (5).
+            backoff_factor (int, optional): The backoff factor for retrying.
+                Defaults to the client retry policy (5).
+            kwargs (dict): The query parameters to pass to the endpoint
+
+        Returns:
+            dict: The fetched data as a dictionary.
+
+        Raises:
+            aiohttp.ClientError: If there is an error with the aiohttp client
+                (HTTP errors not in the retry policy status_forcelist are
+                not retried).
+            asyncio.exceptions.TimeoutError: If the request times out.
+            Exception: If the data cannot be fetched after the specified number of retries.
+        """
+
+        # test for page and size in kwargs
+        kwargs = self._update_kwargs(kwargs)
+
+        policy = _async_retry_policy(session, retries, backoff_factor)
+
+        for attempt in range(policy.retries):
+            try:
+                return await self._get_async_once(session, **kwargs)
+
+            except (aiohttp.ClientError, asyncio.exceptions.TimeoutError) as exc:
+                if not _is_retryable(exc, policy):
+                    logger.error(f"Failed to fetch data for page {kwargs['page']}: {exc}")
+                    raise exc
+
+                if attempt < policy.retries - 1:
+                    wait_time = policy.wait_time(attempt)
+                    logger.warning(f"Error {exc}, retrying in {wait_time} seconds...")
+                    _record_retry(session)
+                    await asyncio.sleep(wait_time)
+                else:
+                    logger.error(
+                        f"Failed to fetch data for page {kwargs['page']} "
+                        f"after {policy.retries} attempts"
+                    )
+                    raise exc
+
+    async def _get_async_once(self, session, **kwargs) -> dict:
+        """A single attempt to fetch async a page of data"""
+
+        kwargs = self._update_kwargs(kwargs)
+
+        if self.mirror is not None:
+            return self._parse_response(self.mirror.query(self, **kwargs))
+
+        # aiohttp doesn't skip None params like requests does
+        params = {key: value for key, value in kwargs.items() if value is not None}
+
+        logger.debug(f"Getting data from {self.url} with params {params}")
+
+        result = await _async_get_once(session, self.url, params)
+        logger.debug(f"Successfully fetched data for page {kwargs['page']}")
+
+        return self._parse_response(result)
+
+    def _parse_response(self, response: dict) -> dict:
+        """Post-process a page of results. Returns the page as it is."""
+
+        return response
+
+    def iter_pages(
+        self, prefetch: int = 2, raw: bool = False, **kwargs
+    ) -> Iterator[dict]:
+        """
+        Iterate over all the pages of a query, starting from ``page``. Up to
+        ``prefetch`` pages are downloaded in background while the current
+        page is consumed, so memory is bounded by the page size and not by
+        the total number of results.
+
+        Args:
+            prefetch (int, optional): The number of pages to download in
+                advance (0 to download each page when requested). Defaults
+                to 2.
+            raw (bool, optional): Return pages as they are returned by the
+                API, without post-processing them. Defaults to False.
+            kwargs (dict): The query parameters to pass to the endpoint
+
+        Yields:
+            dict: The fetched pages, in page order.
+        """
+
+        if prefetch < 0:
+            raise ValueError(f"prefetch must be 0 or more, got {prefetch}")
+
+        kwargs = self._update_kwargs(kwargs)
+
+        def fetch(page):
+            response = self.get(**{**kwargs, "page": page})
+            return response if raw else self._parse_response(response)
+
+        response = fetch(kwargs["page"])
+        total_pages = response["pages"]
+        next_page = response["page"] + 1
+
+        if prefetch == 0:
+            # no background downloads: fetch each page when requested
+            yield response
+
+            while next_page <= total_pages:
+                yield fetch(next_page)
+                next_page += 1
+
+            return
+
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            futures = collections.deque()
+
+            try:
+                while len(futures) < prefetch and next_page <= total_pages:
+                    futures.append(executor.submit(fetch, next_page))
+                    next_page += 1
+
+                yield response
+
+                while futures:
+                    response = futures.popleft().result()
+
+                    if next_page <= total_pages:
+                        futures.append(executor.submit(fetch, next_page))
+                        next_page += 1
+
+                    yield response
+
+            finally:
+                # don't wait for pages which won't be consumed
+                for future in futures:
+                    future.cancel()
 
 
 class SheepEndpoint(EndPointMixin):
     url = urljoin(BASE_URL, "smarter-api/samples/sheep")
 
+    mirror_filters = {
+        "type": ("type",),
+        "breed": ("breed",),
+        "breed_code": ("breed_code",),
+        "chip_name": ("chip_name",),
+        "smarter_id": ("smarter_id",),
+    }
+
     def get_samples(
         self,
         _type: str = None,
@@ -103,6 +691,12 @@ class SheepEndpoint(EndPointMixin):
 class BreedEndpoint(EndPointMixin):
     url = urljoin(BASE_URL, "smarter-api/breeds")
 
+    mirror_filters = {
+        "species": ("species",),
+        "name": ("name",),
+        "code": ("code",),
+    }
+
     def get_breeds(self, species: str = None, **kwargs) -> dict:
         """Get the breeds from the Sheep SMARTER API."""
 
@@ -112,6 +706,12 @@ class BreedEndpoint(EndPointMixin):
 class ChipEndpoint(EndPointMixin):
     url = urljoin(BASE_URL, "smarter-api/supported-chips")
 
+    mirror_filters = {
+        "species": ("species",),
+        "manufacturer": ("manufacturer",),
+        "name": ("name",),
+    }
+
     def get_chips(
         self, species: str = None, manufacturer: str = None, **kwargs
     ) -> dict:
@@ -121,8 +721,21 @@ class ChipEndpoint(EndPointMixin):
 
 
 class VariantsEndpoint(EndPointMixin):
-    def __init__(self, species, assembly) -> None:
-        super().__init__()
+    # region (chrom or chrom:start-end) is managed by Mirror
+    mirror_filters = {
+        "chip_name": ("chip_name",),
+        "name": ("name",),
+        "rs_id": ("rs_id",),
+    }
+
+    def __init__(
+        self,
+        species,
+        assembly,
+        mirror: "Mirror" = None,
+        client: SmarterClient = None,
+    ) -> None:
+        super().__init__(mirror=mirror, client=client)
 
         self.url = urljoin(
             BASE_URL, f"smarter-api/variants/{species.lower()}/{assembly.upper()}"
@@ -135,82 +748,833 @@ class VariantsEndpoint(EndPointMixin):
 
         response = self.get(chip_name=chip_name, region=region, **kwargs)
 
+        return self._parse_response(response)
+
+    def _parse_response(self, response: dict) -> dict:
         # un-nesting locations items: get first item
         for item in response["items"]:
             item["locations"] = item["locations"][0]
 
         return response
 
+    def iter_variants(
+        self, chip_name: str = None, region: str = None, prefetch: int = 2, **kwargs
+    ) -> Iterator[dict]:
+        """
+        Iterate over the variants from the Variant SMARTER API, while the
+        next pages are downloaded in background.
+        """
+
+        for response in self.iter_pages(
+            prefetch=prefetch, chip_name=chip_name, region=region, **kwargs
+        ):
+            yield from response["items"]
+
     async def get_async_variants(
-        self, session, retries=5, backoff_factor=5, **kwargs
+        self, session, retries=None, backoff_factor=None, **kwargs
     ) -> dict:
         """
-        Fetches async variants from the specified URL.
+        Fetches async variants from the specified URL. See
+        :meth:`EndPointMixin.get_async`
+        """
 
-        Args:
-            session (aiohttp.ClientSession): The aiohttp client session.
-            retries (int, optional): The number of retries in case of errors. Defaults to 5.
-            backoff_factor (int, optional): The backoff factor for retrying. Defaults to 5.
-            kwargs (dict): The query parameters to pass to
+        return await self.get_async(
+            session, retries=retries, backoff_factor=backoff_factor, **kwargs
+        )
 
-        Returns:
-            dict: The fetched data as a dictionary.
 
-        Raises:
-            aiohttp.ClientError: If there is an error with the aiohttp client.
-            asyncio.exceptions.TimeoutError: If the request times out.
-            Exception: If the data cannot be fetched after the specified number of retries.
+def _drop_nulls(value):
+    """
+    Remove None values from nested records: fields missing in a JSON record
+    are null in a Parquet table with the fields of all the records
+    """
+
+    if isinstance(value, dict):
+        return {
+            key: _drop_nulls(item) for key, item in value.items() if item is not None
+        }
+
+    if isinstance(value, list):
+        return [_drop_nulls(item) for item in value]
+
+    return value
+
+
+class Mirror:
+    """
+    A local mirror of the SMARTER endpoints. Each endpoint is stored as a
+    Parquet file (``<name>.parquet``, like ``variants-sheep-OAR3.parquet``)
+    with a ``<name>.json`` state file used for incremental sync. Endpoints
+    using a mirror answer queries from the local data, emulating the API
+    pagination and filters.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = pathlib.Path(path)
+        self._tables = {}
+
+    def _parquet_file(self, endpoint: EndPointMixin) -> pathlib.Path:
+        return self.path / f"{endpoint.mirror_name}.parquet"
+
+    def _state_file(self, endpoint: EndPointMixin) -> pathlib.Path:
+        return self.path / f"{endpoint.mirror_name}.json"
+
+    def read_state(self, endpoint: EndPointMixin) -> dict:
+        state_file = self._state_file(endpoint)
+
+        if not state_file.exists() or not self._parquet_file(endpoint).exists():
+            return {}
+
+        with open(state_file) as handle:
+            return json.load(handle)
+
+    def read_table(self, endpoint: EndPointMixin) -> pa.Table:
+        """Read (and cache) the mirrored data of an endpoint"""
+
+        parquet_file = self._parquet_file(endpoint)
+
+        if not parquet_file.exists():
+            raise FileNotFoundError(
+                f"No mirror for {endpoint.url} in {self.path}: "
+                "run smarter_mirror first"
+            )
+
+        mtime = parquet_file.stat().st_mtime
+
+        if endpoint.mirror_name not in self._tables or (
+            self._tables[endpoint.mirror_name][0] != mtime
+        ):
+            self._tables[endpoint.mirror_name] = (mtime, pq.read_table(parquet_file))
+
+        return self._tables[endpoint.mirror_name][1]
+
+    def _write(self, endpoint: EndPointMixin, table: pa.Table, state: dict):
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        # write to temporary files first, to never leave a broken mirror
+        if table is not None:
+            parquet_file = self._parquet_file(endpoint)
+            tmp_file = parquet_file.with_suffix(".parquet.tmp")
+            pq.write_table(table, tmp_file)
+            tmp_file.replace(parquet_file)
+
+        state_file = self._state_file(endpoint)
+        tmp_file = state_file.with_suffix(".json.tmp")
+
+        with open(tmp_file, "w") as handle:
+            json.dump(state, handle, indent=2)
+
+        tmp_file.replace(state_file)
+
+    def sync(
+        self,
+        endpoint: EndPointMixin,
+        size: int = 1000,
+        prefetch: int = 2,
+        force: bool = False,
+    ) -> bool:
+        """
+        Download the whole content of an endpoint, or only the new records
+        if a mirror exists. Nothing is downloaded if the API returns
+        *304 Not Modified* to a conditional request (ETag/Last-Modified),
+        or if the API has no validators and the number of records didn't
+        change. A *200* to a conditional request means that records changed:
+        only new records are downloaded if the API appended them, which is
+        checked comparing the last stored record with the remote one,
+        otherwise the whole endpoint is downloaded again. Returns True if
+        the mirror was updated.
         """
 
-        # test for page and size in kwargs
-        kwargs = self._update_kwargs(kwargs)
+        # always query the remote endpoint
+        remote = copy.copy(endpoint)
+        remote._mirror = None
 
-        for attempt in range(retries):
-            try:
-                req = PreparedRequest()
-                req.prepare_url(self.url, kwargs)
+        state = {} if force else self.read_state(endpoint)
 
-                logger.debug(f"Getting data from {req.url}")
+        headers = dict(endpoint.headers)
 
-                async with session.get(self.url, params=kwargs) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    logger.info(f"Successfully fetched data for page {kwargs['page']}")
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
 
-                    # un-nesting locations items: get first item
-                    for item in result["items"]:
-                        item["locations"] = item["locations"][0]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
 
-                    return result
+        response = remote.client.get(
+            endpoint.url, headers=headers, params={"page": 1, "size": 1}
+        )
 
-            except (aiohttp.ClientError, asyncio.exceptions.TimeoutError) as exc:
-                if attempt < retries - 1:
-                    wait_time = backoff_factor * (2**attempt)
-                    logger.warning(f"Error {exc}, retrying in {wait_time} seconds...")
-                    await asyncio.sleep(wait_time)
-                else:
-                    logger.error(
-                        f"Failed to fetch data for page {kwargs['page']} "
-                        f"after {retries} attempts"
+        if response.status_code == 304:
+            logger.info(f"{endpoint.mirror_name} is up to date (not modified)")
+            return False
+
+        if response.status_code != 200:
+            raise Exception(
+                f"Failed to get data from {endpoint.url}: {response.text}"
+            )
+
+        total = response.json()["total"]
+
+        new_state = {
+            "url": endpoint.url,
+            "total": total,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "synced": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+
+        # a 200 to a conditional request means the endpoint was modified
+        conditional = bool(state.get("etag") or state.get("last_modified"))
+
+        if state and total == state["total"] and not conditional:
+            logger.info(f"{endpoint.mirror_name} is up to date ({total} records)")
+            self._write(endpoint, None, new_state)
+            return False
+
+        if (
+            state
+            and total > state["total"] > 0
+            and self._is_appended(remote, endpoint, state["total"])
+        ):
+            # records are appended by the API: download only the new ones
+            old_total = state["total"]
+            start_page = old_total // size + 1
+            skip = old_total % size
+            tables = [self.read_table(endpoint)]
+
+            logger.info(
+                f"Adding {total - old_total} records to {endpoint.mirror_name}"
+            )
+
+        else:
+            start_page, skip, tables = 1, 0, []
+
+            logger.info(f"Downloading {total} records for {endpoint.mirror_name}")
+
+        for page in remote.iter_pages(
+            prefetch=prefetch, raw=True, page=start_page, size=size
+        ):
+            items = page["items"][skip:]
+            skip = 0
+
+            if items:
+                tables.append(pa.Table.from_struct_array(pa.array(items)))
+
+        if tables:
+            table = pa.concat_tables(tables, promote_options="permissive")
+
+        else:
+            table = pa.table({})
+
+        new_state["total"] = table.num_rows
+
+        self._write(endpoint, table, new_state)
+        logger.info(f"{endpoint.mirror_name} has {table.num_rows} records")
+
+        return True
+
+    def _is_appended(
+        self, remote: EndPointMixin, endpoint: EndPointMixin, old_total: int
+    ) -> bool:
+        """
+        Check that the last stored record is still the same in the API, to
+        assume that the stored records are unchanged and new ones appended
+        """
+
+        response = remote.client.get(
+            endpoint.url,
+            headers=dict(endpoint.headers),
+            params={"page": old_total, "size": 1},
+        )
+
+        if response.status_code != 200:
+            return False
+
+        items = response.json()["items"]
+        stored = self.read_table(endpoint).slice(old_total - 1, 1).to_pylist()
+
+        if len(items) != 1 or _drop_nulls(items) != _drop_nulls(stored):
+            logger.info(
+                f"Stored records of {endpoint.mirror_name} were modified: "
+                "downloading all the records"
+            )
+            return False
+
+        return True
+
+    @staticmethod
+    def _resolve(table: pa.Table, path: Tuple[str, ...]):
+        """
+        Return the values of a (nested) field and the index of the row
+        they come from. List fields are flattened
+        """
+
+        if path[0] not in table.column_names:
+            return pa.array([], pa.null()), np.array([], dtype=np.int64)
+
+        values = table.column(path[0]).combine_chunks()
+        rows = np.arange(len(values))
+
+        for field in path[1:] + (None,):
+            while pa.types.is_list(values.type) or pa.types.is_large_list(
+                values.type
+            ):
+                rows = rows[pc.list_parent_indices(values).to_numpy()]
+                values = pc.list_flatten(values)
+
+            if field is not None:
+                values = pc.struct_field(values, field)
+
+        return values, rows
+
+    @classmethod
+    def _match(cls, table, path, predicate) -> np.ndarray:
+        values, rows = cls._resolve(table, path)
+        mask = np.zeros(table.num_rows, dtype=bool)
+
+        if len(values) and not pa.types.is_null(values.type):
+            matched = predicate(values).to_numpy(zero_copy_only=False)
+            mask[rows[np.asarray(matched, dtype=bool)]] = True
+
+        return mask
+
+    @staticmethod
+    def _equal(value):
+        return lambda values: pc.fill_null(
+            pc.equal(values, pc.cast(pa.scalar(str(value)), values.type)), False
+        )
+
+    def _match_region(self, table, region) -> np.ndarray:
+        # region could be 'chrom' or 'chrom:start-end'
+        chrom, _, interval = str(region).partition(":")
+
+        values, rows = self._resolve(table, ("locations",))
+        mask = np.zeros(table.num_rows, dtype=bool)
+
+        if not len(values):
+            return mask
+
+        matched = self._equal(chrom)(pc.struct_field(values, "chrom"))
+
+        if interval:
+            start, end = (int(value) for value in interval.split("-"))
+            position = pc.struct_field(values, "position")
+            matched = pc.and_(
+                matched,
+                pc.fill_null(
+                    pc.and_(
+                        pc.greater_equal(position, start),
+                        pc.less_equal(position, end),
+                    ),
+                    False,
+                ),
+            )
+
+        mask[rows[matched.to_numpy(zero_copy_only=False)]] = True
+
+        return mask
+
+    def query(self, endpoint: EndPointMixin, **kwargs) -> dict:
+        """Answer an API query from the local data, page by page"""
+
+        table = self.read_table(endpoint)
+        page, size = kwargs.pop("page", 1), kwargs.pop("size", SIZE)
+
+        mask = np.ones(table.num_rows, dtype=bool)
+
+        for param, value in kwargs.items():
+            if value is None:
+                continue
+
+            if param == "region" and isinstance(endpoint, VariantsEndpoint):
+                mask &= self._match_region(table, value)
+
+            elif param in endpoint.mirror_filters:
+                mask &= self._match(
+                    table, endpoint.mirror_filters[param], self._equal(value)
+                )
+
+            else:
+                raise NotImplementedError(
+                    f"Param '{param}' is not supported by the local mirror"
+                )
+
+        indices = np.flatnonzero(mask)
+        total = len(indices)
+        pages = math.ceil(total / size)
+
+        items = table.take(indices[(page - 1) * size : page * size]).to_pylist()
+
+        def page_url(page):
+            return f"{endpoint.url}?page={page}&size={size}"
+
+        return {
+            "items": items,
+            "total": total,
+            "pages": pages,
+            "page": page,
+            "size": size,
+            "next": page_url(page + 1) if page < pages else None,
+            "prev": page_url(page - 1) if page > 1 else None,
+        }
+
+
+def use_mirror(path) -> Mirror:
+    """
+    Make all the SMARTER endpoints read data from a local mirror. Call
+    with None to query the SMARTER API again.
+    """
+
+    global MIRROR
+
+    MIRROR = Mirror(path) if path is not None else None
+
+    return MIRROR
+
+
+async def paginate(
+    endpoint: EndPointMixin,
+    session: Union[AsyncSmarterClient, aiohttp.ClientSession],
+    size: int = SIZE,
+    min_concurrency: int = 1,
+    max_concurrency: int = 10,
+    retries: Optional[int] = None,
+    backoff_factor: Optional[float] = None,
+    progress: Callable[[int, int], None] = None,
+    log_interval: float = 10,
+    start_page: int = 1,
+    **kwargs,
+) -> AsyncIterator[dict]:
+    """
+    Fetch all the pages of a query from any SMARTER endpoint. The first page
+    is fetched to learn the number of pages, then the remaining pages are
+    fetched concurrently and yielded in page order. Concurrency is adaptive:
+    it grows by one after every fetched page and it's halved after every
+    failed request, between ``min_concurrency`` and ``max_concurrency``.
+
+    Args:
+        endpoint (EndPointMixin): The SMARTER endpoint instance.
+        session (AsyncSmarterClient): The async SMARTER client (or an
+            aiohttp.ClientSession).
+        size (int, optional): The page size. Defaults to SIZE.
+        min_concurrency (int, optional): The minimum number of concurrent
+            requests. Defaults to 1.
+        max_concurrency (int, optional): The maximum number of concurrent
+            requests. Defaults to 10.
+        retries (int, optional): The number of attempts for each page.
+            Defaults to the client retry policy (5).
+        backoff_factor (float, optional): The backoff factor for retrying.
+            Defaults to the client retry policy (5).
+        progress (callable, optional): called with the number of yielded
+            pages and the total number of pages after each page.
+        log_interval (float, optional): log progress every ``log_interval``
+            seconds. Defaults to 10.
+        start_page (int, optional): The first page to fetch, for example to
+            resume an interrupted download. Defaults to 1.
+        kwargs (dict): The query parameters to pass to the endpoint
+
+    Yields:
+        dict: The fetched pages, in page order.
+
+    Raises:
+        PaginationError: If a page cannot be fetched after the specified
+            number of retries.
+    """
+
+    kwargs["size"] = size
+    kwargs.pop("page", None)
+
+    policy = _async_retry_policy(session, retries, backoff_factor)
+
+    response = await endpoint.get_async(
+        session,
+        retries=policy.retries,
+        backoff_factor=policy.backoff_factor,
+        page=start_page,
+        **kwargs,
+    )
+    total_pages = response["pages"]
+
+    if start_page > total_pages:
+        logger.info(f"No pages to fetch from {endpoint.url} after page {total_pages}")
+        return
+
+    logger.info(
+        f"Fetching {response['total']} items in {total_pages} pages "
+        f"from {endpoint.url}"
+    )
+
+    async def fetch(page, delay):
+        if delay:
+            await asyncio.sleep(delay)
+
+        # a single attempt: retries are managed by the paginator
+        return await endpoint._get_async_once(session, page=page, **kwargs)
+
+    # pages to schedule (as a heap, since failed pages are scheduled again)
+    pending = list(range(start_page + 1, total_pages + 1))
+    delays = {}
+    attempts = collections.Counter()
+
+    # running tasks and fetched pages waiting to be yielded
+    running = {}
+    fetched = {}
+
+    # don't fetch too far from the page to be yielded to bound memory
+    window = 2 * max_concurrency
+    concurrency = min_concurrency
+    next_page = start_page + 1
+
+    start_time = last_log = time.monotonic()
+
+    def report(page):
+        nonlocal last_log
+
+        if progress:
+            progress(page, total_pages)
+
+        now = time.monotonic()
+
+        if now - last_log >= log_interval or page == total_pages:
+            last_log = now
+            fetched_pages = page - start_page + 1
+            rate = fetched_pages / (now - start_time) if now > start_time else 0
+            logger.info(
+                f"Fetched {page}/{total_pages} pages from {endpoint.url} "
+                f"({rate:.1f} pages/s, concurrency {concurrency})"
+            )
+
+    report(start_page)
+    yield response
+
+    try:
+        while next_page <= total_pages:
+            while (
+                pending
+                and len(running) < concurrency
+                and pending[0] < next_page + window
+            ):
+                page = heapq.heappop(pending)
+                task = asyncio.create_task(fetch(page, delays.pop(page, 0)))
+                running[task] = page
+
+            finished, _ = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            for task in finished:
+                page = running.pop(task)
+
+                try:
+                    fetched[page] = task.result()
+                    concurrency = min(max_concurrency, concurrency + 1)
+
+                except (aiohttp.ClientError, asyncio.exceptions.TimeoutError) as exc:
+                    attempts[page] += 1
+                    concurrency = max(min_concurrency, concurrency // 2)
+
+                    if not _is_retryable(exc, policy):
+                        logger.error(f"Failed to fetch data for page {page}: {exc}")
+                        raise PaginationError(
+                            f"Failed to fetch page {page} from {endpoint.url}: {exc}",
+                            page,
+                        ) from exc
+
+                    if attempts[page] >= policy.retries:
+                        logger.error(
+                            f"Failed to fetch data for page {page} "
+                            f"after {policy.retries} attempts"
+                        )
+                        raise PaginationError(
+                            f"Failed to fetch page {page} from {endpoint.url}: {exc}",
+                            page,
+                        ) from exc
+
+                    delays[page] = policy.wait_time(attempts[page] - 1)
+                    _record_retry(session)
+
+                    logger.warning(
+                        f"Error {exc} for page {page}, retrying in "
+                        f"{delays[page]} seconds (concurrency {concurrency})..."
                     )
-                    raise exc
 
+                    heapq.heappush(pending, page)
+
+            while next_page in fetched:
+                report(next_page)
+                yield fetched.pop(next_page)
+                next_page += 1
 
-async def variant_worker(
-    queue, session, variant_api, async_processing_func, size, **kwargs
+    finally:
+        for task in running:
+            task.cancel()
+
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+@click.command()
+@click.option(
+    "--mirror_dir",
+    help="Local mirror directory",
+    type=click.Path(file_okay=False),
+    required=True,
+)
+@click.option(
+    "--endpoint",
+    "endpoints",
+    help="Endpoint to mirror",
+    type=click.Choice(["samples", "breeds", "chips", "variants"]),
+    multiple=True,
+    default=["samples", "breeds", "chips", "variants"],
+    show_default=True,
+)
+@click.option(
+    "--species",
+    help="Species of variants",
+    default="Sheep",
+    show_default=True,
+)
+@click.option(
+    "--assembly",
+    help="Assembly of variants",
+    default="OAR3",
+    show_default=True,
+)
+@click.option(
+    "--size",
+    help="Page size used to download data",
+    type=int,
+    default=1000,
+    show_default=True,
+)
+@click.option(
+    "--force",
+    help="Download everything again",
+    is_flag=True,
+    default=False,
+)
+def smarter_mirror(
+    mirror_dir: click.Path,
+    endpoints: Tuple[str],
+    species: str,
+    assembly: str,
+    size: int,
+    force: bool,
 ):
-    while True:
-        page = await queue.get()
+    """
+    Download the SMARTER API data in a local mirror or sync an existing
+    mirror. Endpoints can then read data from the mirror with use_mirror
+    """
+
+    mirror = Mirror(mirror_dir)
+
+    for endpoint in endpoints:
+        if endpoint == "samples":
+            api = SheepEndpoint()
+
+        elif endpoint == "breeds":
+            api = BreedEndpoint()
 
+        elif endpoint == "chips":
+            api = ChipEndpoint()
+
+        else:
+            api = VariantsEndpoint(species=species, assembly=assembly)
+
+        mirror.sync(api, size=size, force=force)
+
+    logger.info("Done!")
+
+
+async def write_update_alleles(
+    endpoint: VariantsEndpoint,
+    handle,
+    size: int = 50,
+    max_concurrency: int = 10,
+    queue_size: int = 10,
+    start_page: int = 1,
+    on_page: Callable[[int], None] = None,
+    retries: Optional[int] = None,
+    **kwargs,
+) -> int:
+    """
+    Download the variants of an endpoint and write the plink
+    ``--update-alleles`` records (TOP to FORWARD) to a text handle while
+    pages are downloaded. Pages are passed from the downloader to the
+    writer through a bounded queue, in page order. ``on_page`` is called
+    with the page number after each page is written. Returns the number
+    of written records.
+    """
+
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    async def download():
         try:
-            response = await variant_api.get_async_variants(
-                session, page=page, size=size, **kwargs
+            async with AsyncSmarterClient(pool_size=max_concurrency) as session:
+                async for response in paginate(
+                    endpoint,
+                    session,
+                    size=size,
+                    max_concurrency=max_concurrency,
+                    start_page=start_page,
+                    retries=retries,
+                    **kwargs,
+                ):
+                    locations = LocationTable.from_items(response["items"])
+                    await queue.put((response["page"], locations))
+
+        finally:
+            # tell the writer there are no more pages
+            await queue.put(None)
+
+    task = asyncio.create_task(download())
+    written = 0
+
+    while (record := await queue.get()) is not None:
+        page, locations = record
+        written += locations.write_update_alleles(handle)
+
+        if on_page:
+            on_page(page)
+
+    # raise download errors, if any
+    await task
+
+    return written
+
+
+@click.command()
+@click.option(
+    "--species",
+    help="Species to query",
+    default="Sheep",
+    show_default=True,
+)
+@click.option(
+    "--assembly",
+    help="Reference assembly",
+    default="OAR3",
+    show_default=True,
+)
+@click.option(
+    "--size",
+    help="Number of variants per page",
+    type=int,
+    default=50,
+    show_default=True,
+)
+@click.option(
+    "--max_concurrency",
+    help="Max concurrent requests",
+    type=int,
+    default=10,
+    show_default=True,
+)
+@click.option(
+    "--queue_size",
+    help="Max downloaded pages waiting to be written",
+    type=int,
+    default=10,
+    show_default=True,
+)
+@click.option(
+    "--retries",
+    help="Max attempts to download a page",
+    type=int,
+    default=5,
+    show_default=True,
+)
+@click.option(
+    "--output",
+    help="Output file (default: stdout)",
+    type=click.Path(dir_okay=False),
+    default=None,
+)
+@click.option(
+    "--resume",
+    help="Resume an interrupted conversion from the last written page",
+    is_flag=True,
+    default=False,
+)
+def top2forward(
+    species: str,
+    assembly: str,
+    size: int,
+    max_concurrency: int,
+    queue_size: int,
+    retries: int,
+    output: click.Path,
+    resume: bool,
+):
+    """
+    Collect variants from the SMARTER API variants endpoint and convert
+    them from TOP to FORWARD using plink --update-alleles format
+    """
+
+    if resume and output is None:
+        raise click.UsageError("--resume requires --output")
+
+    variant_api = VariantsEndpoint(species=species, assembly=assembly)
+
+    # the state of a conversion: the last written page and the output size
+    query = {"species": species, "assembly": assembly, "size": size}
+    state_file = pathlib.Path(f"{output}.state.json") if output else None
+    start_page = 1
+
+    if resume and state_file.exists():
+        with open(state_file) as handle:
+            state = json.load(handle)
+
+        if any(state[key] != value for key, value in query.items()):
+            raise click.UsageError(
+                f"Cannot resume {output}: it was created with {state}"
             )
 
-            # call my processing function
-            await async_processing_func(response)
+        start_page = state["last_page"] + 1
+        logger.info(f"Resuming {output} from page {start_page}")
 
-            logger.debug(f"Got {len(response['items'])} results for page {page}")
+        handle = open(output, "r+")
 
-        finally:
-            queue.task_done()
+        # remove records of a partially written page
+        handle.truncate(state["offset"])
+        handle.seek(state["offset"])
+
+    elif output:
+        handle = open(output, "w")
+
+    else:
+        handle = click.get_text_stream("stdout")
+
+    def on_page(page):
+        if state_file is None:
+            return
+
+        handle.flush()
+
+        tmp_file = state_file.with_suffix(".tmp")
+
+        with open(tmp_file, "w") as state_handle:
+            json.dump({**query, "last_page": page, "offset": handle.tell()}, state_handle)
+
+        tmp_file.replace(state_file)
+
+    try:
+        written = asyncio.run(
+            write_update_alleles(
+                variant_api,
+                handle,
+                size=size,
+                max_concurrency=max_concurrency,
+                queue_size=queue_size,
+                start_page=start_page,
+                on_page=on_page,
+                retries=retries,
+            )
+        )
+
+    finally:
+        if output:
+            handle.close()
+
+    logger.info(f"Written {written} records")
+    logger.info("Done!")
@@ -0,0 +1,489 @@
+import json
+import logging
+import collections.abc
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+import click
+import numpy as np
+
+from .samplesheet import SampleSheet
+
+if TYPE_CHECKING:
+    # imported where they are used, to keep the command line startup fast
+    import cyvcf2
+    import tsinfer
+    import zarr
+
+log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+# the missing allele in the ancestral state array (unknown for tsinfer)
+UNKNOWN_ALLELE = "N"
+
+# the VCF Zarr dimension names, like bio2zarr
+DIMENSIONS = {
+    "sample_id": ["samples"],
+    "contig_id": ["contigs"],
+    "contig_length": ["contigs"],
+    "variant_contig": ["variants"],
+    "variant_position": ["variants"],
+    "variant_id": ["variants"],
+    "variant_allele": ["variants", "alleles"],
+    "call_genotype": ["variants", "samples", "ploidy"],
+    "call_genotype_phased": ["variants", "samples"],
+}
+
+
+class VariantsBuffer:
+    """Collect a chunk of variants from cyvcf2 as numpy arrays"""
+
+    def __init__(self, num_samples: int, ploidy: int = 2):
+        self.num_samples = num_samples
+        self.ploidy = ploidy
+        self.clear()
+
+    def __len__(self):
+        return len(self.position)
+
+    def clear(self):
+        self.contig, self.position, self.ids = [], [], []
+        self.alleles, self.genotypes, self.phased = [], [], []
+
+    def append(self, variant: "cyvcf2.Variant", contig: int):
+        # genotypes as (samples, ploidy + 1): the last column is the phase
+        genotype = variant.genotype.array()
+
+        self.contig.append(contig)
+        self.position.append(variant.POS)
+        self.ids.append(variant.ID or ".")
+        self.alleles.append([variant.REF.upper()] + [a.upper() for a in variant.ALT])
+        self.genotypes.append(genotype[:, : self.ploidy])
+        self.phased.append(genotype[:, -1].astype(bool))
+
+    def alleles_array(self, width: int) -> np.ndarray:
+        alleles = np.full((len(self), width), "", dtype=object)
+
+        for i, row in enumerate(self.alleles):
+            alleles[i, : len(row)] = row
+
+        return alleles
+
+
+def create_array(group: "zarr.Group", name: str, shape, chunks, dtype, **kwargs):
+    import numcodecs
+
+    if dtype is object:
+        kwargs["object_codec"] = numcodecs.VLenUTF8()
+
+    array = group.create_dataset(name, shape=shape, chunks=chunks, dtype=dtype, **kwargs)
+    array.attrs["_ARRAY_DIMENSIONS"] = DIMENSIONS[name]
+
+    return array
+
+
+def vcf_to_vcz(
+    vcf_file: str,
+    output: str,
+    variants_chunk_size: int = 10_000,
+    samples_chunk_size: int = 10_000,
+    ploidy: int = 2,
+) -> "zarr.Group":
+    """
+    Convert a VCF file in a VCF Zarr store (with the fields required by
+    tsinfer.VariantData), reading the VCF once and writing the genotypes one
+    chunk of variants at a time. Alleles are stored in upper case, like
+    create_tstree does when reading a VCF.
+    """
+
+    import cyvcf2
+    import zarr
+
+    vcf = cyvcf2.VCF(vcf_file)
+    num_samples = len(vcf.samples)
+
+    root = zarr.open_group(output, mode="w-")
+    root.attrs["source"] = "tskitetude"
+    root.attrs["vcf_zarr_version"] = "0.2"
+
+    create_array(
+        root, "sample_id", (num_samples,), (samples_chunk_size,), object
+    )[:] = np.array(vcf.samples, dtype=object)
+
+    contigs = list(vcf.seqnames)
+    create_array(root, "contig_id", (len(contigs),), (len(contigs) or 1,), object)[
+        :
+    ] = np.array(contigs, dtype=object)
+
+    try:
+        create_array(
+            root, "contig_length", (len(contigs),), (len(contigs) or 1,), np.int64
+        )[:] = np.array(vcf.seqlens, dtype=np.int64)
+
+    except AttributeError:
+        # cyvcf2 raises before the array is created
+        logger.warning(f"No contig lengths in {vcf_file} header")
+
+    contig_index = {contig: i for i, contig in enumerate(contigs)}
+
+    arrays = {
+        "variant_contig": create_array(
+            root, "variant_contig", (0,), (variants_chunk_size,), np.int16
+        ),
+        "variant_position": create_array(
+            root, "variant_position", (0,), (variants_chunk_size,), np.int32
+        ),
+        "variant_id": create_array(
+            root, "variant_id", (0,), (variants_chunk_size,), object
+        ),
+        "variant_allele": create_array(
+            root, "variant_allele", (0, 2), (variants_chunk_size, 2), object
+        ),
+        "call_genotype": create_array(
+            root,
+            "call_genotype",
+            (0, num_samples, ploidy),
+            (variants_chunk_size, samples_chunk_size, ploidy),
+            np.int8,
+            fill_value=-1,
+        ),
+        "call_genotype_phased": create_array(
+            root,
+            "call_genotype_phased",
+            (0, num_samples),
+            (variants_chunk_size, samples_chunk_size),
+            bool,
+        ),
+    }
+
+    buffer = VariantsBuffer(num_samples, ploidy)
+    num_variants = 0
+
+    def flush():
+        width = max(len(row) for row in buffer.alleles)
+        allele_array = arrays["variant_allele"]
+
+        if width > allele_array.shape[1]:
+            allele_array.resize(allele_array.shape[0], width)
+
+        arrays["variant_contig"].append(np.array(buffer.contig, dtype=np.int16))
+        arrays["variant_position"].append(np.array(buffer.position, dtype=np.int32))
+        arrays["variant_id"].append(np.array(buffer.ids, dtype=object))
+        allele_array.append(buffer.alleles_array(allele_array.shape[1]))
+        arrays["call_genotype"].append(np.stack(buffer.genotypes).astype(np.int8))
+        arrays["call_genotype_phased"].append(np.stack(buffer.phased))
+
+        buffer.clear()
+
+    for variant in vcf:
+        if variant.CHROM not in contig_index:
+            # a contig not declared in header
+            contig_index[variant.CHROM] = len(contig_index)
+
+        buffer.append(variant, contig_index[variant.CHROM])
+        num_variants += 1
+
+        if len(buffer) == variants_chunk_size:
+            flush()
+            logger.info(f"Converted {num_variants} variants")
+
+    if len(buffer):
+        flush()
+
+    vcf.close()
+
+    # there could be contigs not declared in VCF header
+    if len(contig_index) > len(contigs):
+        contigs = list(contig_index)
+        root["contig_id"].resize(len(contigs))
+        root["contig_id"][:] = np.array(contigs, dtype=object)
+
+        if "contig_length" in root:
+            del root["contig_length"]
+
+    logger.info(f"Written {num_variants} variants for {num_samples} samples")
+
+    return root
+
+
+class OverlayStore(collections.abc.MutableMapping):
+    """
+    A zarr store which reads from a (read-only) base store and writes in
+    memory: used to add per-run arrays (metadata, masks) to a VCF Zarr store
+    without copying or modifying the genotypes.
+    """
+
+    def __init__(self, base: collections.abc.Mapping):
+        self.base = base
+        self.overlay = {}
+
+    def __getitem__(self, key):
+        if key in self.overlay:
+            return self.overlay[key]
+
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self.overlay[key] = value
+
+    def __delitem__(self, key):
+        del self.overlay[key]
+
+    def __contains__(self, key):
+        return key in self.overlay or key in self.base
+
+    def __iter__(self):
+        yield from self.overlay
+        yield from (key for key in self.base if key not in self.overlay)
+
+    def __len__(self):
+        return len(set(self.overlay) | set(self.base))
+
+
+def get_ancestral_states(
+    root: "zarr.Group",
+    ancestors_alleles: Dict[Tuple[str, int], Union[int, str]],
+    ancestral_method: str,
+) -> np.ndarray:
+    """
+    Return the ancestral allele (as a string) of every variant in the store,
+    with 'N' (unknown for tsinfer) where the ancestral allele is missing.
+    Alleles are processed one chunk of variants at a time.
+    """
+
+    alleles_array = root["variant_allele"]
+    genotypes_array = root["call_genotype"]
+    contig_ids = root["contig_id"][:]
+
+    ancestral_states = np.full(alleles_array.shape[0], UNKNOWN_ALLELE, dtype=object)
+    chunk_size = genotypes_array.chunks[0]
+
+    for start in range(0, alleles_array.shape[0], chunk_size):
+        end = min(start + chunk_size, alleles_array.shape[0])
+        alleles = alleles_array[start:end]
+        rows = np.arange(end - start)
+
+        if ancestral_method == "reference":
+            ancestral_states[start:end] = alleles[:, 0]
+
+        elif ancestral_method == "major":
+            genotypes = genotypes_array[start:end].reshape(end - start, -1)
+
+            # count alleles for each variant (missing genotypes are ignored),
+            # argmax returns the first allele (the reference) in case of a tie
+            counts = np.stack(
+                [
+                    np.sum(genotypes == allele, axis=1)
+                    for allele in range(alleles.shape[1])
+                ],
+                axis=1,
+            )
+            ancestral_states[start:end] = alleles[rows, np.argmax(counts, axis=1)]
+
+        elif ancestral_method in ("estsfs", "ensembl"):
+            contigs = contig_ids[root["variant_contig"][start:end]]
+            positions = root["variant_position"][start:end]
+
+            for i, key in enumerate(zip(contigs, positions.tolist())):
+                ancestral_allele = ancestors_alleles.get(key)
+
+                if ancestral_allele is None:
+                    continue
+
+                if ancestral_method == "estsfs":
+                    # an allele index
+                    index = int(ancestral_allele)
+
+                    if not 0 <= index < alleles.shape[1]:
+                        continue
+
+                    ancestral_allele = alleles[i, index]
+
+                if ancestral_allele and ancestral_allele in alleles[i]:
+                    ancestral_states[start + i] = ancestral_allele
+
+        else:
+            raise NotImplementedError(
+                f"Ancestral method {ancestral_method} not implemented"
+            )
+
+    return ancestral_states
+
+
+def load_variant_data(
+    vcz_path: str,
+    sample_sheet: SampleSheet,
+    ancestors_alleles: Dict[Tuple[str, int], Union[int, str]],
+    ancestral_method: str = "estsfs",
+    site_mask: Optional[np.ndarray] = None,
+) -> "tsinfer.VariantData":
+    """
+    Create a tsinfer.VariantData from a VCF Zarr store for the samples in the
+    sample sheet. Populations and individuals metadata are written in memory,
+    so the same store could be used by different runs. Sites are masked with
+    site_mask (see siteqc.qc_vcz), if provided, otherwise samples are checked
+    to be phased and duplicated positions are masked (only the first one is
+    used). Sites with alleles not in ALLELE_CHARS are always masked, like
+    add_diploid_sites does for VCF files. Individuals follow the store (VCF)
+    order.
+    """
+
+    import numcodecs
+    import tsinfer
+    import zarr
+
+    # siteqc imports this module
+    from .siteqc import ALLELE_CHARS, allele_qc
+
+    root = zarr.open_group(OverlayStore(zarr.DirectoryStore(vcz_path)), mode="r+")
+
+    vcz_samples = root["sample_id"][:]
+    sample_index = {sample: i for i, sample in enumerate(vcz_samples)}
+
+    missing = [
+        sample_id
+        for sample_id in sample_sheet.sample_ids
+        if sample_id not in sample_index
+    ]
+
+    if missing:
+        raise ValueError(
+            f"Samples {missing[:10]} found in CSV but not in {vcz_path}"
+        )
+
+    # the VCF samples not in the sample sheet are masked
+    focal = np.array([sample_index[sample] for sample in sample_sheet.sample_ids])
+    sample_mask = np.ones(len(vcz_samples), dtype=bool)
+    sample_mask[focal] = False
+
+    # populations in sample sheet order, individuals in VCF order
+    population = np.full(len(vcz_samples), -1, dtype=np.int32)
+    population[focal] = sample_sheet.population_index
+
+    root.create_dataset(
+        "populations_metadata",
+        data=np.array(
+            [json.dumps({"breed": breed}).encode() for breed in sample_sheet.populations],
+            dtype=object,
+        ),
+        object_codec=numcodecs.VLenBytes(),
+    )
+    root.create_dataset(
+        "individuals_metadata",
+        data=np.array(
+            [json.dumps({"sample_id": sample}).encode() for sample in vcz_samples],
+            dtype=object,
+        ),
+        object_codec=numcodecs.VLenBytes(),
+    )
+
+    if site_mask is None:
+        check_phased(root, ~sample_mask)
+
+        # skip duplicated positions, like add_diploid_sites does
+        positions = root["variant_position"][:]
+        site_mask = np.zeros(len(positions), dtype=bool)
+        site_mask[1:] = positions[1:] == positions[:-1]
+
+    elif len(site_mask) != root["variant_position"].shape[0]:
+        raise ValueError(
+            f"Site mask has {len(site_mask)} values for "
+            f"{root['variant_position'].shape[0]} variants"
+        )
+
+    # alleles are stored in upper case by vcf_to_zarr
+    _, valid = allele_qc(root["variant_allele"][:].tolist(), ALLELE_CHARS)
+    site_mask = site_mask | ~valid
+
+    if np.any(site_mask):
+        logger.warning(f"Ignoring {np.sum(site_mask)} masked sites")
+
+    ancestral_states = get_ancestral_states(root, ancestors_alleles, ancestral_method)
+
+    return tsinfer.VariantData(
+        root,
+        ancestral_states[~site_mask],
+        sample_mask=sample_mask,
+        site_mask=site_mask,
+        individuals_population=population[~sample_mask],
+    )
+
+
+def check_phased(root: "zarr.Group", selected: Optional[np.ndarray] = None):
+    """Raise a ValueError if any selected sample is unphased"""
+
+    phased = root["call_genotype_phased"]
+
+    for start in range(0, phased.shape[0], phased.chunks[0]):
+        chunk = phased[start : start + phased.chunks[0]]
+
+        if selected is not None:
+            chunk = chunk[:, selected]
+
+        unphased = np.flatnonzero(~np.all(chunk, axis=1))
+
+        if len(unphased):
+            position = root["variant_position"][start + unphased[0]]
+            raise ValueError("Unphased genotypes for variant at position", position)
+
+
+def get_contigs(vcz_path: str) -> List[str]:
+    """Return the contigs with variants in a VCF Zarr store"""
+
+    import zarr
+
+    root = zarr.open_group(vcz_path, mode="r")
+    contig_ids = root["contig_id"][:]
+
+    return [contig_ids[i] for i in np.unique(root["variant_contig"][:])]
+
+
+@click.command()
+@click.option(
+    "--vcf",
+    "vcf_file",
+    help="Input VCF file",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+)
+@click.option(
+    "--output",
+    help="Output VCF Zarr store (.vcz)",
+    type=click.Path(exists=False),
+    required=True,
+)
+@click.option(
+    "--variants_chunk_size",
+    help="Number of variants in a chunk",
+    type=int,
+    default=10_000,
+    show_default=True,
+)
+@click.option(
+    "--samples_chunk_size",
+    help="Number of samples in a chunk",
+    type=int,
+    default=10_000,
+    show_default=True,
+)
+def vcf_to_zarr(
+    vcf_file: click.Path,
+    output: click.Path,
+    variants_chunk_size: int,
+    samples_chunk_size: int,
+):
+    """
+    Convert a phased VCF file in a VCF Zarr store, which could be used as
+    input of create_tstree (--vcz) many times without parsing the VCF again.
+    """
+
+    vcf_to_vcz(
+        vcf_file,
+        output,
+        variants_chunk_size=variants_chunk_size,
+        samples_chunk_size=samples_chunk_size,
+    )
+
+    logger.info(f"VCF Zarr store written to {output}")